@@ -1,15 +1,38 @@
 # agent.py
+import asyncio
 import getpass
 import os
+import statistics
+import threading
+import time
+import urllib.request
+from collections import deque
 import dotenv
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.messages import HumanMessage, AIMessage
 import json
-from typing import List  
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple, Union
+
+from metrics import llm_requests, llm_tokens
 
 dotenv.load_dotenv()
 
+# "gemini", or "http" for a stub server at LLM_HTTP_URL. MODEL_NAME is part of
+# the plan cache key, so give a stub its own LLM_MODEL.
+LLM_PROVIDER = os.environ.get("LLM_PROVIDER", "gemini")
+MODEL_NAME = os.environ.get("LLM_MODEL", "gemini-2.0-flash")
+LLM_HTTP_URL = os.environ.get("LLM_HTTP_URL", "")
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 8))
+LLM_TIMEOUT_SECONDS = float(os.environ.get("LLM_TIMEOUT_SECONDS", 30))
+LLM_HEDGE_ENABLED = os.environ.get("LLM_HEDGE_ENABLED", "").lower() in ("1", "true", "yes")
+# Successful calls needed before the p95 latency is trusted as a hedge delay.
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", 20))
+LLM_LATENCY_WINDOW = 200
+# Bump whenever the schema, guided prompt or few-shot examples change so that
+# plans cached under the old prompt are no longer reused.
+PROMPT_VERSION = "2"
+
 schema = {
     "name": "data_processing_plan",
     "description": "A comprehensive plan containing a sequence of data processing operations.",
@@ -105,6 +128,10 @@ schema = {
                     "required": ["operation_type", "parameters"],
                 },
             },
+            "limit": {
+                "type": ["integer", "null"],
+                "description": "Optional: the number of result rows that answer the request, when it only asks for the top or bottom N (e.g. 1 for 'which song is the most popular'). Use null when every row is wanted.",
+            },
         },
         "required": ["operations"],
     },
@@ -158,228 +185,469 @@ IMPORTANT RULES FOR PLAN GENERATION:
 6. Use 'output_data_key' to name the result of an operation so subsequent operations can use it.
 7. 'read_csv' typically does not need an 'input_data_key'.
 8. 'display_data' typically does not need an 'output_data_key'.
+9. If the request only asks for the top or bottom N rows (e.g. "which song is the most popular", "the 5 cheapest products"), set the top-level 'limit' to N next to 'operations'. Leave it out when all rows are wanted.
 
 Here are examples of complete operation sequences for different queries given specific contexts:
 """
 
 
-def llm_agent(user_query_text: str, filename: str, available_columns: List[str]):
-    if not os.environ.get("GOOGLE_API_KEY"):
-        os.environ["GOOGLE_API_KEY"] = getpass.getpass("Enter your Google API key")
-
-    llm_context_input = f"""
-User Request: {user_query_text}
-Target File: {filename}
-Available Columns: {', '.join(available_columns)}
-"""
-    prompt_messages = [
-        ("system", guided_prompt),
-        # --- Example 1: Find Most Popular Song (unchanged for consistency) ---
-        HumanMessage(
-            content="""
+few_shot_messages = [
+    # --- Example 1: Find Most Popular Song (unchanged for consistency) ---
+    HumanMessage(
+        content="""
 User Request: Which song has the most popularity?
 Target File: music_data.csv
 Available Columns: Song, Artist, popularity, duration_ms, genre
 """
-        ),
-        AIMessage(
-            content=json.dumps(
-                {
-                    "operations": [
-                        {
-                            "operation_type": "read_csv",
-                            "parameters": {"filepath": "music_data.csv"},
-                            "output_data_key": "raw_music_data",
-                            "description": "Load the CSV data from 'music_data.csv'.",
-                        },
-                        {
-                            "operation_type": "sort_column",
-                            "input_data_key": "raw_music_data",
-                            "output_data_key": "sorted_music",
-                            "parameters": {
-                                "column": "popularity",
-                                "order": "descending",
-                            },
-                            "description": "Sort songs by the 'popularity' column in descending order.",
-                        },
-                        {
-                            "operation_type": "display_data",
-                            "input_data_key": "sorted_music",
-                            "output_data_key": None,
-                            "parameters": {"label": "Most Popular Songs"},
-                            "description": "Display the sorted songs to show the most popular ones.",
+    ),
+    AIMessage(
+        content=json.dumps(
+            {
+                "operations": [
+                    {
+                        "operation_type": "read_csv",
+                        "parameters": {"filepath": "music_data.csv"},
+                        "output_data_key": "raw_music_data",
+                        "description": "Load the CSV data from 'music_data.csv'.",
+                    },
+                    {
+                        "operation_type": "sort_column",
+                        "input_data_key": "raw_music_data",
+                        "output_data_key": "sorted_music",
+                        "parameters": {
+                            "column": "popularity",
+                            "order": "descending",
                         },
-                    ]
-                }
-            )
-        ),
-        # --- Example 2: Group and Aggregate (NEW COMPLEX EXAMPLE) ---
-        HumanMessage(
-            content="""
+                        "description": "Sort songs by the 'popularity' column in descending order.",
+                    },
+                    {
+                        "operation_type": "display_data",
+                        "input_data_key": "sorted_music",
+                        "output_data_key": None,
+                        "parameters": {"label": "Most Popular Songs"},
+                        "description": "Display the sorted songs to show the most popular ones.",
+                    },
+                ],
+                "limit": 1,
+            }
+        )
+    ),
+    # --- Example 2: Group and Aggregate (NEW COMPLEX EXAMPLE) ---
+    HumanMessage(
+        content="""
 User Request: What is the total sales and average quantity for each product category?
 Target File: sales_data.csv
 Available Columns: transaction_id, product_name, category, sales_amount, quantity, date
 """
-        ),
-        AIMessage(
-            content=json.dumps(
-                {
-                    "operations": [
-                        {
-                            "operation_type": "read_csv",
-                            "parameters": {"filepath": "sales_data.csv"},
-                            "output_data_key": "sales_df",
-                            "description": "Load sales data.",
-                        },
-                        {
-                            "operation_type": "group_and_aggregate",
-                            "input_data_key": "sales_df",
-                            "output_data_key": "category_summary",
-                            "parameters": {
-                                "by_columns": ["category"],
-                                "aggregations": [
-                                    {
-                                        "column": "sales_amount",
-                                        "function": "sum",
-                                        "output_column_name": "Total Sales",
-                                    },
-                                    {
-                                        "column": "quantity",
-                                        "function": "mean",
-                                        "output_column_name": "Average Quantity",
-                                    },
-                                ],
-                            },
-                            "description": "Group by category and calculate total sales and average quantity.",
-                        },
-                        {
-                            "operation_type": "display_data",
-                            "input_data_key": "category_summary",
-                            "output_data_key": None,
-                            "parameters": {"label": "Sales Summary by Category"},
-                            "description": "Display the aggregated summary.",
+    ),
+    AIMessage(
+        content=json.dumps(
+            {
+                "operations": [
+                    {
+                        "operation_type": "read_csv",
+                        "parameters": {"filepath": "sales_data.csv"},
+                        "output_data_key": "sales_df",
+                        "description": "Load sales data.",
+                    },
+                    {
+                        "operation_type": "group_and_aggregate",
+                        "input_data_key": "sales_df",
+                        "output_data_key": "category_summary",
+                        "parameters": {
+                            "by_columns": ["category"],
+                            "aggregations": [
+                                {
+                                    "column": "sales_amount",
+                                    "function": "sum",
+                                    "output_column_name": "Total Sales",
+                                },
+                                {
+                                    "column": "quantity",
+                                    "function": "mean",
+                                    "output_column_name": "Average Quantity",
+                                },
+                            ],
                         },
-                    ]
-                }
-            )
-        ),
-        # --- Example 3: Drop and Rename Columns (NEW EXAMPLE) ---
-        HumanMessage(
-            content="""
+                        "description": "Group by category and calculate total sales and average quantity.",
+                    },
+                    {
+                        "operation_type": "display_data",
+                        "input_data_key": "category_summary",
+                        "output_data_key": None,
+                        "parameters": {"label": "Sales Summary by Category"},
+                        "description": "Display the aggregated summary.",
+                    },
+                ]
+            }
+        )
+    ),
+    # --- Example 3: Drop and Rename Columns (NEW EXAMPLE) ---
+    HumanMessage(
+        content="""
 User Request: I only need product name and its price. Also, rename 'price' to 'unit_price'.
 Target File: products.csv
 Available Columns: product_id, name, description, price, category, stock_count
 """
-        ),
-        AIMessage(
-            content=json.dumps(
-                {
-                    "operations": [
-                        {
-                            "operation_type": "read_csv",
-                            "parameters": {"filepath": "products.csv"},
-                            "output_data_key": "product_data",
-                            "description": "Load product data.",
-                        },
-                        {
-                            "operation_type": "drop_columns",
-                            "input_data_key": "product_data",
-                            "output_data_key": "relevant_products",
-                            "parameters": {
-                                "columns_to_drop": [
-                                    "product_id",
-                                    "description",
-                                    "category",
-                                    "stock_count",
-                                ]
-                            },
-                            "description": "Drop irrelevant columns.",
-                        },
-                        {
-                            "operation_type": "rename_column",
-                            "input_data_key": "relevant_products",
-                            "output_data_key": "final_products",
-                            "parameters": {
-                                "old_name": "price",
-                                "new_name": "unit_price",
-                            },
-                            "description": "Rename 'price' column to 'unit_price'.",
+    ),
+    AIMessage(
+        content=json.dumps(
+            {
+                "operations": [
+                    {
+                        "operation_type": "read_csv",
+                        "parameters": {"filepath": "products.csv"},
+                        "output_data_key": "product_data",
+                        "description": "Load product data.",
+                    },
+                    {
+                        "operation_type": "drop_columns",
+                        "input_data_key": "product_data",
+                        "output_data_key": "relevant_products",
+                        "parameters": {
+                            "columns_to_drop": [
+                                "product_id",
+                                "description",
+                                "category",
+                                "stock_count",
+                            ]
                         },
-                        {
-                            "operation_type": "display_data",
-                            "input_data_key": "final_products",
-                            "output_data_key": None,
-                            "parameters": {"label": "Product Names and Unit Prices"},
-                            "description": "Display the final product data.",
+                        "description": "Drop irrelevant columns.",
+                    },
+                    {
+                        "operation_type": "rename_column",
+                        "input_data_key": "relevant_products",
+                        "output_data_key": "final_products",
+                        "parameters": {
+                            "old_name": "price",
+                            "new_name": "unit_price",
                         },
-                    ]
-                }
-            )
-        ),
-        # --- Example 4: Merge DataFrames (NEW COMPLEX EXAMPLE) ---
-        HumanMessage(
-            content="""
+                        "description": "Rename 'price' column to 'unit_price'.",
+                    },
+                    {
+                        "operation_type": "display_data",
+                        "input_data_key": "final_products",
+                        "output_data_key": None,
+                        "parameters": {"label": "Product Names and Unit Prices"},
+                        "description": "Display the final product data.",
+                    },
+                ]
+            }
+        )
+    ),
+    # --- Example 4: Merge DataFrames (NEW COMPLEX EXAMPLE) ---
+    HumanMessage(
+        content="""
 User Request: Combine sales data from 'daily_sales.csv' with product details from 'product_info.csv' using 'product_id'. Show total sales amounts for the combined data.
 Target File: daily_sales.csv AND product_info.csv
 Available Columns:
   daily_sales.csv: date, product_id, amount, quantity
   product_info.csv: product_id, product_name, category
 """
-        ),
-        AIMessage(
-            content=json.dumps(
-                {
-                    "operations": [
-                        {
-                            "operation_type": "read_csv",
-                            "parameters": {"filepath": "daily_sales.csv"},
-                            "output_data_key": "daily_sales_data",
-                            "description": "Load daily sales data.",
-                        },
-                        {
-                            "operation_type": "read_csv",
-                            "parameters": {"filepath": "product_info.csv"},
-                            "output_data_key": "product_info_data",
-                            "description": "Load product information.",
-                        },
-                        {
-                            "operation_type": "merge_dataframes",
-                            "input_data_key": "daily_sales_data",  # Left DataFrame
-                            "output_data_key": "merged_sales_products",
-                            "parameters": {
-                                "right_data_key": "product_info_data",  # Right DataFrame
-                                "on_column": "product_id",
-                                "how": "inner",
-                            },
-                            "description": "Merge sales and product data on 'product_id'.",
-                        },
-                        {
-                            "operation_type": "calculate_sum",
-                            "input_data_key": "merged_sales_products",
-                            "output_data_key": "total_combined_sales",
-                            "parameters": {"column": "amount"},
-                            "description": "Calculate the total sales from the combined data.",
-                        },
-                        {
-                            "operation_type": "display_data",
-                            "input_data_key": "total_combined_sales",
-                            "output_data_key": None,
-                            "parameters": {"label": "Total Combined Sales Amount"},
-                            "description": "Display the total sales amount.",
+    ),
+    AIMessage(
+        content=json.dumps(
+            {
+                "operations": [
+                    {
+                        "operation_type": "read_csv",
+                        "parameters": {"filepath": "daily_sales.csv"},
+                        "output_data_key": "daily_sales_data",
+                        "description": "Load daily sales data.",
+                    },
+                    {
+                        "operation_type": "read_csv",
+                        "parameters": {"filepath": "product_info.csv"},
+                        "output_data_key": "product_info_data",
+                        "description": "Load product information.",
+                    },
+                    {
+                        "operation_type": "merge_dataframes",
+                        "input_data_key": "daily_sales_data",  # Left DataFrame
+                        "output_data_key": "merged_sales_products",
+                        "parameters": {
+                            "right_data_key": "product_info_data",  # Right DataFrame
+                            "on_column": "product_id",
+                            "how": "inner",
                         },
-                    ]
-                }
+                        "description": "Merge sales and product data on 'product_id'.",
+                    },
+                    {
+                        "operation_type": "calculate_sum",
+                        "input_data_key": "merged_sales_products",
+                        "output_data_key": "total_combined_sales",
+                        "parameters": {"column": "amount"},
+                        "description": "Calculate the total sales from the combined data.",
+                    },
+                    {
+                        "operation_type": "display_data",
+                        "input_data_key": "total_combined_sales",
+                        "output_data_key": None,
+                        "parameters": {"label": "Total Combined Sales Amount"},
+                        "description": "Display the total sales amount.",
+                    },
+                ]
+            }
+        )
+    ),
+]
+
+# Built once per process; only the final human message varies per call.
+plan_prompt = ChatPromptTemplate.from_messages(
+    [("system", guided_prompt), *few_shot_messages, ("human", "{input}")]
+)
+
+
+class LLMTimeoutError(TimeoutError):
+    pass
+
+
+class PlanProvider:
+    """Turns a request context into a plan. Subclasses talk to one backend."""
+
+    async def aplan(self, context_input: str) -> Tuple[Dict[str, Any], Dict[str, int]]:
+        """Returns the parsed plan and the token usage of the call."""
+        raise NotImplementedError
+
+
+class GeminiPlanProvider(PlanProvider):
+    def __init__(self, model_name: str = MODEL_NAME):
+        self.model_name = model_name
+        self._chain = None
+        self._lock = threading.Lock()
+
+    @property
+    def chain(self):
+        with self._lock:
+            if self._chain is None:
+                if not os.environ.get("GOOGLE_API_KEY"):
+                    os.environ["GOOGLE_API_KEY"] = getpass.getpass("Enter your Google API key")
+                llm = ChatGoogleGenerativeAI(model=self.model_name, temperature=0.0)
+                self._chain = plan_prompt | llm.with_structured_output(schema, include_raw=True)
+            return self._chain
+
+    async def aplan(self, context_input: str) -> Tuple[Dict[str, Any], Dict[str, int]]:
+        response = await self.chain.ainvoke({"input": context_input})
+        usage = getattr(response["raw"], "usage_metadata", None) or {}
+        if response.get("parsing_error") is not None:
+            raise response["parsing_error"]
+        return response["parsed"], usage
+
+
+class HttpPlanProvider(PlanProvider):
+    """
+    Posts {"model", "input", "schema"} as JSON to LLM_HTTP_URL and expects the
+    plan back as the JSON body, optionally with a "usage" object. Meant for a
+    local stub server standing in for Gemini in tests and load benchmarks.
+    """
+
+    def __init__(self, url: str = LLM_HTTP_URL, model_name: str = MODEL_NAME):
+        if not url:
+            raise ValueError("LLM_PROVIDER=http needs LLM_HTTP_URL.")
+        self.url = url
+        self.model_name = model_name
+
+    def _post(self, context_input: str) -> Dict[str, Any]:
+        body = json.dumps(
+            {"model": self.model_name, "input": context_input, "schema": schema}
+        ).encode("utf-8")
+        request = urllib.request.Request(
+            self.url, data=body, headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=LLM_TIMEOUT_SECONDS) as response:
+            return json.loads(response.read())
+
+    async def aplan(self, context_input: str) -> Tuple[Dict[str, Any], Dict[str, int]]:
+        plan = await asyncio.to_thread(self._post, context_input)
+        return plan, plan.pop("usage", None) or {}
+
+
+PROVIDERS: Dict[str, Callable[[], PlanProvider]] = {
+    "gemini": GeminiPlanProvider,
+    "http": HttpPlanProvider,
+}
+
+
+class LLMClient:
+    """
+    Process-wide planning client. Calls run as coroutines on one background
+    event loop, so every thread of the process shares the concurrency limit.
+
+    Each call gets LLM_TIMEOUT_SECONDS. With LLM_HEDGE_ENABLED, a call still
+    running after the recent p95 latency gets a duplicate request, and the
+    first answer wins. Duplicates are only sent while concurrency slots are
+    free, so hedging never queues behind real traffic.
+    """
+
+    def __init__(
+        self,
+        provider: Optional[PlanProvider] = None,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        timeout_seconds: float = LLM_TIMEOUT_SECONDS,
+        hedge_enabled: bool = LLM_HEDGE_ENABLED,
+        hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+    ):
+        self._provider = provider
+        self.max_concurrency = max_concurrency
+        self.timeout_seconds = timeout_seconds
+        self.hedge_enabled = hedge_enabled
+        self.hedge_min_samples = hedge_min_samples
+        self._latencies: Deque[float] = deque(maxlen=LLM_LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_pid: Optional[int] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    @property
+    def provider(self) -> PlanProvider:
+        with self._lock:
+            if self._provider is None:
+                if LLM_PROVIDER not in PROVIDERS:
+                    raise ValueError(
+                        f"Unsupported LLM_PROVIDER: {LLM_PROVIDER}. Use one of {', '.join(PROVIDERS)}."
+                    )
+                self._provider = PROVIDERS[LLM_PROVIDER]()
+            return self._provider
+
+    @provider.setter
+    def provider(self, provider: PlanProvider):
+        with self._lock:
+            self._provider = provider
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            # A forked worker process inherits the attribute but not the thread.
+            if self._loop is None or self._loop_pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-client", daemon=True).start()
+                self._loop = loop
+                self._loop_pid = os.getpid()
+                self._semaphore = None
+            return self._loop
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds before a hedged request is sent, or None when hedging is off."""
+        latencies = list(self._latencies)
+        if not self.hedge_enabled or len(latencies) < self.hedge_min_samples:
+            return None
+        return statistics.quantiles(latencies, n=20)[-1]
+
+    async def _attempt(self, context_input: str) -> Dict[str, Any]:
+        async with self._semaphore:
+            self.in_flight += 1
+            started = time.perf_counter()
+            try:
+                llm_requests.inc(model=MODEL_NAME)
+                plan, usage = await self.provider.aplan(context_input)
+            finally:
+                self.in_flight -= 1
+        self._latencies.append(time.perf_counter() - started)
+        for kind in ["input_tokens", "output_tokens"]:
+            if usage.get(kind):
+                llm_tokens.inc(usage[kind], model=MODEL_NAME, kind=kind)
+        return plan
+
+    async def _hedged(self, context_input: str) -> Dict[str, Any]:
+        primary = asyncio.ensure_future(self._attempt(context_input))
+        delay = self.hedge_delay()
+        if delay is None:
+            return await primary
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and not self._semaphore.locked():
+                tasks.add(asyncio.ensure_future(self._attempt(context_input)))
+                self.hedged += 1
+            while True:
+                done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                # Inspect every finished task so no exception goes unretrieved.
+                failures = [task.exception() for task in done]
+                for task, failure in zip(done, failures):
+                    if failure is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                if not pending:
+                    raise failures[0]
+                tasks = pending
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def aplan(self, context_input: str) -> Dict[str, Any]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.calls += 1
+        try:
+            return await asyncio.wait_for(self._hedged(context_input), self.timeout_seconds)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise LLMTimeoutError(
+                f"The planning model did not answer within {self.timeout_seconds:g} seconds."
             )
-        ),
-        HumanMessage(content=llm_context_input),
-    ]
+        except Exception:
+            self.errors += 1
+            raise
+
+    def plan(self, context_input: str) -> Dict[str, Any]:
+        """Blocking wrapper for worker threads; runs aplan on the client's loop."""
+        return asyncio.run_coroutine_threadsafe(
+            self.aplan(context_input), self._get_loop()
+        ).result()
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = list(self._latencies)
+        return {
+            "provider": LLM_PROVIDER if self._provider is None else type(self._provider).__name__,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "p95_latency_seconds": (
+                statistics.quantiles(latencies, n=20)[-1] if len(latencies) >= 2 else 0.0
+            ),
+        }
 
-    prompt = ChatPromptTemplate.from_messages(prompt_messages)
-    llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0.0)
 
-    structured_llm = llm.with_structured_output(schema)
-    chain = prompt | structured_llm
+llm_client = LLMClient()
+
+
+def llm_context(
+    user_query_text: str,
+    filename: str,
+    available_columns: Union[List[str], Dict[str, List[str]]],
+    feedback: Optional[str] = None,
+) -> str:
+    """available_columns maps each file to its columns when several are uploaded."""
+    if isinstance(available_columns, dict):
+        columns = "".join(
+            f"\n  {name}: {', '.join(file_columns)}" for name, file_columns in available_columns.items()
+        )
+    else:
+        columns = f" {', '.join(available_columns)}"
+    context = f"""
+User Request: {user_query_text}
+Target File: {filename}
+Available Columns:{columns}
+"""
+    if feedback:
+        context += f"Your previous plan for this request was rejected: {feedback}\nReturn a corrected plan.\n"
+    return context
 
-    response = chain.invoke({"input": llm_context_input})
 
-    return response
+def llm_agent(
+    user_query_text: str,
+    filename: str,
+    available_columns: Union[List[str], Dict[str, List[str]]],
+    feedback: Optional[str] = None,
+):
+    return llm_client.plan(llm_context(user_query_text, filename, available_columns, feedback))
@@ -0,0 +1,129 @@
+# benchmark.py
+"""
+Ad-hoc benchmarks for the data path. Run from the backend directory, e.g.
+
+    python benchmark.py columnar data.csv --columns price,quantity
+    python benchmark.py parallel data.csv --workers 1,2,4,8,16
+    python benchmark.py formats data.csv
+"""
+import argparse
+import statistics
+import tempfile
+import time
+from typing import Callable, List
+
+import pandas as pd
+from fastapi.responses import JSONResponse
+
+from columnar_store import ColumnarStore
+from compaction import expand_frame
+from parallel_csv import read_csv_parallel
+from serialization import arrow_available, arrow_chunks, columns_json_chunks, ndjson_chunks
+
+
+def _time(func: Callable[[], object], repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def _report(label: str, timings: List[float]):
+    print(
+        f"{label:<32} median {statistics.median(timings) * 1000:10.1f} ms"
+        f"   min {min(timings) * 1000:10.1f} ms   ({len(timings)} runs)"
+    )
+
+
+def bench_columnar(args: argparse.Namespace):
+    columns = args.columns.split(",") if args.columns else None
+    header = list(pd.read_csv(args.csv, nrows=0).columns)
+    with tempfile.TemporaryDirectory() as root:
+        store = ColumnarStore(root=root)
+        store.write("benchmark", header, pd.read_csv(args.csv))
+
+        def cold():
+            df = pd.read_csv(args.csv, usecols=columns)
+            df.select_dtypes("number").sum()
+
+        def warm():
+            df = store.load("benchmark", columns)
+            # Summing forces the mapped pages to be read.
+            df.select_dtypes("number").sum()
+
+        _report("cold CSV parse", _time(cold, args.repeat))
+        _report("warm columnar load", _time(warm, args.repeat))
+        print(f"columnar copy: {store.stats()['bytes']} bytes")
+
+
+def bench_parallel(args: argparse.Namespace):
+    baseline = _time(lambda: pd.read_csv(args.csv), args.repeat)
+    _report("pd.read_csv", baseline)
+    for workers in [int(w) for w in args.workers.split(",")]:
+        # Warm the pool so process start-up is not measured.
+        read_csv_parallel(args.csv, workers=workers)
+        timings = _time(lambda: read_csv_parallel(args.csv, workers=workers), args.repeat)
+        speedup = statistics.median(baseline) / statistics.median(timings)
+        _report(f"parallel, {workers} workers ({speedup:.1f}x)", timings)
+
+
+def bench_formats(args: argparse.Namespace):
+    df = pd.read_csv(args.csv)
+    sizes = {}
+
+    def encode(label, chunks):
+        def run():
+            sizes[label] = sum(len(chunk) for chunk in chunks())
+
+        _report(label, _time(run, args.repeat))
+
+    def records():
+        # The pre-streaming path; NaN has to be replaced for JSONResponse to
+        # accept the records at all.
+        rows = expand_frame(df).astype(object).where(df.notna(), None).to_dict(orient="records")
+        return [JSONResponse(rows).body]
+
+    encode("to_dict + JSONResponse", records)
+    encode("column-oriented JSON", lambda: columns_json_chunks(df))
+    encode("NDJSON", lambda: ndjson_chunks(df))
+    if arrow_available():
+        encode("Arrow IPC", lambda: arrow_chunks(df))
+    for label, size in sizes.items():
+        print(f"{label:<32} {size:>14,} bytes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    columnar = subparsers.add_parser(
+        "columnar", help="Cold CSV parse vs warm memory-mapped columnar load."
+    )
+    columnar.add_argument("csv")
+    columnar.add_argument("--columns", help="Comma-separated subset of columns to load.")
+    columnar.add_argument("--repeat", type=int, default=5)
+    columnar.set_defaults(func=bench_columnar)
+
+    parallel = subparsers.add_parser(
+        "parallel", help="pd.read_csv vs byte-range parallel parsing at several worker counts."
+    )
+    parallel.add_argument("csv")
+    parallel.add_argument("--workers", default="1,2,4,8,16")
+    parallel.add_argument("--repeat", type=int, default=3)
+    parallel.set_defaults(func=bench_parallel)
+
+    formats = subparsers.add_parser(
+        "formats", help="Encoding a result as records JSON vs columns JSON, NDJSON and Arrow."
+    )
+    formats.add_argument("csv")
+    formats.add_argument("--repeat", type=int, default=3)
+    formats.set_defaults(func=bench_formats)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
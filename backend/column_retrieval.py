@@ -0,0 +1,202 @@
+# column_retrieval.py
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Set
+
+import dotenv
+import pandas as pd
+
+from dataset_store import Dataset
+from execution_trace import trace_log
+
+dotenv.load_dotenv()
+
+# Prompts list every column unless the file has more than this many.
+COLUMN_RETRIEVAL_MIN_COLUMNS = int(os.environ.get("COLUMN_RETRIEVAL_MIN_COLUMNS", 100))
+COLUMN_RETRIEVAL_TOP_K = int(os.environ.get("COLUMN_RETRIEVAL_TOP_K", 40))
+# A plan naming a column outside the header is re-planned once with this many
+# times more columns.
+COLUMN_RETRIEVAL_WIDEN_FACTOR = int(os.environ.get("COLUMN_RETRIEVAL_WIDEN_FACTOR", 4))
+COLUMN_SAMPLE_ROWS = int(os.environ.get("COLUMN_SAMPLE_ROWS", 200))
+# Distinct sampled values indexed per string column.
+COLUMN_SAMPLE_VALUES = 50
+INDEX_CACHE_ENTRIES = 32
+
+# BM25 parameters and field weights: a word of the column name counts three
+# times, a character trigram of the name or a word of a sampled value once.
+BM25_K1 = 1.2
+BM25_B = 0.75
+NAME_WEIGHT = 3
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "each", "for", "from", "how",
+    "in", "is", "it", "me", "of", "on", "or", "per", "show", "than", "that", "the",
+    "to", "what", "when", "where", "which", "who", "with",
+}
+
+
+def _words(text: str) -> List[str]:
+    # camelCase and snake_case names split into their words.
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", str(text))
+    return [w for w in re.split(r"[^0-9a-z]+", text.lower()) if w]
+
+
+def _trigrams(word: str) -> List[str]:
+    padded = f"^{word}$"
+    return ["#" + padded[i : i + 3] for i in range(len(padded) - 2)]
+
+
+def query_terms(text: str) -> Counter:
+    terms: Counter = Counter()
+    for word in _words(text):
+        if word in _STOPWORDS:
+            continue
+        terms[word] += 1
+        terms.update(_trigrams(word))
+    return terms
+
+
+class ColumnIndex:
+    """BM25 index with one document per column: its name and sampled values."""
+
+    def __init__(self, columns: List[str], sample: pd.DataFrame):
+        self.columns = columns
+        self.names = [" ".join(_words(column)) for column in columns]
+        self.documents: List[Counter] = []
+        for position, column in enumerate(columns):
+            terms: Counter = Counter()
+            for word in _words(column):
+                terms[word] += NAME_WEIGHT
+                terms.update(_trigrams(word))
+            series = sample.iloc[:, position] if position < sample.shape[1] else None
+            if series is not None and series.dtype == object:
+                for value in series.dropna().unique()[:COLUMN_SAMPLE_VALUES]:
+                    terms.update(_words(value))
+            self.documents.append(terms)
+        self.lengths = [sum(doc.values()) for doc in self.documents]
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        document_frequency: Counter = Counter()
+        for doc in self.documents:
+            document_frequency.update(doc.keys())
+        n = len(self.documents)
+        self.idf = {
+            term: math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        }
+
+    def scores(self, query: str) -> List[float]:
+        terms = query_terms(query)
+        normalized_query = f" {' '.join(_words(query))} "
+        scores = []
+        for position, doc in enumerate(self.documents):
+            score = 0.0
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[position] / (self.average_length or 1))
+            for term, count in terms.items():
+                tf = doc.get(term)
+                if tf:
+                    score += count * self.idf[term] * tf * (BM25_K1 + 1) / (tf + norm)
+            # A column named verbatim in the question is always included.
+            if self.names[position] and f" {self.names[position]} " in normalized_query:
+                score = math.inf
+            scores.append(score)
+        return scores
+
+    def top_k(self, query: str, k: int) -> List[str]:
+        """The k best-scoring columns in header order; ties go to earlier columns."""
+        scores = self.scores(query)
+        ranked = sorted(range(len(self.columns)), key=lambda i: (-scores[i], i))
+        keep = set(ranked[:k])
+        return [column for i, column in enumerate(self.columns) if i in keep]
+
+
+def plan_column_references(plan: Dict[str, Any]) -> Set[str]:
+    """Column names the plan reads that it does not create itself."""
+    referenced: Set[str] = set()
+    created: Set[str] = set()
+    for op in plan.get("operations") or []:
+        params = op.get("parameters") or {}
+        op_type = op.get("operation_type")
+        if op_type in ["calculate_sum", "calculate_average", "filter_rows", "sort_column"]:
+            referenced.add(params.get("column"))
+        elif op_type == "group_and_aggregate":
+            referenced.update(params.get("by_columns") or [])
+            for agg in params.get("aggregations") or []:
+                referenced.add(agg.get("column"))
+                created.add(agg.get("output_column_name") or f"{agg.get('column')}_{agg.get('function')}")
+        elif op_type == "drop_columns":
+            referenced.update(params.get("columns_to_drop") or [])
+        elif op_type == "rename_column":
+            referenced.add(params.get("old_name"))
+            created.add(params.get("new_name"))
+        elif op_type == "merge_dataframes":
+            referenced.add(params.get("on_column"))
+    return {column for column in referenced - created if isinstance(column, str)}
+
+
+class ColumnRetriever:
+    """
+    Picks the columns of a wide dataset that are relevant to a question, so
+    the planner prompt does not list thousands of names. Indexes are built
+    from the header and a sample of rows, once per dataset.
+    """
+
+    def __init__(
+        self,
+        min_columns: int = COLUMN_RETRIEVAL_MIN_COLUMNS,
+        top_k: int = COLUMN_RETRIEVAL_TOP_K,
+    ):
+        self.min_columns = min_columns
+        self.top_k = top_k
+        self._indexes: "OrderedDict[str, ColumnIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.narrowed_prompts = 0
+        self.prompt_columns = 0
+        self.widened_retries = 0
+
+    def _index(self, dataset: Dataset) -> ColumnIndex:
+        with self._lock:
+            index = self._indexes.get(dataset.dataset_id)
+            if index is not None:
+                self._indexes.move_to_end(dataset.dataset_id)
+                return index
+        sample = pd.read_csv(dataset.path, nrows=COLUMN_SAMPLE_ROWS)
+        index = ColumnIndex(dataset.columns, sample)
+        with self._lock:
+            self._indexes[dataset.dataset_id] = index
+            while len(self._indexes) > INDEX_CACHE_ENTRIES:
+                self._indexes.popitem(last=False)
+        return index
+
+    def select(self, dataset: Dataset, query: str, k: int) -> List[str]:
+        """All columns for narrow datasets, otherwise the k most relevant."""
+        columns = dataset.columns
+        if len(columns) <= self.min_columns or k >= len(columns):
+            return columns
+        selected = self._index(dataset).top_k(query, k)
+        with self._lock:
+            self.narrowed_prompts += 1
+            self.prompt_columns += len(selected)
+        trace_log(
+            f"COLUMN RETRIEVAL: Prompting with {len(selected)} of {len(columns)} columns."
+        )
+        return selected
+
+    def record_retry(self):
+        with self._lock:
+            self.widened_retries += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "indexed_datasets": len(self._indexes),
+                "narrowed_prompts": self.narrowed_prompts,
+                "average_prompt_columns": (
+                    self.prompt_columns / self.narrowed_prompts if self.narrowed_prompts else 0.0
+                ),
+                "widened_retries": self.widened_retries,
+            }
+
+
+column_retriever = ColumnRetriever()
@@ -0,0 +1,189 @@
+# columnar_store.py
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import dotenv
+import numpy as np
+import pandas as pd
+
+from execution_trace import trace_log
+
+dotenv.load_dotenv()
+
+COLUMNAR_CACHE_DIR = os.environ.get(
+    "COLUMNAR_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "columnar_cache"),
+)
+COLUMNAR_CACHE_MAX_AGE_SECONDS = float(
+    os.environ.get("COLUMNAR_CACHE_MAX_AGE_SECONDS", 7 * 24 * 3600)
+)
+COLUMNAR_CACHE_MAX_BYTES = int(os.environ.get("COLUMNAR_CACHE_MAX_BYTES", 20 * 1024**3))
+MANIFEST_NAME = "manifest.json"
+
+# Column dtypes that np.save writes as plain binary arrays and np.load can
+# memory-map; anything else (Python object strings) is pickled and loaded eagerly.
+MAPPABLE_KINDS = "biufcmM"
+
+
+class ColumnarStore:
+    """
+    Per-dataset columnar copies of parsed CSVs: one .npy file per column plus
+    a JSON manifest with the header order, dtypes and row count. Numeric
+    columns are memory-mapped copy-on-write on load, so only the pages a plan
+    touches are read and nothing is re-parsed.
+    """
+
+    def __init__(
+        self,
+        root: str = COLUMNAR_CACHE_DIR,
+        max_age_seconds: float = COLUMNAR_CACHE_MAX_AGE_SECONDS,
+        max_bytes: int = COLUMNAR_CACHE_MAX_BYTES,
+    ):
+        self.root = root
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _dir_for(self, dataset_id: str) -> str:
+        return os.path.join(self.root, dataset_id)
+
+    def _manifest_path(self, dataset_id: str) -> str:
+        return os.path.join(self._dir_for(dataset_id), MANIFEST_NAME)
+
+    def manifest(self, dataset_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._manifest_path(dataset_id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def has_columns(self, dataset_id: str, columns: Optional[List[str]]) -> bool:
+        manifest = self.manifest(dataset_id)
+        if manifest is None:
+            return False
+        wanted = manifest["header"] if columns is None else columns
+        return all(column in manifest["columns"] for column in wanted)
+
+    def write(self, dataset_id: str, header: List[str], df: pd.DataFrame):
+        """Persists the columns of df, merging them into any existing copy."""
+        # Duplicate header names are mangled by read_csv ("a", "a.1"), which
+        # the header-keyed manifest cannot represent.
+        if not isinstance(df.index, pd.RangeIndex) or len(set(header)) != len(header):
+            return
+        directory = self._dir_for(dataset_id)
+        with self._lock:
+            os.makedirs(directory, exist_ok=True)
+            manifest = self.manifest(dataset_id) or {
+                "header": header,
+                "rows": len(df),
+                "columns": {},
+            }
+            if manifest["rows"] != len(df):
+                return
+            for column in df.columns:
+                if column in manifest["columns"] or column not in header:
+                    continue
+                values = df[column].to_numpy()
+                mappable = values.dtype.kind in MAPPABLE_KINDS
+                filename = f"{header.index(column)}.npy"
+                tmp_path = os.path.join(directory, filename + ".part")
+                with open(tmp_path, "wb") as f:
+                    np.save(f, values, allow_pickle=not mappable)
+                os.replace(tmp_path, os.path.join(directory, filename))
+                manifest["columns"][column] = {
+                    "file": filename,
+                    "dtype": str(values.dtype),
+                    "mappable": mappable,
+                }
+            tmp_manifest = self._manifest_path(dataset_id) + ".part"
+            with open(tmp_manifest, "w") as f:
+                json.dump(manifest, f)
+            os.replace(tmp_manifest, self._manifest_path(dataset_id))
+        trace_log(
+            f"COLUMNAR: Stored {len(manifest['columns'])} of {len(header)} columns for {dataset_id[:12]}."
+        )
+        self.cleanup()
+
+    def load(self, dataset_id: str, columns: Optional[List[str]] = None) -> Optional[pd.DataFrame]:
+        manifest = self.manifest(dataset_id)
+        if manifest is None:
+            return None
+        wanted = manifest["header"] if columns is None else columns
+        if not all(column in manifest["columns"] for column in wanted):
+            return None
+        # read_csv returns usecols in file order; match it.
+        wanted = [column for column in manifest["header"] if column in wanted]
+        directory = self._dir_for(dataset_id)
+        arrays = {}
+        for column in wanted:
+            entry = manifest["columns"][column]
+            path = os.path.join(directory, entry["file"])
+            if entry["mappable"]:
+                # A plain ndarray view of the mapping, so pandas never sees
+                # the np.memmap subclass.
+                arrays[column] = np.load(path, mmap_mode="c").view(np.ndarray)
+            else:
+                arrays[column] = np.load(path, allow_pickle=True)
+        os.utime(self._manifest_path(dataset_id))
+        # copy=False keeps one block per column, backed by the mapped files.
+        return pd.DataFrame(arrays, index=pd.RangeIndex(manifest["rows"]), copy=False)
+
+    def _entries(self) -> List[Dict[str, Any]]:
+        """
+        Size and last use of every copy. Runs without the lock for stats, so
+        copies and files removed or renamed while they are listed are skipped.
+        """
+        entries = []
+        for name in os.listdir(self.root):
+            directory = os.path.join(self.root, name)
+            if not os.path.isdir(directory):
+                continue
+            try:
+                filenames = os.listdir(directory)
+            except FileNotFoundError:
+                continue
+            size = 0
+            for filename in filenames:
+                try:
+                    size += os.path.getsize(os.path.join(directory, filename))
+                except FileNotFoundError:
+                    continue
+            try:
+                last_used = os.path.getmtime(os.path.join(directory, MANIFEST_NAME))
+            except FileNotFoundError:
+                try:
+                    last_used = os.path.getmtime(directory)
+                except FileNotFoundError:
+                    continue
+            entries.append({"directory": directory, "bytes": size, "last_used": last_used})
+        return entries
+
+    def cleanup(self):
+        """Removes copies unused for longer than the max age, then the least
+        recently used ones until the total size fits the byte budget."""
+        with self._lock:
+            now = time.time()
+            entries = sorted(self._entries(), key=lambda entry: entry["last_used"])
+            total = sum(entry["bytes"] for entry in entries)
+            for entry in entries:
+                if now - entry["last_used"] <= self.max_age_seconds and total <= self.max_bytes:
+                    continue
+                shutil.rmtree(entry["directory"], ignore_errors=True)
+                total -= entry["bytes"]
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self._entries()
+        return {
+            "datasets": len(entries),
+            "bytes": sum(entry["bytes"] for entry in entries),
+            "max_bytes": self.max_bytes,
+            "max_age_seconds": self.max_age_seconds,
+        }
+
+
+columnar_store = ColumnarStore()
@@ -0,0 +1,142 @@
+# compaction.py
+import operator
+import os
+from typing import Any, Callable, Dict, Tuple
+
+import dotenv
+import numpy as np
+import pandas as pd
+
+from frame_cache import frame_nbytes
+
+dotenv.load_dotenv()
+
+DTYPE_COMPACTION = os.environ.get("DTYPE_COMPACTION", "").lower() in ("1", "true", "yes")
+# String columns whose distinct values are at most this fraction of the rows
+# become categoricals; the rest use the pyarrow string dtype when available.
+COMPACTION_CATEGORY_MAX_RATIO = float(os.environ.get("COMPACTION_CATEGORY_MAX_RATIO", 0.5))
+
+try:
+    import pyarrow  # noqa: F401
+
+    ARROW_STRING_DTYPE = pd.StringDtype("pyarrow")
+except ImportError:
+    ARROW_STRING_DTYPE = None
+
+COMPARISONS: Dict[str, Callable[[Any, Any], Any]] = {
+    "==": operator.eq,
+    ">": operator.gt,
+    "<": operator.lt,
+    ">=": operator.ge,
+    "<=": operator.le,
+    "!=": operator.ne,
+}
+
+
+def _compact_series(series: pd.Series) -> pd.Series:
+    kind = series.dtype.kind
+    if kind == "i":
+        return pd.to_numeric(series, downcast="integer")
+    if kind == "f":
+        values = series.to_numpy()
+        narrowed = values.astype(np.float32)
+        if np.array_equal(narrowed.astype(np.float64), values, equal_nan=True):
+            return pd.Series(narrowed, index=series.index, name=series.name)
+        return series
+    if series.dtype == object and pd.api.types.infer_dtype(series, skipna=True) == "string":
+        if series.nunique() <= COMPACTION_CATEGORY_MAX_RATIO * len(series):
+            return series.astype("category")
+        if ARROW_STRING_DTYPE is not None:
+            return series.astype(ARROW_STRING_DTYPE)
+    return series
+
+
+def compact_frame(df: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    Shrinks a frame as parsed by read_csv: integers and floats are downcast
+    when every value survives the round trip, and all-string columns become
+    categoricals or pyarrow strings. Returns the frame and a memory report.
+    """
+    before = frame_nbytes(df)
+    converted: Dict[str, str] = {}
+    if not df.columns.duplicated().any():
+        compacted_df = df.copy(deep=False)
+        for column in df.columns:
+            compacted = _compact_series(df[column])
+            if compacted.dtype != df[column].dtype:
+                compacted_df[column] = compacted
+                converted[str(column)] = f"{df[column].dtype} -> {compacted.dtype}"
+        df = compacted_df
+    return df, {
+        "before_bytes": before,
+        "after_bytes": frame_nbytes(df),
+        "converted_columns": converted,
+    }
+
+
+def expanded_dtype(dtype: Any) -> Any:
+    """The dtype read_csv would have produced for a column compacted to dtype."""
+    if dtype.kind == "i" and dtype.itemsize < 8:
+        return np.dtype(np.int64)
+    if dtype.kind == "f" and dtype.itemsize < 8:
+        return np.dtype(np.float64)
+    if isinstance(dtype, (pd.CategoricalDtype, pd.StringDtype)):
+        return np.dtype(object)
+    return dtype
+
+
+def expand_series(series: pd.Series) -> pd.Series:
+    """Restores the dtype read_csv would have produced for a compacted column."""
+    dtype = expanded_dtype(series.dtype)
+    if dtype is series.dtype:
+        return series
+    if dtype == object:
+        return series.astype(object).where(series.notna(), np.nan)
+    return series.astype(dtype)
+
+
+def expand_frame(df: pd.DataFrame) -> pd.DataFrame:
+    if df.columns.duplicated().any():
+        return df
+    expanded = df.copy(deep=False)
+    for column in df.columns:
+        series = df[column]
+        restored = expand_series(series)
+        if restored is not series:
+            expanded[column] = restored
+    return expanded
+
+
+def filter_value_type(series: pd.Series) -> type:
+    """
+    The scalar type a filter value is converted to before comparing. Downcast
+    columns use the 64-bit type, so e.g. 0.1 is compared as a float64 exactly
+    as it would be against the uncompacted column. Taken from the dtype, not a
+    value, so it also works on a chunk that earlier filters emptied.
+    """
+    kind = series.dtype.kind
+    if kind == "i" and series.dtype.itemsize < 8:
+        return np.int64
+    if kind == "f" and series.dtype.itemsize < 8:
+        return np.float64
+    return series.dtype.type
+
+
+def compare(series: pd.Series, operator_str: str, value: Any) -> pd.Series:
+    """
+    Boolean mask of series <operator_str> value. Missing strings only satisfy
+    '!=', which is how object columns holding NaN compare.
+    """
+    op = COMPARISONS[operator_str]
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Unordered categoricals only support == and !=, so compare the
+        # categories once and map the result back through the codes (-1 is NaN).
+        matches = np.append(
+            op(series.cat.categories.to_numpy(dtype=object), value).astype(bool),
+            operator_str == "!=",
+        )
+        return pd.Series(matches[series.cat.codes.to_numpy()], index=series.index)
+    mask = op(series, value)
+    if mask.dtype != bool:
+        mask = mask.fillna(operator_str == "!=").astype(bool)
+    return mask
@@ -0,0 +1,273 @@
+# dataset_store.py
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+import dotenv
+import pandas as pd
+
+from columnar_store import columnar_store
+from compaction import DTYPE_COMPACTION, compact_frame
+from execution_trace import trace_log
+from frame_cache import frame_cache, read_options_key
+from parallel_csv import parse_csv
+from zone_maps import zone_maps
+
+dotenv.load_dotenv()
+
+# Relative to this file rather than the working directory, so the store is the
+# same wherever the server is started from.
+DATASET_STORE_DIR = os.environ.get(
+    "DATASET_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "datasets")
+)
+HASH_BLOCK_SIZE = 1024 * 1024
+# Uploads up to this size are parsed while they are hashed and stored. Larger
+# ones are parsed on first use, where they can be read in parallel or scanned.
+UPLOAD_INLINE_PARSE_MAX_BYTES = int(
+    os.environ.get("UPLOAD_INLINE_PARSE_MAX_BYTES", 64 * 1024**2)
+)
+# Rows read to infer column dtypes when no parsed copy of a dataset exists.
+DTYPE_SAMPLE_ROWS = int(os.environ.get("DTYPE_SAMPLE_ROWS", 1000))
+DATASET_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+class Dataset:
+    """
+    A handle to an uploaded CSV, addressed by the SHA-256 of its bytes.
+    Parsed frames live in the process-wide frame cache, keyed by the content
+    hash and the read options.
+    """
+
+    def __init__(self, dataset_id: str, path: str, filename: str, size_bytes: int):
+        self.dataset_id = dataset_id
+        self.path = path
+        self.filename = filename
+        self.size_bytes = size_bytes
+        self._columns: Optional[List[str]] = None
+        # Memory report of the most recent compacted load, if any.
+        self.compaction: Optional[Dict[str, Any]] = None
+
+    def _cache_key(self, read_options: Dict[str, Any]):
+        return (self.dataset_id, read_options_key(read_options))
+
+    @property
+    def columns(self) -> List[str]:
+        if self._columns is None:
+            cached = frame_cache.peek(self._cache_key({}))
+            if cached is not None:
+                self._columns = cached.columns.tolist()
+            else:
+                self._columns = pd.read_csv(self.path, nrows=0).columns.tolist()
+        return self._columns
+
+    def dtypes(self) -> Tuple[Dict[str, Any], bool]:
+        """
+        Column dtypes without a full parse, and whether they are exact. They
+        come from the cached frame or the columnar copy when either exists,
+        otherwise from the first DTYPE_SAMPLE_ROWS rows; a column that is
+        empty in the sample maps to None.
+        """
+        cached = frame_cache.peek(self._cache_key({}))
+        if cached is not None:
+            return dict(cached.dtypes.items()), True
+        manifest = columnar_store.manifest(self.dataset_id)
+        if manifest is not None and all(c in manifest["columns"] for c in manifest["header"]):
+            return {
+                column: pd.api.types.pandas_dtype(manifest["columns"][column]["dtype"])
+                for column in manifest["header"]
+            }, True
+        sample = pd.read_csv(self.path, nrows=DTYPE_SAMPLE_ROWS)
+        return {
+            column: None if sample[column].isna().all() else sample[column].dtype
+            for column in sample.columns
+        }, False
+
+    def is_cached(self) -> bool:
+        return frame_cache.peek(self._cache_key({})) is not None
+
+    def has_fast_path(self, usecols: Optional[List[str]] = None) -> bool:
+        """True when the columns can be served without parsing the CSV."""
+        return self.is_cached() or columnar_store.has_columns(self.dataset_id, usecols)
+
+    def frame(self, usecols: Optional[List[str]] = None) -> pd.DataFrame:
+        read_options: Dict[str, Any] = {}
+        if usecols:
+            # A column subset of an already parsed full frame is as good as a
+            # projected re-read, and much cheaper.
+            full = frame_cache.peek(self._cache_key({}), count_hit=True)
+            if full is not None:
+                return full[usecols]
+            read_options["usecols"] = usecols
+
+        def read() -> pd.DataFrame:
+            try:
+                df = columnar_store.load(self.dataset_id, usecols)
+            except OSError:
+                # The copy was cleaned up underneath us; parse the CSV instead.
+                df = None
+            if df is not None:
+                trace_log(f"DATASET: Mapped '{self.filename}' from its columnar copy.")
+                return df
+            trace_log(f"DATASET: Parsing '{self.filename}' ({self.dataset_id[:12]})...")
+            df = parse_csv(self.path, **read_options)
+            columnar_store.write(self.dataset_id, self.columns, df)
+            return df
+
+        return frame_cache.get_or_load(
+            self._cache_key(read_options), lambda: self._compact(read())
+        )
+
+    def _compact(self, df: pd.DataFrame) -> pd.DataFrame:
+        if DTYPE_COMPACTION:
+            df, self.compaction = compact_frame(df)
+            trace_log(
+                f"DATASET: Compacted '{self.filename}' from {self.compaction['before_bytes']} "
+                f"to {self.compaction['after_bytes']} bytes."
+            )
+        return df
+
+    def adopt(self, df: pd.DataFrame):
+        """Caches the full frame of this dataset, parsed while it was uploaded."""
+        self._columns = df.columns.tolist()
+        columnar_store.write(self.dataset_id, self._columns, df)
+        frame_cache.get_or_load(self._cache_key({}), lambda: self._compact(df))
+
+    def named(self, filename: str) -> "Dataset":
+        """This dataset under another upload name, sharing the stored content."""
+        if filename == self.filename:
+            return self
+        dataset = Dataset(self.dataset_id, self.path, filename, self.size_bytes)
+        dataset._columns = self._columns
+        return dataset
+
+    def matches(self, filepath: str) -> bool:
+        name = os.path.basename(str(filepath))
+        return filepath in (self.dataset_id, self.path) or name in (
+            self.filename,
+            os.path.basename(self.path),
+        )
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "dataset_id": self.dataset_id,
+            "filename": self.filename,
+            "size_bytes": self.size_bytes,
+            "columns": self.columns,
+            "memory": self.compaction,
+        }
+
+
+class _TeeReader:
+    """
+    File-like view of an upload that hashes the bytes and copies them to
+    `sink` as they are read, so read_csv and the store share one pass.
+    """
+
+    def __init__(self, source: BinaryIO, sink: BinaryIO):
+        self.source = source
+        self.sink = sink
+        self.hasher = hashlib.sha256()
+        self.size_bytes = 0
+
+    def read(self, size: int = -1) -> bytes:
+        block = self.source.read(size)
+        self.hasher.update(block)
+        self.sink.write(block)
+        self.size_bytes += len(block)
+        return block
+
+    def drain(self):
+        while self.read(HASH_BLOCK_SIZE):
+            pass
+
+
+def _remaining_bytes(fileobj: BinaryIO) -> Optional[int]:
+    try:
+        position = fileobj.tell()
+        end = fileobj.seek(0, os.SEEK_END)
+        fileobj.seek(position)
+    except (AttributeError, OSError, ValueError):
+        return None
+    return end - position
+
+
+class DatasetStore:
+    """
+    Keeps uploaded CSVs on disk under their content hash so identical uploads
+    are stored and parsed only once.
+    """
+
+    def __init__(self, root: str = DATASET_STORE_DIR):
+        self.root = root
+        self._datasets: Dict[str, Dataset] = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path_for(self, dataset_id: str) -> str:
+        return os.path.join(self.root, f"{dataset_id}.csv")
+
+    def add(self, fileobj: BinaryIO, filename: str, parse: bool = False) -> Dataset:
+        """
+        Stores an upload under the SHA-256 of its bytes. The bytes are hashed
+        while they are copied to a private temporary file, which becomes the
+        stored file if the content is new. With parse=True, an upload of at
+        most UPLOAD_INLINE_PARSE_MAX_BYTES is parsed from the same pass and
+        its frame cached, so the first query does not read the file again.
+        """
+        remaining = _remaining_bytes(fileobj) if parse else None
+        df: Optional[pd.DataFrame] = None
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as buffer:
+                reader = _TeeReader(fileobj, buffer)
+                if remaining is not None and remaining <= UPLOAD_INLINE_PARSE_MAX_BYTES:
+                    try:
+                        df = pd.read_csv(reader)
+                    except Exception as e:
+                        # Queries report the parse error; storing still works.
+                        print(f"DATASET: Could not parse '{filename}' while uploading: {e}")
+                reader.drain()
+            dataset_id = reader.hasher.hexdigest()
+            with self._lock:
+                dataset = self._datasets.get(dataset_id)
+                if dataset is not None:
+                    print(f"DATASET: '{filename}' already stored as {dataset_id[:12]}.")
+                else:
+                    path = self._path_for(dataset_id)
+                    if not os.path.exists(path):
+                        os.replace(tmp_path, path)
+                    dataset = Dataset(dataset_id, path, filename, reader.size_bytes)
+                    self._datasets[dataset_id] = dataset
+                    print(
+                        f"DATASET: Stored '{filename}' as {dataset_id[:12]} ({reader.size_bytes} bytes)."
+                    )
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        if df is not None and not dataset.is_cached():
+            dataset.adopt(df)
+        elif df is None:
+            # Too large to parse inline: later scans read it in chunks.
+            zone_maps.build_in_background(dataset)
+        return dataset
+
+    def get(self, dataset_id: str) -> Dataset:
+        with self._lock:
+            dataset = self._datasets.get(dataset_id)
+            if dataset is None:
+                if not DATASET_ID_PATTERN.match(dataset_id):
+                    raise KeyError(dataset_id)
+                path = self._path_for(dataset_id)
+                if not os.path.exists(path):
+                    raise KeyError(dataset_id)
+                dataset = Dataset(
+                    dataset_id, path, f"{dataset_id}.csv", os.path.getsize(path)
+                )
+                self._datasets[dataset_id] = dataset
+            return dataset
+
+
+dataset_store = DatasetStore()
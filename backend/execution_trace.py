@@ -0,0 +1,147 @@
+# execution_trace.py
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+STEP_FIELDS = (
+    "kind",
+    "step",
+    "op_type",
+    "at_ms",
+    "input_shape",
+    "output_shape",
+    "wall_time_ms",
+    "status",
+)
+
+
+def shape_of(data: Any) -> Optional[List[int]]:
+    if isinstance(data, pd.DataFrame):
+        return list(data.shape)
+    if isinstance(data, (pd.Series, pd.Index, list, tuple)):
+        return [len(data)]
+    return None
+
+
+class ExecutionTrace:
+    """
+    Structured, per-request record of a plan execution. Tools append free-form
+    log events; execute_plan appends one step event per operation with its
+    shapes and wall time. The text log is rendered from these events.
+    """
+
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+        self.current_step: Optional[int] = None
+        self.current_op: Optional[str] = None
+        self.muted = False
+        self._started = time.perf_counter()
+
+    def _elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._started) * 1000
+
+    def log(self, message: str):
+        if self.muted:
+            return
+        self.events.append(
+            {
+                "kind": "log",
+                "step": self.current_step,
+                "op_type": self.current_op,
+                "at_ms": self._elapsed_ms(),
+                "message": message,
+            }
+        )
+
+    def begin_step(self, step: int, op_type: Optional[str]):
+        self.current_step = step
+        self.current_op = op_type
+
+    def end_step(
+        self,
+        input_data: Any,
+        output_data: Any,
+        wall_time_ms: float,
+        status: str = "ok",
+        **extra,
+    ) -> Dict[str, Any]:
+        event = {
+            "kind": "step",
+            "step": self.current_step,
+            "op_type": self.current_op,
+            "at_ms": self._elapsed_ms(),
+            "input_shape": extra.pop("input_shape", shape_of(input_data)),
+            "output_shape": extra.pop("output_shape", shape_of(output_data)),
+            "wall_time_ms": wall_time_ms,
+            "status": status,
+            **extra,
+        }
+        self.events.append(event)
+        self.current_step = None
+        self.current_op = None
+        return event
+
+    def steps(self) -> List[Dict[str, Any]]:
+        return [event for event in self.events if event["kind"] == "step"]
+
+    def render(self) -> str:
+        lines = []
+        for event in self.events:
+            if event["kind"] == "log":
+                lines.append(event["message"])
+                continue
+            extra = "".join(
+                f", {key}={value}"
+                for key, value in event.items()
+                if key not in STEP_FIELDS
+            )
+            lines.append(
+                f"[step {event['step']} {event['op_type']}] {event['status']} in "
+                f"{event['wall_time_ms']:.1f} ms, input {event['input_shape']} -> "
+                f"output {event['output_shape']}{extra}"
+            )
+        return "\n".join(lines)
+
+
+_current_trace: ContextVar[Optional[ExecutionTrace]] = ContextVar(
+    "execution_trace", default=None
+)
+
+
+def current_trace() -> Optional[ExecutionTrace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def use_trace(trace: ExecutionTrace):
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def muted_logs():
+    """Silences trace_log, e.g. while the same tool runs on every chunk of a file."""
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    previous, trace.muted = trace.muted, True
+    try:
+        yield
+    finally:
+        trace.muted = previous
+
+
+def trace_log(message: str):
+    """Log to the active request's trace, or to stdout outside of a request."""
+    trace = current_trace()
+    if trace is None:
+        print(message)
+    else:
+        trace.log(message)
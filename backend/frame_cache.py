@@ -0,0 +1,128 @@
+# frame_cache.py
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import dotenv
+import pandas as pd
+
+from execution_trace import trace_log
+
+dotenv.load_dotenv()
+
+FRAME_CACHE_MAX_BYTES = int(os.environ.get("FRAME_CACHE_MAX_BYTES", 1024**3))
+
+
+def read_options_key(read_options: Dict[str, Any]) -> str:
+    return json.dumps(read_options, sort_keys=True, default=str)
+
+
+def cached_copy(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    A cached frame as handed to a caller. Under pandas copy-on-write, which
+    main.py turns on, a shallow copy is enough: an in-place change allocates
+    its own buffers instead of writing through to the cache. Without it the
+    copy has to be deep.
+    """
+    return df.copy(deep=not pd.get_option("mode.copy_on_write"))
+
+
+def frame_nbytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class FrameCache:
+    """
+    Process-wide LRU cache of parsed DataFrames, bounded by the deep memory
+    usage of the cached frames rather than by entry count.
+    """
+
+    def __init__(self, max_bytes: int = FRAME_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, Tuple[pd.DataFrame, int]]" = OrderedDict()
+        self._loading: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, key: Hashable) -> Optional[pd.DataFrame]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def peek(self, key: Hashable, count_hit: bool = False) -> Optional[pd.DataFrame]:
+        with self._lock:
+            df = self._lookup(key)
+            if df is not None and count_hit:
+                self.hits += 1
+        return None if df is None else cached_copy(df)
+
+    def get_or_load(
+        self, key: Hashable, loader: Callable[[], pd.DataFrame]
+    ) -> pd.DataFrame:
+        with self._lock:
+            df = self._lookup(key)
+            if df is not None:
+                self.hits += 1
+                return cached_copy(df)
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        # Only one thread parses a given key; the others wait and then hit.
+        with key_lock:
+            with self._lock:
+                df = self._lookup(key)
+                if df is not None:
+                    self.hits += 1
+                    return cached_copy(df)
+                self.misses += 1
+            try:
+                df = loader()
+                self.put(key, df)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        return cached_copy(df)
+
+    def put(self, key: Hashable, df: pd.DataFrame):
+        nbytes = frame_nbytes(df)
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                trace_log(
+                    f"FRAME CACHE: Frame of {nbytes} bytes exceeds the {self.max_bytes} byte budget; not caching."
+                )
+                return
+            self._entries[key] = (df, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]):
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                self.current_bytes -= self._entries.pop(key)[1]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "current_bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+frame_cache = FrameCache()
@@ -0,0 +1,271 @@
+# hash_join.py
+import os
+from typing import Callable, List, Optional, Tuple
+
+import dotenv
+import numpy as np
+import pandas as pd
+
+from compaction import expand_series
+from frame_cache import frame_nbytes
+from secondary_index import HashIndex
+
+dotenv.load_dotenv()
+
+HASH_JOIN_ENABLED = os.environ.get("HASH_JOIN_ENABLED", "1").lower() in ("1", "true", "yes")
+# Joins whose result is estimated to exceed this are refused before any row is
+# materialized; keys that repeat on both sides are the usual cause.
+JOIN_MAX_RESULT_BYTES = int(os.environ.get("JOIN_MAX_RESULT_BYTES", 4 * 1024**3))
+# Rows sampled from each side to estimate the bytes of a result row.
+JOIN_ROW_SAMPLE = 1000
+
+HASH_JOIN_HOWS = ["inner", "left", "right"]
+MERGE_SUFFIXES = ("_x", "_y")
+
+
+def key_kind(series: pd.Series) -> Optional[str]:
+    """
+    'int', 'float' or 'string' for join keys the hash join compares exactly
+    like pd.merge, judged by a categorical's categories; None otherwise.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        series = pd.Series(series.cat.categories)
+    if series.dtype.kind in "iu":
+        return "int"
+    if series.dtype.kind == "f":
+        return "float"
+    if series.dtype == object and pd.api.types.infer_dtype(series, skipna=True) == "string":
+        return "string"
+    return None
+
+
+def merged_columns(left: pd.DataFrame, right: pd.DataFrame, on: str) -> List[str]:
+    """The columns pd.merge gives the join, suffixing names both sides have."""
+    right_columns = [column for column in right.columns if column != on]
+    overlap = set(left.columns) & set(right_columns)
+    return [
+        f"{column}{MERGE_SUFFIXES[0]}" if column in overlap else column for column in left.columns
+    ] + [f"{column}{MERGE_SUFFIXES[1]}" if column in overlap else column for column in right_columns]
+
+
+def join_cardinality(left_keys: pd.Series, right_keys: pd.Series, how: str) -> Tuple[int, bool]:
+    """
+    Rows the join produces, and whether some key repeats on both sides.
+    Missing keys are counted apart: pd.merge matches them to each other.
+    """
+    left_keys, right_keys = expand_series(left_keys), expand_series(right_keys)
+    left_counts, right_counts = left_keys.value_counts(), right_keys.value_counts()
+    left_nulls, right_nulls = int(left_keys.isna().sum()), int(right_keys.isna().sum())
+    common = left_counts.index.intersection(right_counts.index)
+    matched_left = left_counts[common].to_numpy()
+    matched_right = right_counts[common].to_numpy()
+    rows = int((matched_left * matched_right).sum()) + left_nulls * right_nulls
+    if how in ("left", "outer"):
+        rows += len(left_keys) - int(matched_left.sum()) - (left_nulls if right_nulls else 0)
+    if how in ("right", "outer"):
+        rows += len(right_keys) - int(matched_right.sum()) - (right_nulls if left_nulls else 0)
+    many_to_many = bool(
+        (len(common) and matched_left.max() > 1 and matched_right.max() > 1)
+        or (left_nulls > 1 and right_nulls > 1)
+    )
+    return rows, many_to_many
+
+
+def _row_bytes(df: pd.DataFrame) -> float:
+    sample = df.head(JOIN_ROW_SAMPLE)
+    return frame_nbytes(sample) / len(sample) if len(sample) else 0.0
+
+
+def check_join_size(
+    left: pd.DataFrame, right: pd.DataFrame, on: str, rows: int, many_to_many: bool
+) -> Optional[str]:
+    """
+    Raises ValueError when the join result would not fit JOIN_MAX_RESULT_BYTES.
+    Returns a warning for a many-to-many join that does fit.
+    """
+    estimated = int(rows * (_row_bytes(left) + _row_bytes(right)))
+    detail = (
+        f"joining {len(left)} rows with {len(right)} rows on '{on}' produces {rows} rows "
+        f"(about {estimated / 1024**2:.0f} MiB)"
+    )
+    if estimated > JOIN_MAX_RESULT_BYTES:
+        raise ValueError(
+            f"Refusing the merge: {detail}, more than the {JOIN_MAX_RESULT_BYTES / 1024**2:.0f} MiB "
+            f"allowed{'; its keys repeat on both sides' if many_to_many else ''}. "
+            "Filter or aggregate one side first, or join on a more specific column."
+        )
+    if many_to_many:
+        return f"Many-to-many merge: '{on}' repeats on both sides, so {detail}."
+    return None
+
+
+def _take(df: pd.DataFrame, positions: np.ndarray, fill: bool) -> pd.DataFrame:
+    """The rows at positions, with missing values where a position is -1."""
+    if not fill:
+        taken = df.take(positions)
+        taken.index = pd.RangeIndex(len(positions))
+        return taken
+    columns = {}
+    for column in df.columns:
+        series = df[column]
+        if isinstance(series.dtype, pd.api.extensions.ExtensionDtype):
+            values = series.array
+        else:
+            values = series.to_numpy()
+        columns[column] = pd.api.extensions.take(values, positions, allow_fill=True)
+    return pd.DataFrame(columns, index=pd.RangeIndex(len(positions)), columns=df.columns)
+
+
+class HashJoin:
+    """
+    An inner, left or right merge on one key column with the result pd.merge
+    gives, rows in the same order included. The keys of the smaller side (the
+    other side's for left and right joins) come from a HashIndex, which for a
+    dataset's full frame is kept and reused by later queries. The other side
+    only probes it: a categorical key probes once per category instead of
+    once per row, so compacted keys are aligned without being expanded.
+
+    pd.merge lists an inner join by left row only while no left row has
+    several matches, so inner joins whose matched right keys repeat are left
+    to pd.merge.
+
+    plan() matches the keys and counts the result rows; nothing is
+    materialized until result(), so the size can be checked first.
+    """
+
+    def __init__(self, left: pd.DataFrame, right: pd.DataFrame, on: str, how: str):
+        self.left = left
+        self.right = right
+        self.on = on
+        self.how = how
+        self.build_side = "right"
+        self.rows = 0
+        self.many_to_many = False
+        self._found: Optional[np.ndarray] = None
+        self._starts: Optional[np.ndarray] = None
+        self._counts: Optional[np.ndarray] = None
+        self._index: Optional[HashIndex] = None
+        self._left_row_matches_repeat = False
+
+    @classmethod
+    def plan(
+        cls,
+        left: pd.DataFrame,
+        right: pd.DataFrame,
+        on: str,
+        how: str,
+        index_for: Callable[[pd.DataFrame, str], Optional[HashIndex]],
+    ) -> Optional["HashJoin"]:
+        """
+        The join with its keys matched, or None when pd.merge has to run it:
+        outer joins, inner joins where a left row has several matches, keys of
+        different kinds or with missing values (which pd.merge matches to each
+        other), and duplicate column names.
+        """
+        if not HASH_JOIN_ENABLED or how not in HASH_JOIN_HOWS:
+            return None
+        if not left.columns.is_unique or not right.columns.is_unique:
+            return None
+        if len(set(merged_columns(left, right, on))) != len(left.columns) + len(right.columns) - 1:
+            return None
+        kind = key_kind(left[on])
+        if kind is None or kind != key_kind(right[on]):
+            return None
+        join = cls(left, right, on, how)
+        if how == "right" or (how == "inner" and len(left) < len(right)):
+            join.build_side = "left"
+        build, probe = (left, right) if join.build_side == "left" else (right, left)
+        if probe[on].isna().any():
+            return None
+        index = index_for(build, on)
+        if index is None or index.null_rows:
+            return None
+        join._match(index, probe[on], keep_unmatched=how != "inner")
+        if how == "inner" and join._left_row_matches_repeat:
+            return None
+        return join
+
+    @staticmethod
+    def _probe_codes(index: HashIndex, keys: pd.Series) -> np.ndarray:
+        if isinstance(keys.dtype, pd.CategoricalDtype):
+            aligned = index.keys.get_indexer(keys.cat.categories)
+            return aligned[keys.cat.codes.to_numpy()]
+        return index.keys.get_indexer(expand_series(keys).to_numpy())
+
+    def _match(self, index: HashIndex, keys: pd.Series, keep_unmatched: bool):
+        codes = self._probe_codes(index, keys)
+        found = codes >= 0
+        slots = np.where(found, codes + 1, 0)
+        starts = index.starts[slots]
+        counts = np.where(found, index.starts[slots + 1] - starts, 0)
+        matched = counts[found]
+        build_keys_repeat = bool(len(matched) and matched.max() > 1)
+        probe_keys_repeat = bool(len(matched) and np.bincount(codes[found]).max() > 1)
+        self.many_to_many = build_keys_repeat and probe_keys_repeat
+        self._left_row_matches_repeat = (
+            build_keys_repeat if self.build_side == "right" else probe_keys_repeat
+        )
+        self.rows = int(counts.sum()) + (int((~found).sum()) if keep_unmatched else 0)
+        self._starts = starts
+        self._counts = np.maximum(counts, 1) if keep_unmatched else counts
+        # Unmatched probe rows are kept once, with no build row, in left and right joins.
+        self._found = found if keep_unmatched else None
+        self._index = index
+
+    def _positions(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Row positions in the probe and build side of every result row."""
+        counts = self._counts
+        probe_positions = np.repeat(np.arange(len(counts)), counts)
+        offsets = np.arange(len(probe_positions)) - np.repeat(np.cumsum(counts) - counts, counts)
+        slots = np.repeat(self._starts, counts) + offsets
+        unmatched = np.repeat(~self._found, counts) if self._found is not None else None
+        if unmatched is not None:
+            slots[unmatched] = 0
+        if len(self._index.positions):
+            build_positions = self._index.positions[slots]
+        else:
+            build_positions = np.zeros(len(slots), dtype=np.intp)
+        if unmatched is not None:
+            build_positions[unmatched] = -1
+        return probe_positions, build_positions
+
+    def result(self) -> pd.DataFrame:
+        probe_positions, build_positions = self._positions()
+        if self.build_side == "right":
+            left_positions, right_positions = probe_positions, build_positions
+        else:
+            left_positions, right_positions = build_positions, probe_positions
+            if self.how == "inner":
+                # Matches were found in right order; pd.merge lists them by left row.
+                order = np.argsort(left_positions, kind="stable")
+                left_positions, right_positions = left_positions[order], right_positions[order]
+        left_part = _take(self.left, left_positions, fill=self.how == "right")
+        right_part = _take(
+            self.right.drop(columns=[self.on]), right_positions, fill=self.how == "left"
+        )
+        if self.how == "right":
+            # Unmatched right rows still carry their key.
+            left_part[self.on] = _take(self.right[[self.on]], right_positions, fill=False)[self.on]
+        merged = pd.concat([left_part, right_part], axis=1)
+        merged.columns = merged_columns(self.left, self.right, self.on)
+        key, key_dtype = merged[self.on], self._key_dtype(left_positions)
+        # Categorical dtypes compare equal whatever the order of their categories.
+        if key.dtype != key_dtype or (
+            isinstance(key_dtype, pd.CategoricalDtype)
+            and not key.cat.categories.equals(key_dtype.categories)
+        ):
+            merged[self.on] = expand_series(key).astype(key_dtype)
+        return merged
+
+    def _key_dtype(self, left_positions: np.ndarray):
+        """
+        The key dtype pd.merge gives: a categorical key stays categorical only
+        when both sides share its categories, or in a right join that
+        matches nothing.
+        """
+        if self.how == "right" and len(left_positions) and (left_positions < 0).all():
+            return self.right[self.on].dtype
+        return pd.merge(
+            self.left[[self.on]].head(0), self.right[[self.on]].head(0), on=self.on, how=self.how
+        )[self.on].dtype
+
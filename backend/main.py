@@ -1,13 +1,47 @@
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, status, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, status, Form, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+import asyncio
 import os 
+from typing import List, Optional
+from starlette.concurrency import run_in_threadpool
+from agent import LLMTimeoutError, llm_client
 from manipulator import process_csv_file
-import shutil
-from pathlib import Path
+from column_retrieval import column_retriever
+from columnar_store import columnar_store
+from dataset_store import Dataset, dataset_store
+from frame_cache import frame_cache
+from metrics import register_stats_gauges, registry, time_phase
+from plan_cache import plan_cache
+from result_store import RESULT_MAX_PAGE_ROWS, RESULT_PAGE_ROWS, page_records, result_store
+from rule_planner import rule_planner
+from secondary_index import secondary_indexes
+from subplan_cache import subplan_cache
+from zone_maps import zone_maps
+from serialization import (
+    RESULT_FORMATS,
+    NumpyJSONResponse,
+    arrow_available,
+    arrow_chunks,
+    columns_json_chunks,
+    ndjson_chunks,
+    negotiate_format,
+)
+from worker_pool import (
+    ClientDisconnectedError,
+    PoolSaturatedError,
+    PoolTimeoutError,
+    worker_pool,
+)
 import dotenv
+import pandas as pd
 dotenv.load_dotenv()
+# Cached frames and step results are handed out as shallow copies, which is
+# only safe when an in-place change cannot write through to the cached copy.
+pd.set_option("mode.copy_on_write", True)
+# Files accepted by one multi-file upload.
+UPLOAD_MAX_FILES = int(os.environ.get("UPLOAD_MAX_FILES", 8))
 app = FastAPI(
     title="CSV Uploader API",
     description="API for uploading and processing CSV files from Next.js frontend.",
@@ -22,64 +56,340 @@ app.add_middleware(
 )
 
 
+register_stats_gauges("csv_frame_cache", frame_cache.stats)
+register_stats_gauges("csv_columnar_cache", columnar_store.stats)
+register_stats_gauges("csv_plan_cache", plan_cache.stats)
+register_stats_gauges("csv_worker_pool", worker_pool.stats)
+register_stats_gauges("csv_result_store", result_store.stats)
+register_stats_gauges("csv_llm_client", llm_client.stats)
+register_stats_gauges("csv_rule_planner", rule_planner.stats)
+register_stats_gauges("csv_column_retrieval", column_retriever.stats)
+register_stats_gauges("csv_subplan_cache", subplan_cache.stats)
+register_stats_gauges("csv_secondary_indexes", secondary_indexes.stats)
+register_stats_gauges("csv_zone_maps", zone_maps.stats)
+
+
 @app.get("/", summary="Root endpoint", response_description="Basic API status message")
 async def read_root():
     return {"message": "CSV Upload Python Backend is running!"}
 
 
-@app.post("/uploadcsv")
-async def upload_csv_file(
-    csv_file: UploadFile = File(...),
-    query: str = Form(...), 
-):
+@app.get("/metrics", summary="Prometheus metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.get("/stats/frame-cache", summary="Parsed DataFrame cache counters")
+async def frame_cache_stats():
+    return frame_cache.stats()
+
+
+@app.get("/stats/columnar-cache", summary="On-disk columnar dataset copies")
+async def columnar_cache_stats():
+    return columnar_store.stats()
+
+
+@app.get("/stats/plan-cache", summary="LLM plan cache counters")
+async def plan_cache_stats():
+    return plan_cache.stats()
+
+
+@app.get("/stats/worker-pool", summary="Plan execution pool occupancy")
+async def worker_pool_stats():
+    return worker_pool.stats()
+
+
+@app.get("/stats/result-store", summary="Stored paged query results")
+async def result_store_stats():
+    return result_store.stats()
+
+
+@app.get("/stats/llm", summary="Planning LLM client concurrency, latency and hedging")
+async def llm_client_stats():
+    return llm_client.stats()
+
+
+@app.get("/stats/rule-planner", summary="Queries planned without the LLM")
+async def rule_planner_stats():
+    return rule_planner.stats()
+
+
+@app.get("/stats/column-retrieval", summary="Planner prompts narrowed to relevant columns")
+async def column_retrieval_stats():
+    return column_retriever.stats()
+
+
+@app.get("/stats/subplan-cache", summary="Cached step results shared across plans")
+async def subplan_cache_stats():
+    return subplan_cache.stats()
+
+
+@app.get("/stats/secondary-indexes", summary="Column indexes serving repeated filters")
+async def secondary_indexes_stats():
+    return secondary_indexes.stats()
+
+
+@app.get("/stats/zone-maps", summary="Chunks skipped by per-chunk min/max statistics")
+async def zone_maps_stats():
+    return zone_maps.stats()
+
+
+def _check_csv_upload(csv_file: UploadFile):
     if not csv_file.filename.endswith(".csv"):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid file type. Only CSV files are allowed.",
         )
-    saved_filename = f"{Path(csv_file.filename).stem}.csv"
-    file_location = os.path.join(saved_filename)  
-    print(f"Attempting to save file to: {file_location}")
+
+
+def _get_dataset(dataset_id: str) -> Dataset:
     try:
-        with open(file_location, "wb") as buffer:
-            await csv_file.seek(
-                0
-            ) 
-            shutil.copyfileobj(
-                csv_file.file, buffer
-            ) 
-        print(
-            f"File '{csv_file.filename}' saved successfully as '{saved_filename}' at '{file_location}'"
+        return dataset_store.get(dataset_id)
+    except KeyError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Dataset '{dataset_id}' not found. Upload it via POST /datasets first.",
         )
+
+
+async def _run_query(request: Request, datasets: List[Dataset], query: str):
+    try:
         print("request received")
-        processed_data = process_csv_file(file_location, query)
+        processed_data = await worker_pool.run(
+            process_csv_file,
+            datasets,
+            query,
+            is_disconnected=request.is_disconnected,
+        )
+        result_frame = processed_data.pop("result_frame", None)
+        if result_frame is not None:
+            processed_data["result"] = {
+                **result_store.put(result_frame),
+                "offset": 0,
+                "limit": RESULT_PAGE_ROWS,
+            }
         print("processed data")
         print(processed_data)
+        return processed_data
+    except PoolSaturatedError as pe:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(pe),
+            headers={"Retry-After": str(pe.retry_after)},
+        )
+    except (PoolTimeoutError, LLMTimeoutError) as te:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=str(te),
+        )
+    except ClientDisconnectedError as ce:
+        print(f"Abandoning query: {ce}")
+        raise HTTPException(status_code=499, detail=str(ce))
+    except ValueError as ve:
+        
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, 
+            detail=f"CSV data processing error: {str(ve)}",
+        )
+    except Exception as e:
+        print(f"An unexpected error occurred while processing the query: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An internal server error occurred during processing: {str(e)}",
+        )
+
+
+@app.post("/datasets")
+async def create_dataset(csv_file: UploadFile = File(...)):
+    _check_csv_upload(csv_file)
+    try:
+        await csv_file.seek(0)
+        with time_phase("upload"):
+            dataset = await run_in_threadpool(dataset_store.add, csv_file.file, csv_file.filename)
         return JSONResponse(
             {
                 "message": f"File '{csv_file.filename}' uploaded successfully!",
-                "filename": csv_file.filename,
-                "content_type": csv_file.content_type,
-                **processed_data,
+                **dataset.describe(),
             }
         )
+    except Exception as e:
+        print(f"An unexpected error occurred while storing the dataset: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An internal server error occurred during file upload: {str(e)}",
+        )
 
-    except ValueError as ve:
-        
+
+@app.get("/datasets/{dataset_id}")
+async def get_dataset(dataset_id: str):
+    return _get_dataset(dataset_id).describe()
+
+
+@app.post("/datasets/{dataset_id}/query")
+async def query_dataset(request: Request, dataset_id: str, query: str = Form(...)):
+    dataset = _get_dataset(dataset_id)
+    processed_data = await _run_query(request, [dataset], query)
+    return NumpyJSONResponse({"dataset_id": dataset.dataset_id, **processed_data})
+
+
+@app.get("/results/{result_id}")
+async def get_result_page(
+    request: Request,
+    result_id: str,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(
+        None,
+        ge=1,
+        description="Rows to return. JSON formats default to one page; "
+        "NDJSON and Arrow stream everything after offset.",
+    ),
+    columns: Optional[str] = Query(None, description="Comma-separated column names."),
+    format: Optional[str] = Query(
+        None,
+        pattern="^(records|columns|ndjson|arrow)$",
+        description="Overrides the Accept header.",
+    ),
+):
+    frame = result_store.get(result_id)
+    if frame is None:
         raise HTTPException(
-            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, 
-            detail=f"CSV data processing error: {str(ve)}",
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Result '{result_id}' not found or expired. Run the query again.",
+        )
+    selected = None
+    if columns:
+        selected = [column.strip() for column in columns.split(",")]
+        missing = [column for column in selected if column not in frame.columns]
+        if missing:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"Columns not in result: {', '.join(missing)}",
+            )
+    result_format = negotiate_format(request.headers.get("accept"), format)
+    if result_format in ("records", "columns"):
+        limit = RESULT_PAGE_ROWS if limit is None else limit
+        if limit > RESULT_MAX_PAGE_ROWS:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"JSON pages hold at most {RESULT_MAX_PAGE_ROWS} rows; "
+                "use NDJSON or Arrow to stream more.",
+            )
+    if result_format == "records":
+        return NumpyJSONResponse(
+            {
+                "result_id": result_id,
+                "total_rows": len(frame),
+                "offset": offset,
+                "limit": limit,
+                "rows": page_records(frame, offset, limit, selected),
+            }
         )
+
+    end = None if limit is None else offset + limit
+    page = frame.iloc[offset:end]
+    if selected is not None:
+        page = page[selected]
+    headers = {"X-Total-Rows": str(len(frame))}
+    if result_format == "columns":
+        chunks = columns_json_chunks(
+            page, result_id=result_id, total_rows=len(frame), offset=offset, limit=limit
+        )
+    elif result_format == "ndjson":
+        chunks = ndjson_chunks(page)
+    else:
+        if not arrow_available():
+            raise HTTPException(
+                status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                detail="Arrow output needs pyarrow, which is not installed on the server.",
+            )
+        chunks = arrow_chunks(page)
+    return StreamingResponse(
+        chunks, media_type=RESULT_FORMATS[result_format], headers=headers
+    )
+
+
+@app.post("/uploadcsv")
+async def upload_csv_file(
+    request: Request,
+    csv_file: UploadFile = File(...),
+    query: str = Form(...), 
+):
+    _check_csv_upload(csv_file)
+    try:
+        await csv_file.seek(0)
+        with time_phase("upload"):
+            dataset = await run_in_threadpool(
+                dataset_store.add, csv_file.file, csv_file.filename, parse=True
+            )
     except Exception as e:
         print(f"An unexpected error occurred in the upload endpoint: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"An internal server error occurred during file upload or processing: {str(e)}",
         )
-    finally:
-        if os.path.exists(file_location):
-            try:
-                os.remove(file_location)
-                print(f"Successfully deleted temporary file: {file_location}")
-            except OSError as e:
-                print(f"Error deleting file {file_location}: {e}")
+    processed_data = await _run_query(request, [dataset], query)
+    return NumpyJSONResponse(
+        {
+            "message": f"File '{csv_file.filename}' uploaded successfully!",
+            "filename": csv_file.filename,
+            "content_type": csv_file.content_type,
+            "dataset_id": dataset.dataset_id,
+            **processed_data,
+        }
+    )
+
+
+@app.post("/uploadcsvs")
+async def upload_csv_files(
+    request: Request,
+    csv_files: List[UploadFile] = File(...),
+    query: str = Form(...),
+):
+    """
+    Stores several CSVs at once and answers a query that may join them. The
+    files are hashed, stored and parsed concurrently, and the planner sees
+    every file's columns.
+    """
+    for csv_file in csv_files:
+        _check_csv_upload(csv_file)
+    filenames = [csv_file.filename for csv_file in csv_files]
+    if len(filenames) > UPLOAD_MAX_FILES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {UPLOAD_MAX_FILES} files can be uploaded together.",
+        )
+    if len(set(filenames)) < len(filenames):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Uploaded files need distinct names; the plan refers to files by name.",
+        )
+    try:
+        for csv_file in csv_files:
+            await csv_file.seek(0)
+        with time_phase("upload"):
+            stored = await asyncio.gather(
+                *(
+                    run_in_threadpool(dataset_store.add, csv_file.file, csv_file.filename, parse=True)
+                    for csv_file in csv_files
+                )
+            )
+    except Exception as e:
+        print(f"An unexpected error occurred in the multi-file upload endpoint: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An internal server error occurred during file upload or processing: {str(e)}",
+        )
+    # Files with the same content share one stored dataset but keep their own
+    # names, which is how the plan refers to them.
+    datasets = [dataset.named(name) for dataset, name in zip(stored, filenames)]
+    processed_data = await _run_query(request, datasets, query)
+    return NumpyJSONResponse(
+        {
+            "message": f"Files {', '.join(repr(name) for name in filenames)} uploaded successfully!",
+            "filenames": filenames,
+            "dataset_ids": [dataset.dataset_id for dataset in stored],
+            **processed_data,
+        }
+    )
@@ -1,14 +1,64 @@
 # manipulator.py
+import numpy as np
 import pandas as pd
 from typing import Dict, Any, List, Optional, Callable, Union
 import json
-import sys
-from io import StringIO
 import os
+import threading
+import time
+import weakref
+from contextlib import closing, contextmanager
 from fastapi import FastAPI, UploadFile, File, HTTPException, status, Form
 from pathlib import Path
 
-from agent import llm_agent
+from agent import MODEL_NAME, PROMPT_VERSION, llm_agent
+from column_retrieval import (
+    COLUMN_RETRIEVAL_WIDEN_FACTOR,
+    column_retriever,
+    plan_column_references,
+)
+from compaction import (
+    COMPARISONS,
+    compare,
+    expand_frame,
+    expand_series,
+    filter_value_type,
+)
+from dataset_store import Dataset
+from execution_trace import (
+    ExecutionTrace,
+    current_trace,
+    shape_of,
+    trace_log,
+    use_trace,
+)
+from hash_join import HashJoin, check_join_size, join_cardinality
+from metrics import current_rss_bytes, observe_execution, observe_step, plan_sources, time_phase
+from optimizer import data_key_last_uses, optimize_plan, plan_limit, render_explain
+from parallel_csv import parse_csv
+from parallel_groupby import parallel_group_aggregate, should_parallelize
+from plan_cache import plan_cache, plan_cache_key, rebind_filepaths
+from plan_validator import (
+    PLAN_VALIDATION_ENABLED,
+    PLAN_VALIDATION_REPLAN,
+    PlanValidationError,
+    PlanValidator,
+)
+from result_store import RESULT_PAGE_ROWS
+from rule_planner import RULE_PLANNER_ENABLED, rule_planner
+from secondary_index import secondary_indexes
+from serialization import json_default
+from streaming import StreamingExecutor, chunk_predicates, exceeds_memory_budget, streamable_prefix
+from subplan_cache import SUBPLAN_CACHE_ENABLED, subplan_cache, subplan_keys
+from zone_maps import uniform_dtypes, zone_maps
+
+
+PUSHDOWN_SCAN_MIN_BYTES = int(os.environ.get("PUSHDOWN_SCAN_MIN_BYTES", 256 * 1024**2))
+READ_CHUNK_ROWS = int(os.environ.get("READ_CHUNK_ROWS", 100_000))
+
+
+class ExecutionCancelledError(Exception):
+    pass
 
 
 class DataProcessorAgent:
@@ -17,7 +67,13 @@ class DataProcessorAgent:
     It takes a sequence of operations and applies them to data.
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        datasets: Optional[List[Dataset]] = None,
+        cancel_event: Optional[threading.Event] = None,
+    ):
+        self.datasets: List[Dataset] = datasets or []
+        self.cancel_event = cancel_event
         self.tools: Dict[str, Callable] = {
             "read_csv": self._read_csv,
             "calculate_sum": self._calculate_sum,
@@ -35,24 +91,32 @@ class DataProcessorAgent:
         self.data_store: Dict[str, pd.DataFrame] = {}
         self.results_store: Dict[str, Any] = {}
         self.final_output: Any = None
+        self.stats: Dict[str, Any] = {}
+        self._dataset_frames: Dict[int, Any] = {}
 
-    def _read_csv(self, params: Dict[str, Any]) -> pd.DataFrame:
-        filepath = params.get("filepath")
-        if not filepath:
-            raise ValueError(
-                "No 'filepath' provided for read_csv operation in parameters."
-            )
+    def _resolve_dataset(self, filepath: str) -> Dataset:
+        for dataset in self.datasets:
+            if dataset.matches(filepath):
+                return dataset
+        if len(self.datasets) == 1:
+            # The planner only ever saw one file, so any path it names means that file.
+            return self.datasets[0]
+        raise ValueError(
+            f"CSV file '{filepath}' is not one of the datasets bound to this query."
+        )
 
-        if not os.path.exists(filepath):
-            raise FileNotFoundError(
-                f"CSV file not found at '{filepath}'. Please ensure it exists in the folder."
-            )
+    def _dataset_for(self, filepath: Optional[str]) -> Optional[Dataset]:
+        if not self.datasets or not filepath:
+            return None
+        try:
+            return self._resolve_dataset(filepath)
+        except ValueError:
+            return None
 
+    @contextmanager
+    def _csv_read_errors(self, filepath: str):
         try:
-            print(f"TOOL: Reading data from actual file '{filepath}'...")
-            df = pd.read_csv(filepath)
-            print(f"Successfully loaded '{filepath}'. Shape: {df.shape}")
-            return df
+            yield
         except pd.errors.EmptyDataError:
             raise ValueError(f"CSV file '{filepath}' is empty or has no data.")
         except pd.errors.ParserError as pe:
@@ -64,6 +128,105 @@ class DataProcessorAgent:
                 f"An unexpected error occurred while reading '{filepath}': {str(e)}"
             )
 
+    def _should_scan(
+        self, dataset: Optional[Dataset], path: str, usecols: Optional[List[str]]
+    ) -> bool:
+        if dataset is not None:
+            return (
+                not dataset.has_fast_path(usecols)
+                and dataset.size_bytes >= PUSHDOWN_SCAN_MIN_BYTES
+            )
+        return os.path.getsize(path) >= PUSHDOWN_SCAN_MIN_BYTES
+
+    def _scan_filtered(
+        self,
+        filepath: str,
+        path: str,
+        usecols: Optional[List[str]],
+        filters: List[Dict[str, Any]],
+        dataset: Optional[Dataset] = None,
+    ) -> Optional[pd.DataFrame]:
+        """
+        Reads the file in chunks and keeps only the rows that pass the pushed
+        down filters. Returns None when the chunks disagree on dtypes, because
+        a whole-file parse could then infer different types than the chunks.
+        A stored dataset with a zone map is read only in the chunks that can
+        hold passing rows; the map already says whether the dtypes agree.
+        """
+        kept: List[pd.DataFrame] = []
+        dtypes = None
+        zone_map = zone_maps.get(dataset) if dataset is not None else None
+        if zone_map is not None:
+            if not uniform_dtypes(zone_map, usecols or dataset.columns):
+                return None
+            reader = closing(zone_maps.chunks(dataset, zone_map, usecols, filters, self.stats))
+        else:
+            if dataset is not None:
+                zone_maps.build_in_background(dataset)
+            with self._csv_read_errors(filepath):
+                reader = pd.read_csv(path, usecols=usecols, chunksize=READ_CHUNK_ROWS)
+        with reader as source:
+            while True:
+                with self._csv_read_errors(filepath):
+                    chunk = next(source, None)
+                if chunk is None:
+                    break
+                if dtypes is None:
+                    dtypes = chunk.dtypes
+                elif not chunk.dtypes.equals(dtypes):
+                    return None
+                for filter_params in filters:
+                    chunk = self._filter_frame(chunk, filter_params)
+                kept.append(chunk)
+        if not kept:
+            return None
+        return pd.concat(kept)
+
+    def _read_csv(self, params: Dict[str, Any]) -> pd.DataFrame:
+        filepath = params.get("filepath")
+        if not filepath:
+            raise ValueError(
+                "No 'filepath' provided for read_csv operation in parameters."
+            )
+
+        dataset = self._resolve_dataset(filepath) if self.datasets else None
+        if dataset is None and not os.path.exists(filepath):
+            raise FileNotFoundError(
+                f"CSV file not found at '{filepath}'. Please ensure it exists in the folder."
+            )
+
+        # 'usecols' and 'filters' are only set by the plan optimizer.
+        usecols = params.get("usecols")
+        filters = params.get("filters") or []
+        path = dataset.path if dataset is not None else filepath
+
+        if filters and self._should_scan(dataset, path, usecols):
+            trace_log(
+                f"TOOL: Scanning '{filepath}' in chunks of {READ_CHUNK_ROWS} rows with pushed-down filters..."
+            )
+            for filter_params in filters:
+                self._log_filter(filter_params)
+            df = self._scan_filtered(filepath, path, usecols, filters, dataset)
+            if df is not None:
+                trace_log(f"Successfully loaded '{filepath}'. Shape: {df.shape}")
+                return df
+            trace_log("Chunk dtypes differ; falling back to a full read.")
+
+        with self._csv_read_errors(filepath):
+            if dataset is not None:
+                trace_log(f"TOOL: Reading data from dataset '{dataset.filename}'...")
+                df = dataset.frame(usecols=usecols)
+                # Every row of the dataset, in file order: filters on it can
+                # be served by the dataset's secondary indexes.
+                self._dataset_frames[id(df)] = (dataset.dataset_id, weakref.ref(df))
+            else:
+                trace_log(f"TOOL: Reading data from actual file '{filepath}'...")
+                df = parse_csv(filepath, usecols=usecols)
+        trace_log(f"Successfully loaded '{filepath}'. Shape: {df.shape}")
+        for filter_params in filters:
+            df = self._filter_rows(df, filter_params)
+        return df
+
     def _calculate_sum(
         self, df: pd.DataFrame, params: Dict[str, Any]
     ) -> Union[int, float]:
@@ -72,8 +235,8 @@ class DataProcessorAgent:
             raise ValueError(f"Column '{column}' not found for sum operation.")
         if not pd.api.types.is_numeric_dtype(df[column]):
             raise TypeError(f"Column '{column}' is not numeric. Cannot calculate sum.")
-        print(f"TOOL: Calculating sum of column '{column}'...")
-        return df[column].sum()
+        trace_log(f"TOOL: Calculating sum of column '{column}'...")
+        return expand_series(df[column]).sum()
 
     def _calculate_average(
         self, df: pd.DataFrame, params: Dict[str, Any]
@@ -85,10 +248,30 @@ class DataProcessorAgent:
             raise TypeError(
                 f"Column '{column}' is not numeric. Cannot calculate average."
             )
-        print(f"TOOL: Calculating average of column '{column}'...")
-        return df[column].mean()
+        trace_log(f"TOOL: Calculating average of column '{column}'...")
+        return expand_series(df[column]).mean()
+
+    def _log_filter(self, params: Dict[str, Any]):
+        column = params.get("column")
+        value = params.get("value")
+        operator_str = params.get("operator", "==")
+        trace_log(f"TOOL: Filtering rows where '{column}' {operator_str} '{value}'...")
 
     def _filter_rows(self, df: pd.DataFrame, params: Dict[str, Any]) -> pd.DataFrame:
+        if params.get("column") in df.columns:
+            self._log_filter(params)
+        source = self._dataset_frames.get(id(df))
+        if source is not None and source[1]() is df:
+            column, operator_str, value = self._filter_condition(df, params)
+            positions = secondary_indexes.lookup(source[0], df, column, operator_str, value)
+            if positions is not None:
+                trace_log(f"Probed the index on '{column}': {len(positions)} of {len(df)} rows.")
+                self.stats["index_probes"] += 1
+                return df.take(positions)
+        return self._filter_frame(df, params)
+
+    def _filter_condition(self, df: pd.DataFrame, params: Dict[str, Any]):
+        """The filter's column, operator and value converted for comparison."""
         column = params.get("column")
         value = params.get("value")
         operator_str = params.get("operator", "==")
@@ -96,12 +279,10 @@ class DataProcessorAgent:
         if column not in df.columns:
             raise ValueError(f"Column '{column}' not found for filter operation.")
 
-        print(f"TOOL: Filtering rows where '{column}' {operator_str} '{value}'...")
-
         if pd.api.types.is_numeric_dtype(df[column]):
             try:
                 # Attempt to convert filter value to the column's numeric type
-                value = type(df[column].iloc[0])(value)
+                value = filter_value_type(df[column])(value)
             except (ValueError, TypeError):
                 raise ValueError(
                     f"Cannot compare non-numeric value '{value}' with numeric column '{column}'."
@@ -111,20 +292,13 @@ class DataProcessorAgent:
                 f"Cannot compare numeric value '{value}' with non-numeric column '{column}'."
             )
 
-        if operator_str == "==":
-            return df[df[column] == value]
-        elif operator_str == ">":
-            return df[df[column] > value]
-        elif operator_str == "<":
-            return df[df[column] < value]
-        elif operator_str == ">=":
-            return df[df[column] >= value]
-        elif operator_str == "<=":
-            return df[df[column] <= value]
-        elif operator_str == "!=":
-            return df[df[column] != value]
-        else:
+        if operator_str not in COMPARISONS:
             raise ValueError(f"Unsupported filter operator: {operator_str}")
+        return column, operator_str, value
+
+    def _filter_frame(self, df: pd.DataFrame, params: Dict[str, Any]) -> pd.DataFrame:
+        column, operator_str, value = self._filter_condition(df, params)
+        return df[compare(df[column], operator_str, value)]
 
     def _sort_column(self, df: pd.DataFrame, params: Dict[str, Any]) -> pd.DataFrame:
         column = params.get("column")
@@ -138,21 +312,58 @@ class DataProcessorAgent:
             )
 
         ascending = order == "ascending"
-        print(f"TOOL: Sorting by column '{column}' in {order} order...")
-        return df.sort_values(by=column, ascending=ascending).reset_index(drop=True)
+        trace_log(f"TOOL: Sorting by column '{column}' in {order} order...")
+        # 'limit' is only set by the plan optimizer.
+        limit = params.get("limit")
+        if (
+            limit
+            and limit < len(df)
+            and pd.api.types.is_numeric_dtype(df[column])
+            and not pd.api.types.is_bool_dtype(df[column])
+        ):
+            return self._top_rows(df, column, ascending, limit)
+        # A stable sort keeps ties in input order, which lets the optimizer move
+        # filters ahead of sorts without changing the result.
+        return df.sort_values(by=column, ascending=ascending, kind="stable").reset_index(
+            drop=True
+        )
+
+    def _top_rows(
+        self, df: pd.DataFrame, column: str, ascending: bool, limit: int
+    ) -> pd.DataFrame:
+        """
+        The first `limit` rows of the stable sort by column, found with a
+        partition instead of a full sort. Ties at the cut-off keep their input
+        order and missing values come last, exactly as sort_values orders them.
+        """
+        values = df[column].to_numpy()
+        missing = pd.isna(values)
+        positions = np.flatnonzero(~missing)
+        if limit < len(positions):
+            valid = values[positions]
+            kth = limit - 1 if ascending else len(valid) - limit
+            threshold = np.partition(valid, kth)[kth]
+            beyond = valid < threshold if ascending else valid > threshold
+            ties = np.flatnonzero(valid == threshold)[: limit - int(beyond.sum())]
+            positions = positions[np.sort(np.concatenate([np.flatnonzero(beyond), ties]))]
+        trace_log(f"Selected the top {limit} of {len(df)} rows without a full sort.")
+        top = df.take(positions).sort_values(by=column, ascending=ascending, kind="stable")
+        if len(top) < limit:
+            top = pd.concat([top, df.take(np.flatnonzero(missing)[: limit - len(top)])])
+        return top.reset_index(drop=True)
 
     def _display_data(self, data: Any, params: Dict[str, Any]):
         label = params.get("label", "Result")
-        print(f"\n--- {label} ---")
+        trace_log(f"\n--- {label} ---")
         if isinstance(data, pd.DataFrame):
             if len(data) > 10:
-                print(data.head().to_string())
-                print("...\n(Showing top 5 rows, data truncated for display)\n...")
+                trace_log(expand_frame(data.head()).to_string())
+                trace_log("...\n(Showing top 5 rows, data truncated for display)\n...")
             else:
-                print(data.to_string())
+                trace_log(expand_frame(data).to_string())
         else:
-            print(data)
-        print("-----------------\n")
+            trace_log(str(data))
+        trace_log("-----------------\n")
         return None 
     def _group_and_aggregate(
         self, df: pd.DataFrame, params: Dict[str, Any]
@@ -190,9 +401,19 @@ class DataProcessorAgent:
 
             named_aggs[output_name] = pd.NamedAgg(column=col_to_agg, aggfunc=func)
 
-        print(f"TOOL: Grouping by {by_columns} and aggregating: {aggregations}...")
+        trace_log(f"TOOL: Grouping by {by_columns} and aggregating: {aggregations}...")
 
-        result_df = df.groupby(by_columns).agg(**named_aggs).reset_index()
+        # Aggregate compacted columns at their original width so sums and
+        # means match the uncompacted frame; observed=True keeps categorical
+        # keys from producing groups for values that no longer occur.
+        aggregated_columns = {agg.get("column") for agg in aggregations} - set(by_columns)
+        df = df.assign(**{col: expand_series(df[col]) for col in aggregated_columns})
+        if should_parallelize(df):
+            trace_log(f"TOOL: Aggregating {len(df)} rows in parallel partitions...")
+            grouped = parallel_group_aggregate(df, by_columns, named_aggs)
+        else:
+            grouped = df.groupby(by_columns, observed=True).agg(**named_aggs)
+        result_df = grouped.reset_index()
         return result_df
 
     def _drop_columns(self, df: pd.DataFrame, params: Dict[str, Any]) -> pd.DataFrame:
@@ -207,7 +428,7 @@ class DataProcessorAgent:
         if missing_columns:
             raise ValueError(f"Columns to drop not found: {', '.join(missing_columns)}")
 
-        print(f"TOOL: Dropping columns: {columns_to_drop}...")
+        trace_log(f"TOOL: Dropping columns: {columns_to_drop}...")
         return df.drop(columns=columns_to_drop)
 
     def _rename_column(self, df: pd.DataFrame, params: Dict[str, Any]) -> pd.DataFrame:
@@ -221,7 +442,7 @@ class DataProcessorAgent:
         if old_name not in df.columns:
             raise ValueError(f"Column '{old_name}' not found for renaming.")
 
-        print(f"TOOL: Renaming column '{old_name}' to '{new_name}'...")
+        trace_log(f"TOOL: Renaming column '{old_name}' to '{new_name}'...")
         return df.rename(columns={old_name: new_name})
 
     def _merge_dataframes(
@@ -257,28 +478,237 @@ class DataProcessorAgent:
                 f"Unsupported merge 'how' type: {how}. Use 'inner', 'left', 'right', 'outer'."
             )
 
-        print(f"TOOL: Merging DataFrames on '{on_column}' with '{how}' join...")
-        return pd.merge(left_df, right_df, on=on_column, how=how)
+        trace_log(f"TOOL: Merging DataFrames on '{on_column}' with '{how}' join...")
+        join = HashJoin.plan(left_df, right_df, on_column, how, self._join_index)
+        if join is not None:
+            rows, many_to_many = join.rows, join.many_to_many
+        else:
+            rows, many_to_many = join_cardinality(left_df[on_column], right_df[on_column], how)
+        warning = check_join_size(left_df, right_df, on_column, rows, many_to_many)
+        if warning:
+            trace_log(f"WARNING: {warning}")
+            self.stats["join_warnings"].append(warning)
+        if join is None:
+            return pd.merge(left_df, right_df, on=on_column, how=how)
+        trace_log(f"Hash join with the {join.build_side} side as build side: {rows} rows.")
+        self.stats["hash_joins"] += 1
+        return join.result()
+
+    def _join_index(self, df: pd.DataFrame, column: str):
+        source = self._dataset_frames.get(id(df))
+        dataset_id = source[0] if source is not None and source[1]() is df else None
+        return secondary_indexes.join_index(dataset_id, df, column)
+
+    def _check_cancelled(self, where: str):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise ExecutionCancelledError(f"Plan execution cancelled before {where}.")
+
+    def _run_streaming_prefix(self, operations: List[Dict[str, Any]]) -> int:
+        """
+        Executes the leading streamable steps chunk by chunk when the file would
+        not fit the memory budget. Returns how many steps were executed.
+        """
+        end = streamable_prefix(operations)
+        filepath = (operations[0].get("parameters") or {}).get("filepath")
+        if not end or not filepath or not all(i in self._run_steps for i in range(end)):
+            return 0
+        dataset = self._resolve_dataset(filepath) if self.datasets else None
+        if dataset is not None:
+            usecols = (operations[0].get("parameters") or {}).get("usecols")
+            if dataset.has_fast_path(usecols) or not exceeds_memory_budget(
+                dataset.size_bytes
+            ):
+                return 0
+            path = dataset.path
+        elif os.path.exists(filepath) and exceeds_memory_budget(os.path.getsize(filepath)):
+            path = filepath
+        else:
+            return 0
+
+        prefix = operations[:end]
+        trace_log(
+            f"STEPS 1-{end}: streaming {' -> '.join(op.get('operation_type') for op in prefix)}"
+        )
+        chunks = None
+        zone_map = zone_maps.get(dataset) if dataset is not None else None
+        if zone_map is not None:
+            chunks = zone_maps.chunks(
+                dataset,
+                zone_map,
+                (prefix[0].get("parameters") or {}).get("usecols"),
+                chunk_predicates(prefix),
+                self.stats,
+            )
+        elif dataset is not None:
+            zone_maps.build_in_background(dataset)
+        outcome = StreamingExecutor(self, READ_CHUNK_ROWS).run(prefix, path, chunks)
+        if outcome is None:
+            trace_log("No rows to stream; executing in memory instead.")
+            return 0
+
+        result = outcome["result"]
+        for i, op in enumerate(prefix):
+            self.trace.begin_step(i + 1, op.get("operation_type"))
+            observe_step(
+                self.trace.end_step(
+                    None,
+                    result if i == end - 1 else None,
+                    outcome["wall_ms"][i],
+                    input_shape=[outcome["rows_in"][i]] if i else None,
+                    output_shape=(
+                        shape_of(result) if i == end - 1 else [outcome["rows_out"][i]]
+                    ),
+                    streamed_chunks=outcome["chunks"],
+                )
+            )
+        self._cache_step_result(end - 1, prefix[-1], result)
+        output_key = prefix[-1].get("output_data_key")
+        if output_key:
+            if isinstance(result, pd.DataFrame):
+                self.data_store[output_key] = result
+                self._live_bytes[output_key] = int(result.memory_usage(index=True).sum())
+            else:
+                self.results_store[output_key] = result
+        self.final_output = result
+        self.stats["streamed_steps"] = end
+        self.stats["streamed_chunks"] = outcome["chunks"]
+        trace_log(f"Streamed {end} steps over {outcome['chunks']} chunks.")
+        return end
+
+    def _plan_cached_steps(self, operations: List[Dict[str, Any]]):
+        """
+        Decides, from the last step back, which steps run. A step whose result
+        the output or a running step needs is taken from the subplan cache if
+        it is there and run otherwise; only the inputs of running steps are
+        needed in turn, so execution starts from the deepest cached results.
+        Steps nothing needs are skipped with the subplan cache off as well.
+        """
+        self._subplan_keys, columns, producers = subplan_keys(operations, self._dataset_for)
+        self._cached_results: Dict[int, Any] = {}
+        self._run_steps = set()
+        sink = max(
+            (i for i, op in enumerate(operations) if op.get("operation_type") != "display_data"),
+            default=None,
+        )
+        wanted = set()
+        for i in range(len(operations) - 1, -1, -1):
+            op = operations[i]
+            if op.get("operation_type") != "display_data" and i != sink and i not in wanted:
+                continue
+            if SUBPLAN_CACHE_ENABLED and self._subplan_keys[i] and self._is_cacheable(op):
+                cached = subplan_cache.get(self._subplan_keys[i], columns[i])
+                if cached is not None:
+                    self._cached_results[i] = cached
+                    continue
+            self._run_steps.add(i)
+            wanted.update(p for p in producers[i] if p is not None)
+
+    def _is_cacheable(self, op_dict: Dict[str, Any]) -> bool:
+        # Plain reads are already served by the frame cache and columnar copies.
+        if op_dict.get("operation_type") == "read_csv":
+            return bool((op_dict.get("parameters") or {}).get("filters"))
+        return op_dict.get("operation_type") != "display_data"
+
+    def _cache_step_result(self, step_index: int, op_dict: Dict[str, Any], result: Any):
+        if (
+            SUBPLAN_CACHE_ENABLED
+            and result is not None
+            and self._subplan_keys[step_index]
+            and self._is_cacheable(op_dict)
+        ):
+            subplan_cache.put(self._subplan_keys[step_index], result)
+
+    def _use_cached_step(self, step_index: int, op_dict: Dict[str, Any]):
+        result = self._cached_results.pop(step_index)
+        output_key = op_dict.get("output_data_key")
+        trace_log("Reused the cached result of this step and the steps before it.")
+        output_bytes = (
+            int(result.memory_usage(index=True).sum()) if isinstance(result, pd.DataFrame) else None
+        )
+        observe_step(
+            self.trace.end_step(None, result, 0.0, output_bytes=output_bytes, subplan_cache="hit")
+        )
+        self.stats["cached_steps"].append(step_index + 1)
+        if output_key:
+            if isinstance(result, pd.DataFrame):
+                self.data_store[output_key] = result
+                self._live_bytes[output_key] = output_bytes
+            else:
+                self.results_store[output_key] = result
+        self.final_output = result
+
+    def _release_dead_keys(self, step_index: int, op_dict: Dict[str, Any]):
+        """Drops every data key this step touched that no later step reads."""
+        keys = [
+            op_dict.get("input_data_key"),
+            op_dict.get("output_data_key"),
+            (op_dict.get("parameters") or {}).get("right_data_key"),
+        ]
+        for key in keys:
+            if not key or self._last_uses.get(key, -1) > step_index:
+                continue
+            if key in self.data_store:
+                del self.data_store[key]
+                self._live_bytes.pop(key, None)
+                self.stats["released_keys"].append(key)
+                trace_log(f"Released '{key}'; no later step reads it.")
 
     def execute_plan(self, plan: Dict[str, Any]):
         self.data_store = {}
         self.results_store = {}
         self.final_output = None
+        self.limit = plan_limit(plan)
+        self.result_frame = None
+        self._dataset_frames = {}
+        self.trace = current_trace() or ExecutionTrace()
 
-        print("\n--- Starting Plan Execution ---")
+        trace_log("\n--- Starting Plan Execution ---")
 
         operations = plan.get("operations", [])
         if not operations:
             raise ValueError("No 'operations' array found in the plan. Cannot execute.")
 
+        self._last_uses = data_key_last_uses(operations)
+        self._live_bytes: Dict[str, int] = {}
+        self.stats = {
+            "peak_intermediate_bytes": 0,
+            "total_intermediate_bytes": 0,
+            "released_keys": [],
+            "cached_steps": [],
+            "skipped_steps": [],
+            "index_probes": 0,
+            "zone_chunks_scanned": 0,
+            "zone_chunks_skipped": 0,
+            "hash_joins": 0,
+            "join_warnings": [],
+        }
+
+        self._plan_cached_steps(operations)
+        streamed_steps = self._run_streaming_prefix(operations)
+
         for i, op_dict in enumerate(operations):
+            if i < streamed_steps:
+                continue
+            self._check_cancelled(f"step {i+1}")
             op_type = op_dict.get("operation_type")
             input_key = op_dict.get("input_data_key")
             output_key = op_dict.get("output_data_key")
             params = op_dict.get("parameters", {})
             description = op_dict.get("description", f"Step {i+1}: {op_type}")
 
-            print(f"STEP {i+1}: {description}")
+            self.trace.begin_step(i + 1, op_type)
+            trace_log(f"STEP {i+1}: {description}")
+
+            if i in self._cached_results:
+                self._use_cached_step(i, op_dict)
+                self._release_dead_keys(i, op_dict)
+                continue
+            if i not in self._run_steps:
+                trace_log("Skipped; no step that runs needs its result.")
+                self.trace.end_step(None, None, 0.0, status="skipped")
+                self.stats["skipped_steps"].append(i + 1)
+                self._release_dead_keys(i, op_dict)
+                continue
 
             if op_type not in self.tools:
                 raise ValueError(f"ERROR: Unknown operation type '{op_type}' in plan.")
@@ -324,6 +754,8 @@ class DataProcessorAgent:
                         f"Operation '{op_type}' requires 'input_data_key' but none was provided."
                     )
 
+            step_started = time.perf_counter()
+            rss_before = current_rss_bytes()
             try:
                 
                 if op_type == "read_csv":
@@ -341,33 +773,93 @@ class DataProcessorAgent:
                         )
                     result = tool_func(current_input_data, params)
 
+                output_bytes = (
+                    int(result.memory_usage(index=True).sum())
+                    if isinstance(result, pd.DataFrame)
+                    else None
+                )
+                rss_after = current_rss_bytes()
+                cache_fields = (
+                    {"subplan_cache": "miss"}
+                    if SUBPLAN_CACHE_ENABLED and self._subplan_keys[i] and self._is_cacheable(op_dict)
+                    else {}
+                )
+                observe_step(
+                    self.trace.end_step(
+                        current_input_data,
+                        result,
+                        (time.perf_counter() - step_started) * 1000,
+                        output_bytes=output_bytes,
+                        rss_delta_bytes=(
+                            None if rss_before is None or rss_after is None else rss_after - rss_before
+                        ),
+                        **cache_fields,
+                    )
+                )
+                self._cache_step_result(i, op_dict, result)
+
                 if output_key:
                     if isinstance(result, pd.DataFrame):
                         self.data_store[output_key] = result
-                        print(
+                        trace_log(
                             f"Stored DataFrame as '{output_key}'. Shape: {result.shape}"
                         )
                     else:
                         self.results_store[output_key] = result
-                        print(f"Stored result as '{output_key}'. Value: {result}")
+                        trace_log(f"Stored result as '{output_key}'. Value: {result}")
                 elif result is not None and op_type != "display_data":
-                    print(
+                    trace_log(
                         f"WARNING: Operation '{op_type}' produced a result but no 'output_data_key' was provided. Result will not be chained effectively."
                     )
 
                 if result is not None and op_type != "display_data":
                     self.final_output = result
 
+                if output_key and output_bytes is not None:
+                    self._live_bytes[output_key] = output_bytes
+                    self.stats["total_intermediate_bytes"] += output_bytes
+                self.stats["peak_intermediate_bytes"] = max(
+                    self.stats["peak_intermediate_bytes"], sum(self._live_bytes.values())
+                )
+                self._release_dead_keys(i, op_dict)
+
             except Exception as e:
-                print(f"ERROR: Execution failed for '{op_type}' (Step {i+1}): {e}")
+                trace_log(f"ERROR: Execution failed for '{op_type}' (Step {i+1}): {e}")
+                if self.trace.current_step is not None:
+                    observe_step(
+                        self.trace.end_step(
+                            current_input_data,
+                            None,
+                            (time.perf_counter() - step_started) * 1000,
+                            status="error",
+                            error=str(e),
+                        )
+                    )
                 raise
 
-        print("\n--- Plan Execution Complete ---")
-        
+        trace_log("\n--- Plan Execution Complete ---")
+        trace_log(
+            f"Peak intermediate memory: {self.stats['peak_intermediate_bytes']} bytes "
+            f"(all intermediates together: {self.stats['total_intermediate_bytes']} bytes)."
+        )
+        observe_execution(self.stats)
+
+        with time_phase("serialize"):
+            return self._serialize_output()
+
+    def _serialize_output(self):
         if self.final_output is not None:
             if isinstance(self.final_output, pd.DataFrame):
+                frame = self.final_output
+                if self.limit is not None:
+                    frame = frame.head(self.limit)
+                if len(frame) > RESULT_PAGE_ROWS:
+                    # Large results are kept whole for paging; only the first
+                    # page is returned inline.
+                    self.result_frame = frame
+                    frame = frame.head(RESULT_PAGE_ROWS)
                 # Convert DataFrame to list of dictionaries for JSON
-                return self.final_output.to_dict(orient="records")
+                return expand_frame(frame).to_dict(orient="records")
             elif isinstance(
                 self.final_output, (pd.Series, pd.Index)
             ):  # Handle Series if it somehow became final_output
@@ -382,7 +874,7 @@ class DataProcessorAgent:
             # Assuming results_store typically holds scalar values or dicts/lists.
             for key, value in self.results_store.items():
                 if isinstance(value, pd.DataFrame):
-                    self.results_store[key] = value.to_dict(orient="records")
+                    self.results_store[key] = expand_frame(value).to_dict(orient="records")
                 elif isinstance(value, (pd.Series, pd.Index)):
                     self.results_store[key] = value.tolist()
             return self.results_store
@@ -391,7 +883,7 @@ class DataProcessorAgent:
             # This should always be converted to a list of dicts for JSON
             last_df = list(self.data_store.values())[-1]
             if isinstance(last_df, pd.DataFrame):
-                return last_df.to_dict(orient="records")
+                return expand_frame(last_df).to_dict(orient="records")
             elif isinstance(
                 last_df, (pd.Series, pd.Index)
             ):  
@@ -403,54 +895,212 @@ class DataProcessorAgent:
 
 
 # Main execution block
-def process_csv_file(file_path: Path, user_query: str):
-    agent_executor = DataProcessorAgent()
+_output_file_lock = threading.Lock()
 
-    print("\n--- AI Data Processor ---")
 
-    filename = file_path  
-    available_columns: List[str] = []
-    try:
-        temp_df = pd.read_csv(filename, nrows=0)  
-        available_columns = temp_df.columns.tolist()
-        print(
-            f"Successfully read columns from '{filename}'. Available columns: {', '.join(available_columns)}"
-        )
-    except FileNotFoundError:
-        print(
-            f"Error: File '{filename}' not found. Please ensure it is in the same directory."
-        )
-        raise ValueError(
-            f"File not found: {filename}"
-        )   
-    except pd.errors.EmptyDataError:
-        print(f"Error: File '{filename}' is empty. Cannot extract columns.")
-        raise ValueError(f"File is empty: {filename}")  
-    except Exception as e:
-        print(
-            f"An unexpected error occurred while reading columns from '{filename}': {e}"
+def _file_names(datasets: List[Dataset]) -> List[str]:
+    """
+    The names the planner knows the datasets by: their upload names, or the
+    stored file's name for a dataset whose upload name another one has.
+    """
+    names: List[str] = []
+    for dataset in datasets:
+        name = str(dataset.filename)
+        names.append(os.path.basename(dataset.path) if name in names else name)
+    return names
+
+
+def _llm_plan(
+    datasets: List[Dataset],
+    user_query: str,
+    prompt_columns: List[List[str]],
+    feedback: Optional[str],
+) -> Dict[str, Any]:
+    if len(datasets) == 1:
+        return llm_agent(user_query, str(datasets[0].filename), prompt_columns[0], feedback)
+    # Listed per file, as in the planner's two-file example.
+    files = dict(zip(_file_names(datasets), prompt_columns))
+    return llm_agent(user_query, " AND ".join(files), files, feedback)
+
+
+def _plan_with_llm(
+    datasets: List[Dataset],
+    user_query: str,
+    feedback: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Asks the LLM for a plan, listing only the columns relevant to the query
+    for wide datasets. A plan naming a column that is in none of the full
+    headers is re-planned once with wider column sets that also cover the
+    names it made up. feedback explains why a previous plan was rejected.
+    """
+    top_k = column_retriever.top_k
+    prompt_columns = [column_retriever.select(dataset, user_query, top_k) for dataset in datasets]
+    plan = _llm_plan(datasets, user_query, prompt_columns, feedback)
+    if all(len(columns) == len(dataset.columns) for dataset, columns in zip(datasets, prompt_columns)):
+        return plan
+    missing = plan_column_references(plan) - {
+        column for dataset in datasets for column in dataset.columns
+    }
+    if not missing:
+        return plan
+    print(
+        f"COLUMN RETRIEVAL: Plan references unknown columns {sorted(missing)}; "
+        "re-planning with a wider column set."
+    )
+    column_retriever.record_retry()
+    prompt_columns = [
+        column_retriever.select(
+            dataset,
+            " ".join([user_query, *sorted(missing)]),
+            top_k * COLUMN_RETRIEVAL_WIDEN_FACTOR,
         )
-        raise ValueError(f"Error reading columns from file: {e}")  
+        for dataset in datasets
+    ]
+    return _llm_plan(datasets, user_query, prompt_columns, feedback)
+
 
-    print("\nGetting plan from LLM...")
-    llm_plan_response = llm_agent(
-        user_query, str(filename), available_columns
-    )  
+def _validated_plan(
+    datasets: List[Dataset],
+    user_query: str,
+    plan: Dict[str, Any],
+    plan_source: str,
+):
+    """
+    Checks the plan against the dataset schemas before anything is parsed and
+    returns (plan, plan_source, repairs). A rule or cached plan that fails is
+    replaced by an LLM plan; an LLM plan that fails is re-planned once with
+    the errors in the prompt. Raises PlanValidationError if the plan that
+    would run is still invalid.
+    """
+    validator = PlanValidator(datasets)
+    try:
+        with time_phase("validate"):
+            plan, repairs = validator.validate(plan)
+        return plan, plan_source, repairs
+    except PlanValidationError as pe:
+        if plan_source == "llm" and not PLAN_VALIDATION_REPLAN:
+            raise
+        print(f"PLAN VALIDATION: Rejected the {plan_source} plan: {pe}")
+        feedback = pe.feedback() if plan_source == "llm" else None
+    print("Re-planning with the LLM..." if feedback else "Getting plan from LLM...")
+    with time_phase("llm_plan"):
+        plan = _plan_with_llm(datasets, user_query, feedback)
+    with time_phase("validate"):
+        plan, repairs = validator.validate(plan)
+    return plan, "llm", repairs
 
-    old_stdout = sys.stdout
-    sys.stdout = mystdout = StringIO()
+
+def process_csv_file(
+    datasets: List[Dataset],
+    user_query: str,
+    cancel_event: Optional[threading.Event] = None,
+):
+    agent_executor = DataProcessorAgent(datasets=datasets, cancel_event=cancel_event)
+
+    print("\n--- AI Data Processor ---")
+
+    schemas: Dict[str, List[str]] = {}
+    for filename, dataset in zip(_file_names(datasets), datasets):
+        try:
+            schemas[filename] = dataset.columns
+            print(
+                f"Successfully read columns from '{filename}'. Available columns: {', '.join(schemas[filename])}"
+            )
+        except FileNotFoundError:
+            print(f"Error: Dataset file for '{filename}' is missing from the store.")
+            raise ValueError(
+                f"File not found: {filename}"
+            )   
+        except pd.errors.EmptyDataError:
+            print(f"Error: File '{filename}' is empty. Cannot extract columns.")
+            raise ValueError(f"File is empty: {filename}")  
+        except Exception as e:
+            print(
+                f"An unexpected error occurred while reading columns from '{filename}': {e}"
+            )
+            raise ValueError(f"Error reading columns from file: {e}")  
+
+    single_file = len(datasets) == 1
+    filename = " AND ".join(schemas)
+    available_columns = list(
+        dict.fromkeys(column for columns in schemas.values() for column in columns)
+    )
+    cache_key = plan_cache_key(
+        user_query,
+        available_columns
+        if single_file
+        else [f"{name}: {', '.join(columns)}" for name, columns in schemas.items()],
+        MODEL_NAME,
+        PROMPT_VERSION,
+    )
+    llm_plan_response = None
+    if RULE_PLANNER_ENABLED and single_file:
+        with time_phase("rule_plan"):
+            llm_plan_response = rule_planner.plan(
+                user_query, str(filename), available_columns, datasets[0].dtypes()[0]
+            )
+    if llm_plan_response is not None:
+        print("\nPlanned the query with the rule-based planner.")
+        plan_source = "rules"
+    else:
+        with time_phase("plan_cache_lookup"):
+            cached_plan = plan_cache.get(cache_key)
+        if cached_plan is not None:
+            print("\nReusing cached plan for this query and column set.")
+            # Multi-file keys include the file names, so their paths still match.
+            llm_plan_response = (
+                rebind_filepaths(cached_plan, str(filename)) if single_file else cached_plan
+            )
+            plan_source = "cache"
+        else:
+            print("\nGetting plan from LLM...")
+            with time_phase("llm_plan"):
+                llm_plan_response = _plan_with_llm(datasets, user_query)
+            plan_source = "llm"
+
+    validation: Dict[str, Any] = {"errors": [], "repairs": []}
+    if PLAN_VALIDATION_ENABLED:
+        try:
+            llm_plan_response, plan_source, validation["repairs"] = _validated_plan(
+                datasets, user_query, llm_plan_response, plan_source
+            )
+        except PlanValidationError as pe:
+            validation = {"errors": pe.errors, "repairs": pe.repairs}
+        for repair in validation["repairs"]:
+            print(f"PLAN VALIDATION: {repair}")
+    plan_sources.inc(source=plan_source)
+
+    with time_phase("optimize"):
+        # Read projections need the header of the file a read loads.
+        optimized_plan, explain = optimize_plan(
+            llm_plan_response, available_columns if single_file else None
+        )
+    for rewrite in explain["rewrites"]:
+        print(f"OPTIMIZER: {rewrite}")
 
     execution_success = False
-    try:
-        print("\nExecuting plan...")
-        final_result = agent_executor.execute_plan(llm_plan_response)
-        execution_success = True
-        print("\nPlan execution finished.")
-    except Exception as e:
-        print(f"\nExecution Aborted due to Error: {e}")
-        final_result = {"status": "error", "message": f"Execution failed: {str(e)}"}
+    with use_trace(ExecutionTrace()) as trace, time_phase("execute"):
+        if validation["errors"]:
+            # Nothing is parsed for a plan that is known to fail.
+            trace_log("\nPlan rejected before execution.")
+            final_result = {
+                "status": "error",
+                "message": "Plan validation failed: " + "; ".join(validation["errors"]),
+            }
+        else:
+            try:
+                trace_log("\nExecuting plan...")
+                final_result = agent_executor.execute_plan(optimized_plan)
+                execution_success = True
+                trace_log("\nPlan execution finished.")
+            except Exception as e:
+                trace_log(f"\nExecution Aborted due to Error: {e}")
+                final_result = {"status": "error", "message": f"Execution failed: {str(e)}"}
 
-    sys.stdout = old_stdout
+    if execution_success and plan_source == "llm":
+        # Only LLM plans that ran cleanly are worth replaying.
+        plan_cache.put(cache_key, llm_plan_response)
 
     print("\n--- LLM Generated Plan ---")
     print(json.dumps(llm_plan_response, indent=2))
@@ -458,30 +1108,50 @@ def process_csv_file(file_path: Path, user_query: str):
     print(f"\nFinal result from executor (before backend return): {final_result}")
 
     output_txt_final_result = (
-        json.dumps(final_result, indent=2)
+        json.dumps(final_result, indent=2, default=json_default)
         if isinstance(final_result, (dict, list))
         else str(final_result)
     )
 
-    with open("output.txt", "w") as f:
+    with _output_file_lock, open("output.txt", "w") as f:
         f.write("User Query: " + user_query + "\n")
         f.write(
             "Target File: " + str(filename) + "\n"
         )  
-        f.write("Available Columns: " + ", ".join(available_columns) + "\n\n")
+        if single_file:
+            f.write("Available Columns: " + ", ".join(available_columns) + "\n\n")
+        else:
+            f.write("Available Columns:\n")
+            for name, columns in schemas.items():
+                f.write("  " + name + ": " + ", ".join(columns) + "\n")
+            f.write("\n")
+        f.write("Plan Source: " + plan_source + "\n")
+        if validation["errors"] or validation["repairs"]:
+            f.write("Plan Validation:\n")
+            for line in validation["errors"] + validation["repairs"]:
+                f.write("  " + line + "\n")
         f.write("LLM Plan:\n")
         f.write(json.dumps(llm_plan_response, indent=2) + "\n\n")
+        f.write("Optimizer:\n")
+        f.write(render_explain(explain) + "\n\n")
         f.write("Executor Console Output:\n")
-        f.write(mystdout.getvalue() + "\n")
+        f.write(trace.render() + "\n")
         f.write(
             "Final Returned Result (JSON/String): \n" + output_txt_final_result + "\n"
         )
 
     if execution_success:
-        return {
+        response = {
             "status": "success",
             "message": "CSV processed and query executed successfully.",
             "processed_data": final_result,  
+            "execution_stats": agent_executor.stats,
+            "plan_source": plan_source,
+            "plan_repairs": validation["repairs"],
         }
+        if agent_executor.result_frame is not None:
+            # Stored by the API process; processed_data holds the first page.
+            response["result_frame"] = agent_executor.result_frame
+        return response
     else:
         return final_result 
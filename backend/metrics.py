@@ -0,0 +1,298 @@
+# metrics.py
+import bisect
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ROW_BUCKETS = (0, 1, 10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+BYTE_BUCKETS = (0, 1024, 64 * 1024, 1024**2, 16 * 1024**2, 128 * 1024**2, 1024**3, 8 * 1024**3)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(
+                    f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                )
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series: Dict[LabelValues, List[float]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            counts = self._series.setdefault(key, [0] * (len(self.buckets) + 1))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, counts in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = f'le="{_format_value(float(bound))}"'
+                    lines.append(
+                        f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+                    )
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(self._sums[key])}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """A gauge whose value is read from a callback at scrape time."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        read: Callable[[], Dict[LabelValues, float]],
+        labelnames: Sequence[str] = (),
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.read = read
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for key, value in sorted(self.read().items()):
+            lines.append(
+                f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            )
+        return lines
+
+
+class Registry:
+    """
+    Minimal in-process metrics registry rendered in the Prometheus text
+    exposition format. With EXECUTOR_KIND=process, metrics recorded inside
+    worker processes are not visible here.
+    """
+
+    def __init__(self):
+        self._metrics: List = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+phase_seconds = registry.register(
+    Histogram(
+        "csv_phase_seconds",
+        "Wall time of each request phase (upload, plan, execute, serialize).",
+        ["phase"],
+    )
+)
+step_seconds = registry.register(
+    Histogram(
+        "csv_step_seconds",
+        "Wall time of each plan step; subplan_cache=hit for steps taken from the subplan cache.",
+        ["operation_type", "subplan_cache"],
+    )
+)
+step_rows_in = registry.register(
+    Histogram(
+        "csv_step_rows_in",
+        "Rows in the input of each executed plan step.",
+        ["operation_type"],
+        ROW_BUCKETS,
+    )
+)
+step_rows_out = registry.register(
+    Histogram(
+        "csv_step_rows_out",
+        "Rows in the output of each plan step.",
+        ["operation_type", "subplan_cache"],
+        ROW_BUCKETS,
+    )
+)
+step_output_bytes = registry.register(
+    Histogram(
+        "csv_step_output_bytes",
+        "Shallow memory usage of each plan step's DataFrame output.",
+        ["operation_type", "subplan_cache"],
+        BYTE_BUCKETS,
+    )
+)
+step_rss_delta_bytes = registry.register(
+    Histogram(
+        "csv_step_rss_delta_bytes",
+        "Change in the process resident set size across a plan step; steps that "
+        "free memory fall in the lowest bucket.",
+        ["operation_type"],
+        BYTE_BUCKETS,
+    )
+)
+step_errors = registry.register(
+    Counter(
+        "csv_step_errors_total",
+        "Plan steps that raised an error.",
+        ["operation_type"],
+    )
+)
+request_peak_intermediate_bytes = registry.register(
+    Histogram(
+        "csv_request_peak_intermediate_bytes",
+        "Peak memory held by live intermediate DataFrames during one plan execution.",
+        buckets=BYTE_BUCKETS,
+    )
+)
+llm_requests = registry.register(
+    Counter("csv_llm_requests_total", "Calls made to the planning LLM.", ["model"])
+)
+plan_sources = registry.register(
+    Counter(
+        "csv_plan_source_total",
+        "Executed plans by where they came from (rules, cache or llm).",
+        ["source"],
+    )
+)
+llm_tokens = registry.register(
+    Counter(
+        "csv_llm_tokens_total",
+        "Tokens reported by the planning LLM.",
+        ["model", "kind"],
+    )
+)
+
+
+def current_rss_bytes() -> Optional[int]:
+    """
+    Resident set size of the process right now, or None without /proc.
+    Unlike ru_maxrss this also goes down, so it shows what a step kept.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+@contextmanager
+def time_phase(phase: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phase_seconds.observe(time.perf_counter() - started, phase=phase)
+
+
+def observe_step(event: Dict):
+    op_type = event.get("op_type") or "unknown"
+    if event.get("status") != "ok":
+        step_errors.inc(operation_type=op_type)
+        return
+    # "hit", "miss", or "none" for steps the subplan cache does not hold.
+    cache = event.get("subplan_cache", "none")
+    step_seconds.observe(event["wall_time_ms"] / 1000, operation_type=op_type, subplan_cache=cache)
+    if event.get("input_shape"):
+        step_rows_in.observe(event["input_shape"][0], operation_type=op_type)
+    if event.get("output_shape"):
+        step_rows_out.observe(event["output_shape"][0], operation_type=op_type, subplan_cache=cache)
+    if event.get("output_bytes") is not None:
+        step_output_bytes.observe(
+            event["output_bytes"], operation_type=op_type, subplan_cache=cache
+        )
+    if event.get("rss_delta_bytes") is not None:
+        step_rss_delta_bytes.observe(event["rss_delta_bytes"], operation_type=op_type)
+
+
+def observe_execution(stats: Dict):
+    request_peak_intermediate_bytes.observe(stats["peak_intermediate_bytes"])
+
+
+class StatsGauges:
+    """
+    Gauges for the numeric fields of a component's stats() dict. stats() is
+    called once per scrape and every field is read from that one sample.
+    """
+
+    def __init__(self, prefix: str, stats: Callable[[], Dict], fields: Sequence[str]):
+        self.prefix = prefix
+        self.stats = stats
+        self.fields = tuple(fields)
+
+    def render(self) -> List[str]:
+        sample = self.stats()
+        lines: List[str] = []
+        for field in self.fields:
+            gauge = Gauge(
+                f"{self.prefix}_{field}",
+                f"{field.replace('_', ' ')} ({self.prefix}).",
+                lambda field=field: {(): sample[field]},
+            )
+            lines.extend(gauge.render())
+        return lines
+
+
+def register_stats_gauges(
+    prefix: str, stats: Callable[[], Dict], fields: Optional[Sequence[str]] = None
+):
+    """Expose numeric fields of a component's stats() dict as gauges."""
+    if fields is None:
+        fields = [k for k, v in stats().items() if isinstance(v, (int, float))]
+    registry.register(StatsGauges(prefix, stats, fields))
@@ -0,0 +1,379 @@
+# optimizer.py
+import copy
+import json
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# Marker for "every column of this frame is needed downstream".
+ALL_COLUMNS = None
+
+PUSHABLE_FILTER_OPERATORS = ["==", ">", "<", ">=", "<=", "!="]
+ROW_PRESERVING_OPS = ["filter_rows", "sort_column"]
+# Steps whose first N output rows come from the first N input rows.
+PREFIX_PRESERVING_OPS = ["drop_columns", "rename_column"]
+# display_data prints the first 5 rows of frames longer than 10 rows, so 11
+# rows print exactly like the full frame.
+DISPLAY_ROWS_NEEDED = 11
+
+
+def _consumers(operations: List[Dict[str, Any]]) -> Dict[str, List[int]]:
+    consumers: Dict[str, List[int]] = {}
+    for i, op in enumerate(operations):
+        keys = [op.get("input_data_key")]
+        if op.get("operation_type") == "merge_dataframes":
+            keys.append((op.get("parameters") or {}).get("right_data_key"))
+        for key in keys:
+            if key:
+                consumers.setdefault(key, []).append(i)
+    return consumers
+
+
+def _is_single_assignment(operations: List[Dict[str, Any]]) -> bool:
+    outputs = [op.get("output_data_key") for op in operations if op.get("output_data_key")]
+    return len(outputs) == len(set(outputs))
+
+
+def _is_numeric_filter(params: Dict[str, Any]) -> bool:
+    value = params.get("value")
+    return (
+        isinstance(value, (int, float))
+        and not isinstance(value, bool)
+        and params.get("operator", "==") in PUSHABLE_FILTER_OPERATORS
+        and bool(params.get("column"))
+    )
+
+
+def _sink_index(operations: List[Dict[str, Any]]) -> Optional[int]:
+    """Index of the step whose result execute_plan returns as final output."""
+    for i in range(len(operations) - 1, -1, -1):
+        if operations[i].get("operation_type") != "display_data":
+            return i
+    return None
+
+
+def _union(current: Optional[Set[str]], extra: Optional[Set[str]]) -> Optional[Set[str]]:
+    if current is ALL_COLUMNS or extra is ALL_COLUMNS:
+        return ALL_COLUMNS
+    return current | extra
+
+
+def plan_limit(plan: Dict[str, Any]) -> Optional[int]:
+    """The plan's optional row limit on its final output, if valid."""
+    limit = plan.get("limit")
+    if isinstance(limit, int) and not isinstance(limit, bool) and limit > 0:
+        return limit
+    return None
+
+
+def _max_rows(current: Optional[int], extra: Optional[int]) -> Optional[int]:
+    # None means every row is needed.
+    if current is None or extra is None:
+        return None
+    return max(current, extra)
+
+
+def data_key_last_uses(operations: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Index of the last step that reads each data key."""
+    return {key: users[-1] for key, users in _consumers(operations).items()}
+
+
+def _eliminate_dead_steps(operations: List[Dict[str, Any]], rewrites: List[str]):
+    """
+    Removes steps whose result is never consumed: not read by a later step,
+    not displayed and not the step whose result the plan returns.
+    """
+    changed = True
+    while changed:
+        changed = False
+        consumers = _consumers(operations)
+        sink = _sink_index(operations)
+        for i, op in enumerate(operations):
+            if i == sink or op.get("operation_type") == "display_data":
+                continue
+            output_key = op.get("output_data_key")
+            if output_key and any(j > i for j in consumers.get(output_key, [])):
+                continue
+            rewrites.append(
+                f"Removed dead step {op.get('operation_type')}"
+                + (f" -> '{output_key}'" if output_key else "")
+                + "; its result is never used."
+            )
+            del operations[i]
+            changed = True
+            break
+
+
+def _filters_before_sorts(operations: List[Dict[str, Any]], rewrites: List[str]):
+    """
+    sort -> filter becomes filter -> sort when the sort output feeds only the
+    filter. Sorting is stable, so both orders produce the same rows in the same
+    order; only the row labels differ, and those are renumbered by the sort.
+    """
+    changed = True
+    while changed:
+        changed = False
+        consumers = _consumers(operations)
+        for j, op in enumerate(operations):
+            if op.get("operation_type") != "filter_rows":
+                continue
+            sorted_key = op.get("input_data_key")
+            if not sorted_key or consumers.get(sorted_key) != [j]:
+                continue
+            producers = [
+                i for i in range(j) if operations[i].get("output_data_key") == sorted_key
+            ]
+            if not producers or operations[producers[0]].get("operation_type") != "sort_column":
+                continue
+            i = producers[0]
+            sort_op = operations[i]
+            operations[i] = {
+                **op,
+                "input_data_key": sort_op.get("input_data_key"),
+                "output_data_key": sorted_key,
+            }
+            operations[j] = {
+                **sort_op,
+                "input_data_key": sorted_key,
+                "output_data_key": op.get("output_data_key"),
+            }
+            rewrites.append(
+                f"Moved filter_rows on '{op['parameters'].get('column')}' ahead of "
+                f"sort_column on '{sort_op['parameters'].get('column')}'."
+            )
+            changed = True
+            break
+
+
+def _push_filters_into_reads(operations: List[Dict[str, Any]], rewrites: List[str]):
+    """Fold numeric filters that directly consume a read into the read itself."""
+    changed = True
+    while changed:
+        changed = False
+        consumers = _consumers(operations)
+        for i, op in enumerate(operations):
+            if op.get("operation_type") != "read_csv" or not op.get("output_data_key"):
+                continue
+            users = consumers.get(op["output_data_key"], [])
+            if len(users) != 1:
+                continue
+            filter_op = operations[users[0]]
+            if filter_op.get("operation_type") != "filter_rows":
+                continue
+            filter_params = filter_op.get("parameters") or {}
+            if not _is_numeric_filter(filter_params):
+                continue
+            params = op.setdefault("parameters", {})
+            params["filters"] = params.get("filters", []) + [dict(filter_params)]
+            op["output_data_key"] = filter_op.get("output_data_key")
+            del operations[users[0]]
+            rewrites.append(
+                f"Pushed filter {filter_params['column']} {filter_params.get('operator', '==')} "
+                f"{filter_params['value']} into read_csv of '{params.get('filepath')}'."
+            )
+            changed = True
+            break
+
+
+def _has_mangled_duplicates(columns: List[str]) -> bool:
+    names = set(columns)
+    return any(
+        re.search(r"\.\d+$", column) and column.rsplit(".", 1)[0] in names
+        for column in columns
+    )
+
+
+def _push_projections_into_reads(
+    operations: List[Dict[str, Any]],
+    available_columns: Optional[List[str]],
+    rewrites: List[str],
+):
+    """Backward column-liveness pass that sets read_csv 'usecols'."""
+    if not available_columns or _has_mangled_duplicates(available_columns):
+        return
+    header = set(available_columns)
+    sink = _sink_index(operations)
+    needed: Dict[str, Optional[Set[str]]] = {}
+    read_needs: Dict[int, Optional[Set[str]]] = {}
+
+    for i in range(len(operations) - 1, -1, -1):
+        op = operations[i]
+        op_type = op.get("operation_type")
+        params = op.get("parameters") or {}
+        output_key = op.get("output_data_key")
+        if i == sink:
+            out_need: Optional[Set[str]] = ALL_COLUMNS
+        elif output_key:
+            out_need = needed.get(output_key, set())
+        else:
+            out_need = set()
+
+        if op_type == "read_csv":
+            filter_columns = {f.get("column") for f in params.get("filters", [])}
+            read_needs[i] = _union(out_need, filter_columns)
+            continue
+
+        in_need: Optional[Set[str]]
+        if op_type in ROW_PRESERVING_OPS:
+            in_need = _union(out_need, {params.get("column")})
+        elif op_type in ["calculate_sum", "calculate_average"]:
+            in_need = {params.get("column")}
+        elif op_type == "group_and_aggregate":
+            in_need = set(params.get("by_columns") or []) | {
+                agg.get("column") for agg in params.get("aggregations") or []
+            }
+        elif op_type == "rename_column" and out_need is not ALL_COLUMNS:
+            in_need = (out_need - {params.get("new_name")}) | {params.get("old_name")}
+        elif op_type == "drop_columns" and out_need is not ALL_COLUMNS:
+            dropped = set(params.get("columns_to_drop") or [])
+            # Dropped columns must exist for the step to succeed, so they are
+            # read unless the header proves they exist and they can be pruned.
+            in_need = out_need if dropped <= header else out_need | dropped
+        else:
+            in_need = ALL_COLUMNS
+
+        keys = [op.get("input_data_key")]
+        if op_type == "merge_dataframes":
+            keys.append(params.get("right_data_key"))
+        for key in keys:
+            if key:
+                needed[key] = _union(needed.get(key, set()), in_need)
+
+    for i, need in read_needs.items():
+        if need is ALL_COLUMNS or not need or not need <= header or need == header:
+            continue
+        params = operations[i].setdefault("parameters", {})
+        params["usecols"] = [column for column in available_columns if column in need]
+        rewrites.append(
+            f"Reading only {len(params['usecols'])} of {len(available_columns)} columns "
+            f"from '{params.get('filepath')}': {', '.join(params['usecols'])}."
+        )
+    _prune_drops(operations, rewrites)
+
+
+def _prune_drops(operations: List[Dict[str, Any]], rewrites: List[str]):
+    """Remove dropped columns that a projected read never loaded."""
+    schemas: Dict[str, Optional[List[str]]] = {}
+    aliases: Dict[str, str] = {}
+    i = 0
+    while i < len(operations):
+        op = operations[i]
+        for field in ["input_data_key"]:
+            if op.get(field) in aliases:
+                op[field] = aliases[op[field]]
+        params = op.get("parameters") or {}
+        if params.get("right_data_key") in aliases:
+            params["right_data_key"] = aliases[params["right_data_key"]]
+        op_type = op.get("operation_type")
+        schema = schemas.get(op.get("input_data_key")) if op.get("input_data_key") else None
+        out_schema: Optional[List[str]] = None
+
+        if op_type == "read_csv":
+            out_schema = params.get("usecols")
+        elif op_type in ROW_PRESERVING_OPS:
+            out_schema = schema
+        elif op_type == "rename_column" and schema is not None:
+            out_schema = [
+                params.get("new_name") if c == params.get("old_name") else c for c in schema
+            ]
+        elif op_type == "drop_columns" and schema is not None:
+            dropped = params.get("columns_to_drop") or []
+            kept_drops = [c for c in dropped if c in schema]
+            if len(kept_drops) < len(dropped):
+                if kept_drops:
+                    params["columns_to_drop"] = kept_drops
+                    rewrites.append(
+                        f"Dropping only {', '.join(kept_drops)}; the other columns were never read."
+                    )
+                elif op.get("output_data_key") and op.get("input_data_key"):
+                    aliases[op["output_data_key"]] = op["input_data_key"]
+                    rewrites.append(
+                        "Removed drop_columns; none of its columns were read."
+                    )
+                    del operations[i]
+                    continue
+            out_schema = [c for c in schema if c not in kept_drops]
+
+        if op.get("output_data_key"):
+            schemas[op["output_data_key"]] = out_schema
+        i += 1
+
+
+def _push_limits_into_sorts(
+    operations: List[Dict[str, Any]], limit: Optional[int], rewrites: List[str]
+):
+    """
+    Backward pass over how many leading rows of each frame are used. A sort
+    whose result is only needed up to its first N rows (the plan limit, or
+    what display_data prints) gets a 'limit' so it selects those N rows.
+    """
+    sink = _sink_index(operations)
+    needed: Dict[str, Optional[int]] = {}
+
+    for i in range(len(operations) - 1, -1, -1):
+        op = operations[i]
+        op_type = op.get("operation_type")
+        params = op.get("parameters") or {}
+        output_key = op.get("output_data_key")
+        out_need: Optional[int] = 0
+        if output_key:
+            out_need = needed.get(output_key, 0)
+        if i == sink:
+            out_need = _max_rows(out_need, limit)
+
+        if op_type == "display_data":
+            in_need: Optional[int] = DISPLAY_ROWS_NEEDED
+        elif op_type in PREFIX_PRESERVING_OPS:
+            in_need = out_need
+        else:
+            if op_type == "sort_column" and out_need:
+                op.setdefault("parameters", {})["limit"] = out_need
+                rewrites.append(
+                    f"Sort on '{params.get('column')}' keeps only the top {out_need} rows."
+                )
+            in_need = None
+
+        keys = [op.get("input_data_key")]
+        if op_type == "merge_dataframes":
+            keys.append(params.get("right_data_key"))
+        for key in keys:
+            if key:
+                needed[key] = _max_rows(needed.get(key, 0), in_need)
+
+
+def optimize_plan(
+    plan: Dict[str, Any], available_columns: Optional[List[str]] = None
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Rewrites an LLM plan so that less data is parsed and held: dead steps are
+    removed, filters move ahead of sorts, numeric filters are pushed into the read, reads only
+    load the columns the rest of the plan uses, and sorts whose result is only
+    needed up to a few rows keep just those rows. Returns the rewritten plan and
+    an explain dict with the plan before and after and the applied rewrites.
+    """
+    before = copy.deepcopy(plan)
+    operations = copy.deepcopy(plan.get("operations") or [])
+    rewrites: List[str] = []
+
+    if not operations:
+        return plan, {"before": before, "after": plan, "rewrites": rewrites}
+    if not _is_single_assignment(operations):
+        rewrites.append("Skipped: the plan writes the same data key more than once.")
+        return plan, {"before": before, "after": plan, "rewrites": rewrites}
+
+    _eliminate_dead_steps(operations, rewrites)
+    _filters_before_sorts(operations, rewrites)
+    _push_filters_into_reads(operations, rewrites)
+    _push_projections_into_reads(operations, available_columns, rewrites)
+    _push_limits_into_sorts(operations, plan_limit(plan), rewrites)
+
+    optimized = {**plan, "operations": operations}
+    return optimized, {"before": before, "after": optimized, "rewrites": rewrites}
+
+
+def render_explain(explain: Dict[str, Any]) -> str:
+    lines = ["Plan before optimization:", json.dumps(explain["before"], indent=2)]
+    lines.append("Rewrites:")
+    lines.extend(f"  - {rewrite}" for rewrite in explain["rewrites"] or ["(none)"])
+    lines.append("Plan after optimization:")
+    lines.append(json.dumps(explain["after"], indent=2))
+    return "\n".join(lines)
@@ -0,0 +1,184 @@
+# parallel_csv.py
+import io
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Union
+
+import dotenv
+import pandas as pd
+
+from execution_trace import trace_log
+
+dotenv.load_dotenv()
+
+PARALLEL_PARSE_MIN_BYTES = int(os.environ.get("PARALLEL_PARSE_MIN_BYTES", 256 * 1024**2))
+PARALLEL_PARSE_WORKERS = int(os.environ.get("PARALLEL_PARSE_WORKERS", os.cpu_count() or 1))
+SCAN_BLOCK_SIZE = 16 * 1024**2
+
+_pools: Dict[int, ProcessPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    with _pools_lock:
+        if workers not in _pools:
+            _pools[workers] = ProcessPoolExecutor(max_workers=workers)
+        return _pools[workers]
+
+
+def partition_offsets(path: str, parts: int) -> List[int]:
+    """
+    Byte offsets that split a CSV into up to `parts` ranges of whole records.
+    The first offset is the end of the header record and the last is the file
+    size. The quote state is tracked from the start of the file, so a newline
+    inside a quoted field is never taken as a record boundary; escaped quotes
+    ("") toggle the state twice and cancel out.
+    """
+    size = os.path.getsize(path)
+    targets = [size * i // parts for i in range(parts)]
+    offsets: List[int] = []
+    in_quotes = False
+    with open(path, "rb") as f:
+        block_start = 0
+        block = f.read(SCAN_BLOCK_SIZE)
+        # Index in block up to which the quote state is known.
+        position = 0
+        while block and targets:
+            target = max(targets[0] - block_start, position)
+            record_end = -1
+            if target < len(block):
+                in_quotes ^= block.count(b'"', position, target) % 2 == 1
+                position = target
+                while True:
+                    newline = block.find(b"\n", position)
+                    if newline < 0:
+                        break
+                    in_quotes ^= block.count(b'"', position, newline) % 2 == 1
+                    position = newline + 1
+                    if not in_quotes:
+                        record_end = block_start + position
+                        break
+            if record_end < 0:
+                in_quotes ^= block.count(b'"', position) % 2 == 1
+                block_start += len(block)
+                block = f.read(SCAN_BLOCK_SIZE)
+                position = 0
+                continue
+            offsets.append(record_end)
+            targets = [t for t in targets[1:] if t >= record_end]
+    if not offsets or offsets[-1] < size:
+        offsets.append(size)
+    return offsets
+
+
+def _parse_range(
+    path: str, header: bytes, start: int, end: int, read_options: Dict[str, Any]
+) -> pd.DataFrame:
+    with open(path, "rb") as f:
+        f.seek(start)
+        body = f.read(end - start)
+    return pd.read_csv(io.BytesIO(header + body), **read_options)
+
+
+def _misaligned(partitions: List[pd.DataFrame]) -> bool:
+    """
+    Whether some range was not cut at a record boundary. A stray quote in an
+    unquoted field flips the quote state, and a range cut inside a quoted
+    field then fails to parse or starts with a record of the wrong width,
+    which read_csv turns into an index column.
+    """
+    first = partitions[0]
+    return any(
+        not partition.columns.equals(first.columns)
+        or type(partition.index) is not type(first.index)
+        or partition.index.names != first.index.names
+        for partition in partitions[1:]
+    )
+
+
+def _mismatched_columns(partitions: List[pd.DataFrame]) -> Optional[List[str]]:
+    """
+    Columns whose inferred dtype differs between partitions in a way concat
+    would not resolve like a single read_csv. int64/float64 mixes are fine
+    (a single read also ends up float64). Returns None when a boolean or
+    unsigned column is involved, since no per-column dtype reproduces
+    read_csv's inference for those.
+    """
+    mismatched = []
+    for column in partitions[0].columns:
+        dtypes = {partition[column].dtype for partition in partitions}
+        if len(dtypes) == 1 or all(dtype.kind in "if" for dtype in dtypes):
+            continue
+        if any(dtype.kind in "bu" for dtype in dtypes):
+            return None
+        mismatched.append(column)
+    return mismatched
+
+
+def read_csv_parallel(
+    path: str,
+    workers: int = PARALLEL_PARSE_WORKERS,
+    concat: bool = True,
+    **read_options,
+) -> Optional[Union[pd.DataFrame, List[pd.DataFrame]]]:
+    """
+    Parses byte ranges of a CSV in a process pool. Returns the concatenated
+    frame, or the partitions in file order when concat is False. Returns None
+    when the ranges were not cut at record boundaries or the partitions
+    cannot be reconciled with what a single read_csv would infer, so the
+    caller should read the file in one go.
+    """
+    offsets = partition_offsets(path, workers)
+    with open(path, "rb") as f:
+        header = f.read(offsets[0])
+    ranges = list(zip(offsets[:-1], offsets[1:]))
+    if not ranges:
+        return pd.read_csv(path, **read_options)
+
+    pool = _get_pool(workers)
+
+    def parse_all(options: Dict[str, Any]) -> Optional[List[pd.DataFrame]]:
+        futures = [
+            pool.submit(_parse_range, path, header, start, end, options)
+            for start, end in ranges
+        ]
+        try:
+            parsed = [future.result() for future in futures]
+        except pd.errors.ParserError as e:
+            # A single read reports the error again if the file itself is malformed.
+            trace_log(f"PARSER: A range did not parse on its own ({e}); reading serially.")
+            return None
+        if _misaligned(parsed):
+            trace_log("PARSER: Ranges were not cut at record boundaries; reading serially.")
+            return None
+        # Ranges holding only blank lines parse to empty all-object frames.
+        return [partition for partition in parsed if len(partition)] or parsed[:1]
+
+    trace_log(f"PARSER: Parsing '{os.path.basename(path)}' as {len(ranges)} ranges in parallel...")
+    partitions = parse_all(read_options)
+    if partitions is None:
+        return None
+    mismatched = _mismatched_columns(partitions)
+    if mismatched is None:
+        trace_log("PARSER: Boolean column dtypes differ between ranges; reading serially.")
+        return None
+    if mismatched:
+        # A column read_csv keeps as strings for the whole file may look
+        # numeric within one range; re-parse it as strings everywhere.
+        trace_log(f"PARSER: Re-parsing {mismatched} as strings; ranges inferred different dtypes.")
+        partitions = parse_all({**read_options, "dtype": {c: object for c in mismatched}})
+        if partitions is None:
+            return None
+    if not concat:
+        return partitions
+    return pd.concat(partitions, ignore_index=True)
+
+
+def parse_csv(path: str, **read_options) -> pd.DataFrame:
+    """pd.read_csv that parses large files in parallel."""
+    if PARALLEL_PARSE_WORKERS > 1 and os.path.getsize(path) >= PARALLEL_PARSE_MIN_BYTES:
+        df = read_csv_parallel(path, **read_options)
+        if df is not None:
+            return df
+    return pd.read_csv(path, **read_options)
@@ -0,0 +1,129 @@
+# plan_cache.py
+import copy
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import dotenv
+
+dotenv.load_dotenv()
+
+PLAN_CACHE_PATH = os.environ.get(
+    "PLAN_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "plan_cache.sqlite3"),
+)
+PLAN_CACHE_TTL_SECONDS = float(os.environ.get("PLAN_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+PLAN_CACHE_MAX_ENTRIES = int(os.environ.get("PLAN_CACHE_MAX_ENTRIES", 5000))
+
+
+def normalize_query(user_query: str) -> str:
+    query = re.sub(r"\s+", " ", user_query.strip().lower())
+    return query.rstrip(" ?.!")
+
+
+def plan_cache_key(
+    user_query: str, columns: List[str], model_name: str, prompt_version: str
+) -> str:
+    payload = json.dumps(
+        [normalize_query(user_query), list(columns), model_name, prompt_version]
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def rebind_filepaths(plan: Dict[str, Any], filepath: str) -> Dict[str, Any]:
+    """Point every read_csv step of a cached plan at the current file."""
+    plan = copy.deepcopy(plan)
+    for op in plan.get("operations", []):
+        if op.get("operation_type") == "read_csv":
+            op.setdefault("parameters", {})["filepath"] = filepath
+    return plan
+
+
+class PlanCache:
+    """
+    SQLite-backed cache of LLM plans keyed by (normalized query, ordered
+    columns, model, prompt version), with a TTL and an LRU entry cap.
+    """
+
+    def __init__(
+        self,
+        path: str = PLAN_CACHE_PATH,
+        ttl_seconds: float = PLAN_CACHE_TTL_SECONDS,
+        max_entries: int = PLAN_CACHE_MAX_ENTRIES,
+    ):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS plans ("
+                " key TEXT PRIMARY KEY, plan TEXT NOT NULL,"
+                " created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS plans_last_used ON plans (last_used)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT plan, created_at FROM plans WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] > self.ttl_seconds:
+                conn.execute("DELETE FROM plans WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE plans SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, key: str, plan: Dict[str, Any]):
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO plans (key, plan, created_at, last_used)"
+                " VALUES (?, ?, ?, ?)",
+                (key, json.dumps(plan), now, now),
+            )
+            conn.execute(
+                "DELETE FROM plans WHERE key IN ("
+                " SELECT key FROM plans ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock, self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM plans").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+plan_cache = PlanCache()
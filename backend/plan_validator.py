@@ -0,0 +1,426 @@
+# plan_validator.py
+import copy
+import os
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import dotenv
+import pandas as pd
+
+from compaction import COMPARISONS
+from dataset_store import Dataset
+from rule_planner import match_column
+
+dotenv.load_dotenv()
+
+PLAN_VALIDATION_ENABLED = os.environ.get("PLAN_VALIDATION_ENABLED", "1").lower() in ("1", "true", "yes")
+# An LLM plan that fails validation is re-planned once with the errors in the
+# prompt; without this it is rejected straight away.
+PLAN_VALIDATION_REPLAN = os.environ.get("PLAN_VALIDATION_REPLAN", "1").lower() in ("1", "true", "yes")
+# Lowest match_column score at which a misspelled column or data key is
+# replaced instead of rejected.
+PLAN_REPAIR_MIN_SCORE = float(os.environ.get("PLAN_REPAIR_MIN_SCORE", 0.85))
+# Longest error summary sent back to the LLM.
+FEEDBACK_MAX_CHARS = 600
+
+NUMERIC_FUNCTIONS = ["sum", "mean"]
+AGGREGATION_FUNCTIONS = ["sum", "mean", "count", "min", "max"]
+MERGE_HOWS = ["inner", "left", "right", "outer"]
+SORT_ORDERS = {"ascending": "ascending", "asc": "ascending", "descending": "descending", "desc": "descending"}
+OPERATOR_ALIASES = {"=": "==", "<>": "!=", "=>": ">=", "=<": "<=", "eq": "==", "ne": "!=",
+                    "gt": ">", "lt": "<", "ge": ">=", "le": "<="}
+
+# A schema maps column names to a kind: "numeric", "bool", "datetime",
+# "string", or None when the sample did not tell. A data key holds a schema,
+# SCALAR for the result of calculate_sum/calculate_average, or UNKNOWN_FRAME
+# for a frame whose columns cannot be known without reading it.
+SCALAR = "scalar"
+UNKNOWN_FRAME = "unknown_frame"
+Schema = Dict[str, Optional[str]]
+
+
+class PlanValidationError(ValueError):
+    def __init__(self, errors: List[str], repairs: Optional[List[str]] = None):
+        self.errors = errors
+        self.repairs = repairs or []
+        super().__init__("; ".join(errors))
+
+    def feedback(self) -> str:
+        """The errors in one line, short enough to send back to the LLM."""
+        text = "; ".join(self.errors)
+        if len(text) > FEEDBACK_MAX_CHARS:
+            text = text[: FEEDBACK_MAX_CHARS - 3] + "..."
+        return text
+
+
+def column_kind(dtype: Any) -> Optional[str]:
+    if dtype is None:
+        return None
+    if pd.api.types.is_bool_dtype(dtype):
+        return "bool"
+    if pd.api.types.is_numeric_dtype(dtype):
+        return "numeric"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "datetime"
+    return "string"
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _as_text(value: Any) -> str:
+    """A number as it is written in a CSV: 150.0 as '150'."""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _parses_as_number(value: Any) -> bool:
+    try:
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+class PlanValidator:
+    """
+    Checks a plan against the schemas of its datasets before anything is
+    parsed. The schema of every data key is derived step by step from the
+    read_csv columns and dtypes, so a missing column, an aggregate over a
+    string column or a chain from an undefined key is found without running
+    the plan. Mistakes with one obvious fix (a misspelled column or key, an
+    operator or sort-order alias, a missing input key on a linear plan) are
+    repaired in the returned copy; anything else is an error.
+    """
+
+    def __init__(self, datasets: List[Dataset]):
+        self.datasets = datasets
+        self._schemas: Dict[str, Tuple[Schema, bool]] = {}
+
+    def _dataset(self, filepath: str) -> Optional[Dataset]:
+        for dataset in self.datasets:
+            if dataset.matches(filepath):
+                return dataset
+        if len(self.datasets) == 1:
+            return self.datasets[0]
+        return None
+
+    def _dataset_schema(self, dataset: Dataset) -> Tuple[Schema, bool]:
+        if dataset.dataset_id not in self._schemas:
+            dtypes, exact = dataset.dtypes()
+            self._schemas[dataset.dataset_id] = (
+                {column: column_kind(dtype) for column, dtype in dtypes.items()},
+                exact,
+            )
+        return self._schemas[dataset.dataset_id]
+
+    def validate(self, plan: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+        """
+        The plan with repairs applied and the list of repairs made. Raises
+        PlanValidationError listing every problem that could not be repaired.
+        """
+        plan = copy.deepcopy(plan)
+        self.errors: List[str] = []
+        self.repairs: List[str] = []
+        self.keys: Dict[str, Any] = {}
+        # Sampled dtypes are exact for string columns only: a column that is
+        # numeric in the sample may still hold text further down.
+        self.exact = True
+
+        operations = plan.get("operations")
+        if not isinstance(operations, list) or not operations:
+            raise PlanValidationError(["The plan has no 'operations' list."])
+        previous_output: Optional[str] = None
+        # Outputs no later step has read yet; the plan is linear up to a step
+        # while the previous output is the only one.
+        unconsumed: Set[str] = set()
+        for i, op in enumerate(operations):
+            step = f"Step {i + 1}"
+            if not isinstance(op, dict):
+                self.errors.append(f"{step}: not an operation object.")
+                continue
+            op_type = op.get("operation_type")
+            check = getattr(self, f"_check_{op_type}", None) if isinstance(op_type, str) else None
+            if check is None:
+                self.errors.append(f"{step}: unknown operation type '{op_type}'.")
+                continue
+            if not isinstance(op.get("parameters"), dict):
+                op["parameters"] = {}
+            if op_type != "read_csv":
+                if (
+                    not op.get("input_data_key")
+                    and op_type != "display_data"
+                    and previous_output
+                    and unconsumed == {previous_output}
+                ):
+                    op["input_data_key"] = previous_output
+                    self.repairs.append(f"{step}: set the missing input_data_key to '{previous_output}'.")
+                key = op.get("input_data_key")
+                if key and not self._resolve_key(op, "input_data_key", step):
+                    continue
+            output = check(step, op, op["parameters"])
+            unconsumed.discard(op.get("input_data_key"))
+            unconsumed.discard(op["parameters"].get("right_data_key"))
+            output_key = op.get("output_data_key")
+            if output_key and output is not None:
+                self.keys[output_key] = output
+                previous_output = output_key
+                unconsumed.add(output_key)
+        if self.errors:
+            raise PlanValidationError(self.errors, self.repairs)
+        return plan, self.repairs
+
+    def _resolve_key(self, holder: Dict[str, Any], field: str, step: str) -> bool:
+        key = holder.get(field)
+        if key in self.keys:
+            return True
+        match, score = match_column(str(key), list(self.keys))
+        if match is not None and score >= PLAN_REPAIR_MIN_SCORE:
+            holder[field] = match
+            self.repairs.append(f"{step}: replaced unknown data key '{key}' with '{match}'.")
+            return True
+        self.errors.append(f"{step}: data key '{key}' is not produced by an earlier step.")
+        return False
+
+    def _frame(self, step: str, op: Dict[str, Any]) -> Optional[Any]:
+        """The input schema of a step that needs a frame, or None after an error."""
+        key = op.get("input_data_key")
+        if not key:
+            self.errors.append(f"{step}: '{op['operation_type']}' needs an input_data_key.")
+            return None
+        schema = self.keys[key]
+        if schema == SCALAR:
+            self.errors.append(
+                f"{step}: '{op['operation_type']}' needs a table but '{key}' holds a single value."
+            )
+            return None
+        return schema
+
+    def _column(
+        self, step: str, schema: Any, params: Dict[str, Any], field: str, role: str = "Column"
+    ) -> Optional[str]:
+        """The repaired column named by params[field], or None after an error."""
+        column = params.get(field)
+        if not isinstance(column, str) or not column:
+            self.errors.append(f"{step}: missing '{field}'.")
+            return None
+        return self._repair_column(step, schema, column, role, lambda name: params.__setitem__(field, name))
+
+    def _repair_column(self, step: str, schema: Any, column: str, role: str, replace) -> Optional[str]:
+        if schema == UNKNOWN_FRAME or column in schema:
+            return column
+        match, score = match_column(column, list(schema))
+        if match is not None and score >= PLAN_REPAIR_MIN_SCORE:
+            replace(match)
+            self.repairs.append(f"{step}: replaced unknown column '{column}' with '{match}'.")
+            return match
+        self.errors.append(
+            f"{step}: {role} '{column}' does not exist. Available: {', '.join(map(str, schema))}."
+        )
+        return None
+
+    def _kind(self, schema: Any, column: str) -> Optional[str]:
+        return None if schema == UNKNOWN_FRAME else schema.get(column)
+
+    def _check_read_csv(self, step: str, op: Dict[str, Any], params: Dict[str, Any]) -> Any:
+        filepath = params.get("filepath")
+        if not filepath:
+            self.errors.append(f"{step}: read_csv needs a 'filepath'.")
+            return None
+        dataset = self._dataset(str(filepath))
+        if dataset is None:
+            if self.datasets:
+                names = ", ".join(str(d.filename) for d in self.datasets)
+                self.errors.append(f"{step}: '{filepath}' is not one of the uploaded files ({names}).")
+                return None
+            return UNKNOWN_FRAME
+        schema, exact = self._dataset_schema(dataset)
+        self.exact = self.exact and exact
+        return dict(schema)
+
+    def _check_scalar(self, step: str, op: Dict[str, Any], params: Dict[str, Any], label: str) -> Any:
+        schema = self._frame(step, op)
+        if schema is None:
+            return None
+        column = self._column(step, schema, params, "column")
+        if column is not None and self._kind(schema, column) in ("string", "datetime"):
+            self.errors.append(f"{step}: cannot take the {label} of non-numeric column '{column}'.")
+        return SCALAR
+
+    def _check_calculate_sum(self, step, op, params):
+        return self._check_scalar(step, op, params, "sum")
+
+    def _check_calculate_average(self, step, op, params):
+        return self._check_scalar(step, op, params, "average")
+
+    def _check_filter_rows(self, step, op, params):
+        schema = self._frame(step, op)
+        if schema is None:
+            return None
+        column = self._column(step, schema, params, "column")
+        operator = params.get("operator", "==")
+        if operator not in COMPARISONS:
+            alias = OPERATOR_ALIASES.get(str(operator).strip().lower())
+            if alias is None:
+                self.errors.append(
+                    f"{step}: unsupported filter operator '{operator}'. Use one of {', '.join(COMPARISONS)}."
+                )
+            else:
+                params["operator"] = alias
+                self.repairs.append(f"{step}: replaced filter operator '{operator}' with '{alias}'.")
+        if column is None:
+            return schema
+        value = params.get("value")
+        kind = self._kind(schema, column)
+        if kind == "string" and _is_number(value):
+            if params.get("operator", "==") in ("==", "!="):
+                # The executor refuses to compare numbers with text; codes such
+                # as zip or account numbers are stored as text, so match as text.
+                params["value"] = _as_text(value)
+                self.repairs.append(f"{step}: compared text column '{column}' with '{value}' as text.")
+            else:
+                # Ordering text against a number's text would be lexicographic.
+                self.errors.append(
+                    f"{step}: cannot order text column '{column}' against the number {value}."
+                )
+        elif kind == "numeric" and self.exact and not _is_number(value) and not _parses_as_number(value):
+            self.errors.append(f"{step}: cannot compare numeric column '{column}' with '{value}'.")
+        return schema
+
+    def _check_sort_column(self, step, op, params):
+        schema = self._frame(step, op)
+        if schema is None:
+            return None
+        self._column(step, schema, params, "column")
+        order = params.get("order", "ascending")
+        if order not in ("ascending", "descending"):
+            repaired = SORT_ORDERS.get(str(order).strip().lower())
+            if repaired is None:
+                self.errors.append(f"{step}: unsupported sort order '{order}'. Use 'ascending' or 'descending'.")
+            else:
+                params["order"] = repaired
+                self.repairs.append(f"{step}: replaced sort order '{order}' with '{repaired}'.")
+        return schema
+
+    def _check_display_data(self, step, op, params):
+        return None
+
+    def _check_group_and_aggregate(self, step, op, params):
+        schema = self._frame(step, op)
+        if schema is None:
+            return None
+        by_columns = params.get("by_columns")
+        aggregations = params.get("aggregations")
+        if isinstance(by_columns, str):
+            by_columns = params["by_columns"] = [by_columns]
+            self.repairs.append(f"{step}: wrapped by_columns '{by_columns[0]}' in a list.")
+        if not by_columns:
+            self.errors.append(f"{step}: group_and_aggregate needs 'by_columns'.")
+        if not aggregations or not isinstance(aggregations, list):
+            self.errors.append(f"{step}: group_and_aggregate needs 'aggregations'.")
+            return None
+        output: Schema = {}
+        for position, column in enumerate(by_columns or []):
+            column = self._repair_column(
+                step, schema, str(column), "Grouping column",
+                lambda name, position=position: by_columns.__setitem__(position, name),
+            )
+            if column is not None:
+                output[column] = self._kind(schema, column)
+        for agg in aggregations:
+            if not isinstance(agg, dict):
+                self.errors.append(f"{step}: aggregation {agg!r} is not an object.")
+                continue
+            function = agg.get("function")
+            column = self._column(step, schema, agg, "column", "Aggregation column")
+            if function not in AGGREGATION_FUNCTIONS:
+                self.errors.append(
+                    f"{step}: unsupported aggregation function '{function}'. "
+                    f"Use {', '.join(AGGREGATION_FUNCTIONS)}."
+                )
+                continue
+            if column is None:
+                continue
+            kind = self._kind(schema, column)
+            if function in NUMERIC_FUNCTIONS and kind in ("string", "datetime"):
+                self.errors.append(f"{step}: cannot take the {function} of non-numeric column '{column}'.")
+            output_name = agg.get("output_column_name", f"{column}_{function}")
+            output[output_name] = kind if function in ("min", "max") else "numeric"
+        return UNKNOWN_FRAME if schema == UNKNOWN_FRAME else output
+
+    def _check_drop_columns(self, step, op, params):
+        schema = self._frame(step, op)
+        if schema is None:
+            return None
+        columns = params.get("columns_to_drop")
+        if isinstance(columns, str):
+            columns = [columns]
+        if not columns:
+            self.errors.append(f"{step}: drop_columns needs 'columns_to_drop'.")
+            return schema
+        if schema == UNKNOWN_FRAME:
+            return schema
+        kept = [column for column in columns if column in schema]
+        unknown = [column for column in columns if column not in schema]
+        if unknown:
+            # Dropping a column that is not there leaves the frame as the
+            # plan wanted it.
+            self.repairs.append(f"{step}: removed unknown columns {unknown} from columns_to_drop.")
+        if not kept:
+            self.errors.append(f"{step}: none of the columns to drop exist: {', '.join(map(str, columns))}.")
+            return schema
+        params["columns_to_drop"] = kept
+        return {column: kind for column, kind in schema.items() if column not in kept}
+
+    def _check_rename_column(self, step, op, params):
+        schema = self._frame(step, op)
+        if schema is None:
+            return None
+        old_name = self._column(step, schema, params, "old_name")
+        new_name = params.get("new_name")
+        if not new_name:
+            self.errors.append(f"{step}: rename_column needs 'new_name'.")
+            return schema
+        if old_name is None or schema == UNKNOWN_FRAME:
+            return schema
+        return {new_name if column == old_name else column: kind for column, kind in schema.items()}
+
+    def _check_merge_dataframes(self, step, op, params):
+        left = self._frame(step, op)
+        right_key = params.get("right_data_key")
+        if not right_key:
+            self.errors.append(f"{step}: merge_dataframes needs 'right_data_key'.")
+            return None
+        if not self._resolve_key(params, "right_data_key", step):
+            return None
+        right = self.keys[params["right_data_key"]]
+        if right == SCALAR:
+            self.errors.append(f"{step}: right_data_key '{right_key}' holds a single value, not a table.")
+            return None
+        how = params.get("how", "inner")
+        if how not in MERGE_HOWS:
+            self.errors.append(f"{step}: unsupported merge type '{how}'. Use {', '.join(MERGE_HOWS)}.")
+        if left is None:
+            return None
+        on_column = params.get("on_column")
+        if not on_column:
+            self.errors.append(f"{step}: merge_dataframes needs 'on_column'.")
+            return None
+        for side, schema in (("left", left), ("right", right)):
+            if schema != UNKNOWN_FRAME and on_column not in schema:
+                self.errors.append(f"{step}: join column '{on_column}' is not in the {side} table.")
+        if left == UNKNOWN_FRAME or right == UNKNOWN_FRAME or on_column not in left or on_column not in right:
+            return UNKNOWN_FRAME
+        # pd.merge suffixes columns other than the key that both sides share.
+        output: Schema = {}
+        for column, kind in left.items():
+            output[f"{column}_x" if column != on_column and column in right else column] = kind
+        for column, kind in right.items():
+            if column != on_column:
+                output[f"{column}_y" if column in left else column] = kind
+        return output
+
+
+def validate_plan(plan: Dict[str, Any], datasets: List[Dataset]) -> Tuple[Dict[str, Any], List[str]]:
+    return PlanValidator(datasets).validate(plan)
@@ -0,0 +1,108 @@
+# result_store.py
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import dotenv
+import pandas as pd
+
+from compaction import expand_frame, expanded_dtype
+from frame_cache import frame_nbytes
+
+dotenv.load_dotenv()
+
+# Results with more rows than a page are stored and returned one page at a time.
+RESULT_PAGE_ROWS = int(os.environ.get("RESULT_PAGE_ROWS", 1000))
+RESULT_MAX_PAGE_ROWS = int(os.environ.get("RESULT_MAX_PAGE_ROWS", 10_000))
+RESULT_TTL_SECONDS = float(os.environ.get("RESULT_TTL_SECONDS", 15 * 60))
+RESULT_STORE_MAX_BYTES = int(os.environ.get("RESULT_STORE_MAX_BYTES", 1024**3))
+
+
+def frame_schema(df: pd.DataFrame) -> List[Dict[str, str]]:
+    """Column dtypes as the pages report them, i.e. before any compaction."""
+    return [
+        {"name": str(column), "dtype": str(expanded_dtype(dtype))}
+        for column, dtype in df.dtypes.items()
+    ]
+
+
+def page_records(
+    df: pd.DataFrame, offset: int, limit: int, columns: Optional[List[str]] = None
+) -> List[Dict[str, Any]]:
+    page = df.iloc[offset : offset + limit]
+    if columns is not None:
+        page = page[columns]
+    return expand_frame(page).to_dict(orient="records")
+
+
+class ResultStore:
+    """
+    Process-wide store of large query results, addressed by a random id.
+    Entries expire after a TTL; the least recently read ones are dropped
+    first when the total memory of the stored frames exceeds the budget.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = RESULT_TTL_SECONDS,
+        max_bytes: int = RESULT_STORE_MAX_BYTES,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, Tuple[pd.DataFrame, int, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _purge_expired(self, now: float):
+        for result_id in [k for k, (_, _, expires) in self._entries.items() if expires <= now]:
+            self.current_bytes -= self._entries.pop(result_id)[1]
+            self.expirations += 1
+
+    def put(self, df: pd.DataFrame) -> Dict[str, Any]:
+        """Stores a result frame and returns its handle."""
+        result_id = secrets.token_urlsafe(16)
+        nbytes = frame_nbytes(df)
+        now = time.time()
+        with self._lock:
+            self._purge_expired(now)
+            self._entries[result_id] = (df, nbytes, now + self.ttl_seconds)
+            self.current_bytes += nbytes
+            # The new entry stays even if it alone exceeds the budget.
+            while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_bytes, _) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+        return {
+            "result_id": result_id,
+            "total_rows": len(df),
+            "schema": frame_schema(df),
+            "expires_in_seconds": self.ttl_seconds,
+        }
+
+    def get(self, result_id: str) -> Optional[pd.DataFrame]:
+        with self._lock:
+            self._purge_expired(time.time())
+            entry = self._entries.get(result_id)
+            if entry is None:
+                return None
+            self._entries.move_to_end(result_id)
+            return entry[0]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._purge_expired(time.time())
+            return {
+                "entries": len(self._entries),
+                "current_bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+result_store = ResultStore()
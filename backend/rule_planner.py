@@ -0,0 +1,327 @@
+# rule_planner.py
+import os
+import re
+import threading
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import dotenv
+import pandas as pd
+
+from execution_trace import trace_log
+
+dotenv.load_dotenv()
+
+RULE_PLANNER_ENABLED = os.environ.get("RULE_PLANNER_ENABLED", "1").lower() in ("1", "true", "yes")
+# Lowest fuzzy column-match score a rule plan may rely on; below it the query
+# goes to the LLM.
+RULE_PLANNER_MIN_CONFIDENCE = float(os.environ.get("RULE_PLANNER_MIN_CONFIDENCE", 0.85))
+# A fuzzy match this close to the runner-up is ambiguous and not trusted.
+AMBIGUITY_MARGIN = 0.05
+
+_LEAD = r"^(?:(?:please|show|list|display|get|find|give|return|compute|calculate|tell|what|what's|whats|is|are|was|me|us|all|the)\s+)*"
+_NUMBER = re.compile(r"^-?\d+(?:\.\d+)?$")
+
+_AGGREGATE_FUNCTIONS = {
+    "sum": "sum",
+    "total": "sum",
+    "average": "mean",
+    "avg": "mean",
+    "mean": "mean",
+}
+_AGGREGATE = re.compile(
+    _LEAD + r"(?P<fn>sum|total|average|avg|mean)\s+(?:of\s+)?(?:the\s+)?(?P<col>.+?)"
+    r"(?:\s+(?:by|per|for\s+each|for\s+every|grouped\s+by)\s+(?:the\s+)?(?P<by>.+?))?$",
+    re.IGNORECASE,
+)
+_TOP_N = re.compile(
+    _LEAD + r"(?P<dir>top|bottom|highest|lowest)\s+(?P<n>\d+)"
+    r"(?:\s+[a-z ]+?)?\s+(?:by|on|in\s+terms\s+of|sorted\s+by|ranked\s+by)\s+(?:the\s+)?(?P<col>.+?)$",
+    re.IGNORECASE,
+)
+_EXTREME = re.compile(
+    r"^(?:which|what)\s+(?P<subject>(?:[a-z]+\s+){0,2})(?:has|have|had|with)\s+the\s+"
+    r"(?P<dir>highest|largest|biggest|most|greatest|lowest|smallest|least|fewest)\s+(?P<col>.+?)$",
+    re.IGNORECASE,
+)
+_SORT = re.compile(
+    _LEAD + r"(?:sort|order|rank)\s+(?:(?:the\s+)?(?:data|rows|records|table)\s+)?by\s+(?:the\s+)?"
+    r"(?P<col>.+?)(?:\s+(?:in\s+)?(?P<order>ascending|descending|asc|desc)(?:\s+order)?)?$",
+    re.IGNORECASE,
+)
+_OPERATOR_PHRASES = [
+    (r">=|=>|is greater than or equal to|greater than or equal to|is at least|at least", ">="),
+    (r"<=|=<|is less than or equal to|less than or equal to|is at most|at most", "<="),
+    (r"!=|<>|is not equal to|not equal to|is not|isn't|does not equal", "!="),
+    (r"==|=|is equal to|equal to|equals|is", "=="),
+    (r">|is greater than|greater than|is more than|more than|is above|above|is over|over|exceeds", ">"),
+    (r"<|is less than|less than|is below|below|is under|under|fewer than", "<"),
+]
+_OPERATORS = {
+    phrase: operator for phrases, operator in _OPERATOR_PHRASES for phrase in phrases.split("|")
+}
+_SYMBOLS = [p for p in sorted(_OPERATORS, key=len, reverse=True) if not p[0].isalpha()]
+_WORDS = [p for p in sorted(_OPERATORS, key=len, reverse=True) if p[0].isalpha()]
+_FILTER = re.compile(
+    _LEAD + r"(?:(?:rows|records|entries|items|data)\s+)?(?:where|with|whose|that\s+have|having)\s+"
+    r"(?:the\s+)?(?P<col>.+?)(?:\s*(?P<symbol>"
+    + "|".join(re.escape(p) for p in _SYMBOLS)
+    + r")\s*|\s+(?P<word>"
+    + "|".join(re.escape(p) for p in _WORDS)
+    + r")\s+)(?P<value>.+)$",
+    re.IGNORECASE,
+)
+_DESCENDING = {"top", "highest", "largest", "biggest", "most", "greatest"}
+
+
+def normalize_query(text: str) -> str:
+    """Collapses whitespace and drops trailing punctuation; keeps case for values."""
+    return re.sub(r"\s+", " ", text.strip().rstrip("?.!").strip())
+
+
+def _normalize_name(name: str) -> str:
+    return " ".join(re.sub(r"[^0-9a-z]+", " ", str(name).lower()).split())
+
+
+def match_column(phrase: str, columns: List[str]) -> Tuple[Optional[str], float]:
+    """
+    The column a phrase from the query most likely refers to, and a score in
+    [0, 1]. Exact matches ignoring case and punctuation score 1; otherwise the
+    difflib ratio is used, and a near-tie with another column scores 0.
+    """
+    target = _normalize_name(phrase)
+    scored = []
+    for column in columns:
+        name = _normalize_name(column)
+        if name == target:
+            return column, 1.0
+        scored.append((SequenceMatcher(None, target, name).ratio(), column))
+    if not scored:
+        return None, 0.0
+    scored.sort(key=lambda item: item[0], reverse=True)
+    best_score, best = scored[0]
+    if len(scored) > 1 and best_score - scored[1][0] < AMBIGUITY_MARGIN:
+        return best, 0.0
+    return best, best_score
+
+
+def _parse_value(text: str) -> Optional[Union[int, float, str]]:
+    text = text.strip()
+    if _NUMBER.match(text):
+        return float(text) if "." in text else int(text)
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in "'\"":
+        return text[1:-1]
+    return None
+
+
+def _read(filename: str) -> Dict[str, Any]:
+    return {
+        "operation_type": "read_csv",
+        "parameters": {"filepath": filename},
+        "output_data_key": "data",
+        "description": f"Load the CSV data from '{filename}'.",
+    }
+
+
+def _display(input_key: str, label: str) -> Dict[str, Any]:
+    return {
+        "operation_type": "display_data",
+        "input_data_key": input_key,
+        "output_data_key": None,
+        "parameters": {"label": label},
+        "description": "Display the result.",
+    }
+
+
+class RulePlanner:
+    """
+    Plans simple, single-step questions (sum/average of a column, optionally
+    per group; top or bottom N by a column; sorting; a single comparison
+    filter) without calling the LLM. Patterns must cover the whole query, so
+    any extra clause sends it to the LLM instead. Plans use the same
+    operations JSON the LLM produces.
+
+    "Which ... has the highest ..." is only planned as a one-row sort on a
+    numeric column when its subject is not a column: "which region has the
+    highest sales" asks for a group, not a row.
+    """
+
+    def __init__(self, min_confidence: float = RULE_PLANNER_MIN_CONFIDENCE):
+        self.min_confidence = min_confidence
+        self._lock = threading.Lock()
+        self.matched = 0
+        self.low_confidence = 0
+        self.unmatched = 0
+
+    def _count(self, outcome: str):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def plan(
+        self,
+        user_query: str,
+        filename: str,
+        columns: List[str],
+        dtypes: Optional[Dict[str, Any]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        A plan for the query, or None when the LLM should plan it. Without
+        dtypes, questions that depend on a column being numeric go to the LLM.
+        """
+        query = normalize_query(user_query)
+        for builder in (self._aggregate, self._top_n, self._extreme, self._sort, self._filter):
+            built = builder(query, filename, columns, dtypes or {})
+            if built is None:
+                continue
+            plan, confidence = built
+            if confidence < self.min_confidence:
+                trace_log(
+                    f"RULE PLANNER: Matched '{query}' with confidence {confidence:.2f}; "
+                    f"below {self.min_confidence:.2f}, asking the LLM."
+                )
+                self._count("low_confidence")
+                return None
+            trace_log(f"RULE PLANNER: Planned '{query}' locally (confidence {confidence:.2f}).")
+            self._count("matched")
+            return plan
+        self._count("unmatched")
+        return None
+
+    def _columns(self, columns: List[str], *phrases: str) -> Tuple[List[Optional[str]], float]:
+        matches = [match_column(phrase, columns) for phrase in phrases]
+        return [column for column, _ in matches], min(score for _, score in matches)
+
+    def _aggregate(self, query: str, filename: str, columns: List[str], dtypes: Dict[str, Any]):
+        match = _AGGREGATE.match(query)
+        if not match:
+            return None
+        function = _AGGREGATE_FUNCTIONS[match["fn"].lower()]
+        phrase = match["col"]
+        if match["fn"].lower() == "total" and match_column(f"total {phrase}", columns)[1] == 1.0:
+            # "total revenue" over a column named "Total Revenue".
+            phrase = f"total {phrase}"
+        if match["by"]:
+            (column, by_column), confidence = self._columns(columns, phrase, match["by"])
+            operations = [
+                _read(filename),
+                {
+                    "operation_type": "group_and_aggregate",
+                    "input_data_key": "data",
+                    "output_data_key": "grouped",
+                    "parameters": {
+                        "by_columns": [by_column],
+                        "aggregations": [{"column": column, "function": function}],
+                    },
+                    "description": f"Group by '{by_column}' and take the {function} of '{column}'.",
+                },
+                _display("grouped", f"{function.title()} of {column} by {by_column}"),
+            ]
+            return {"operations": operations}, confidence
+        (column,), confidence = self._columns(columns, phrase)
+        operation_type = "calculate_sum" if function == "sum" else "calculate_average"
+        label = "Sum" if function == "sum" else "Average"
+        operations = [
+            _read(filename),
+            {
+                "operation_type": operation_type,
+                "input_data_key": "data",
+                "output_data_key": "result",
+                "parameters": {"column": column},
+                "description": f"Calculate the {label.lower()} of '{column}'.",
+            },
+            _display("result", f"{label} of {column}"),
+        ]
+        return {"operations": operations}, confidence
+
+    def _sorted(self, filename: str, column: str, order: str, label: str) -> List[Dict[str, Any]]:
+        return [
+            _read(filename),
+            {
+                "operation_type": "sort_column",
+                "input_data_key": "data",
+                "output_data_key": "sorted",
+                "parameters": {"column": column, "order": order},
+                "description": f"Sort by '{column}' in {order} order.",
+            },
+            _display("sorted", label),
+        ]
+
+    def _top_n(self, query: str, filename: str, columns: List[str], dtypes: Dict[str, Any]):
+        match = _TOP_N.match(query)
+        if not match:
+            return None
+        (column,), confidence = self._columns(columns, match["col"])
+        order = "descending" if match["dir"].lower() in _DESCENDING else "ascending"
+        limit = int(match["n"])
+        label = f"{match['dir'].title()} {limit} by {column}"
+        operations = self._sorted(filename, column, order, label)
+        return {"operations": operations, "limit": limit}, confidence
+
+    def _names_column(self, phrase: str, columns: List[str]) -> bool:
+        target = _normalize_name(phrase)
+        if not target:
+            return False
+        if match_column(phrase, columns)[1] >= self.min_confidence:
+            return True
+        return any(target in _normalize_name(column).split() for column in columns)
+
+    def _extreme(self, query: str, filename: str, columns: List[str], dtypes: Dict[str, Any]):
+        match = _EXTREME.match(query)
+        if not match or self._names_column(match["subject"], columns):
+            return None
+        (column,), confidence = self._columns(columns, match["col"])
+        dtype = dtypes.get(column)
+        if (
+            dtype is None
+            or not pd.api.types.is_numeric_dtype(dtype)
+            or pd.api.types.is_bool_dtype(dtype)
+        ):
+            # "The most songs" over a text column is a count the LLM has to plan.
+            return None
+        order = "descending" if match["dir"].lower() in _DESCENDING else "ascending"
+        operations = self._sorted(filename, column, order, f"{match['dir'].title()} {column}")
+        return {"operations": operations, "limit": 1}, confidence
+
+    def _sort(self, query: str, filename: str, columns: List[str], dtypes: Dict[str, Any]):
+        match = _SORT.match(query)
+        if not match:
+            return None
+        (column,), confidence = self._columns(columns, match["col"])
+        order = "descending" if (match["order"] or "").lower() in ("descending", "desc") else "ascending"
+        return {"operations": self._sorted(filename, column, order, f"Sorted by {column}")}, confidence
+
+    def _filter(self, query: str, filename: str, columns: List[str], dtypes: Dict[str, Any]):
+        match = _FILTER.match(query)
+        if not match:
+            return None
+        operator = _OPERATORS[(match["symbol"] or match["word"]).lower()]
+        value = _parse_value(match["value"])
+        if value is None or (isinstance(value, str) and operator not in ("==", "!=")):
+            return None
+        (column,), confidence = self._columns(columns, match["col"])
+        operations = [
+            _read(filename),
+            {
+                "operation_type": "filter_rows",
+                "input_data_key": "data",
+                "output_data_key": "filtered",
+                "parameters": {"column": column, "operator": operator, "value": value},
+                "description": f"Keep rows where '{column}' {operator} {value!r}.",
+            },
+            _display("filtered", f"Rows where {column} {operator} {value}"),
+        ]
+        return {"operations": operations}, confidence
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            attempts = self.matched + self.low_confidence + self.unmatched
+            return {
+                "enabled": int(RULE_PLANNER_ENABLED),
+                "matched": self.matched,
+                "low_confidence": self.low_confidence,
+                "unmatched": self.unmatched,
+                "match_rate": self.matched / attempts if attempts else 0.0,
+            }
+
+
+rule_planner = RulePlanner()
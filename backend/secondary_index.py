@@ -0,0 +1,240 @@
+# secondary_index.py
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Set
+
+import dotenv
+import numpy as np
+import pandas as pd
+
+from compaction import expand_series
+from execution_trace import trace_log
+
+dotenv.load_dotenv()
+
+SECONDARY_INDEXES_ENABLED = os.environ.get("SECONDARY_INDEXES_ENABLED", "1").lower() in ("1", "true", "yes")
+# A column gets indexes once it has been filtered this many times.
+SECONDARY_INDEX_MIN_FILTERS = int(os.environ.get("SECONDARY_INDEX_MIN_FILTERS", 3))
+# Smaller frames are scanned; building and probing an index would not pay off.
+SECONDARY_INDEX_MIN_ROWS = int(os.environ.get("SECONDARY_INDEX_MIN_ROWS", 50_000))
+SECONDARY_INDEX_MAX_BYTES = int(os.environ.get("SECONDARY_INDEX_MAX_BYTES", 256 * 1024**2))
+# Columns whose filter counts are kept; the least recently filtered are forgotten.
+FILTER_COUNT_MAX_COLUMNS = 10_000
+
+HASH_OPERATORS = ["==", "!="]
+RANGE_OPERATORS = [">", "<", ">=", "<="]
+
+
+def _indexable_values(series: pd.Series) -> Optional[np.ndarray]:
+    """
+    The column as a numpy array compared exactly like compare() compares
+    it, or None for dtypes an index could get wrong (bools, mixed objects).
+    """
+    series = expand_series(series)
+    if series.dtype.kind in "iuf":
+        return series.to_numpy()
+    if series.dtype == object and pd.api.types.infer_dtype(series, skipna=True) == "string":
+        return series.to_numpy()
+    return None
+
+
+class HashIndex:
+    """Row positions of every distinct value, each run in ascending order."""
+
+    def __init__(self, values: np.ndarray):
+        codes, uniques = pd.factorize(values)
+        # Missing values get code -1 and sort first; they equal nothing.
+        order = np.argsort(codes, kind="stable")
+        counts = np.bincount(codes + 1, minlength=len(uniques) + 1)
+        self.starts = np.concatenate([[0], np.cumsum(counts)])
+        self.positions = order
+        # The distinct values in code order, to probe a whole column at once.
+        self.keys = pd.Index(uniques)
+        self._slots: Optional[Dict[Any, int]] = None
+        self.null_rows = int(counts[0])
+        self.rows = len(values)
+        # Accounts for the slots dict up front, although joins never build it.
+        self.nbytes = int(
+            self.positions.nbytes + self.starts.nbytes + self.keys.nbytes + 100 * len(self.keys)
+        )
+
+    @property
+    def slots(self) -> Dict[Any, int]:
+        if self._slots is None:
+            self._slots = {value: slot + 1 for slot, value in enumerate(self.keys.tolist())}
+        return self._slots
+
+    def equal(self, value: Any) -> np.ndarray:
+        slot = self.slots.get(value)
+        if slot is None:
+            return np.empty(0, dtype=np.intp)
+        return self.positions[self.starts[slot] : self.starts[slot + 1]]
+
+    def lookup(self, operator_str: str, value: Any) -> np.ndarray:
+        equal = self.equal(value)
+        if operator_str == "==":
+            return equal
+        # Missing values are != everything, as compare() treats them.
+        keep = np.ones(self.rows, dtype=bool)
+        keep[equal] = False
+        return np.flatnonzero(keep)
+
+
+class SortedIndex:
+    """Non-missing values in sorted order with their row positions."""
+
+    def __init__(self, values: np.ndarray):
+        present = np.flatnonzero(~pd.isna(values))
+        order = np.argsort(values[present], kind="stable")
+        self.positions = present[order]
+        self.values = values[self.positions]
+        self.nbytes = int(self.positions.nbytes + self.values.nbytes)
+
+    def lookup(self, operator_str: str, value: Any) -> np.ndarray:
+        if operator_str in (">", "<="):
+            cut = np.searchsorted(self.values, value, side="right")
+        else:
+            cut = np.searchsorted(self.values, value, side="left")
+        selected = self.positions[cut:] if operator_str in (">", ">=") else self.positions[:cut]
+        # take() must return rows in frame order, as a boolean mask does.
+        return np.sort(selected)
+
+
+class SecondaryIndexStore:
+    """
+    Process-wide, memory-bounded LRU of per-column indexes over the full
+    frames of stored datasets. Indexes are built lazily, once a column has
+    been filtered SECONDARY_INDEX_MIN_FILTERS times, and turn a filter into
+    a probe that returns the matching row positions instead of a scan. They
+    are keyed by the dataset's content hash, dtype and row count, so a
+    changed dataset, which gets a new id, never reuses a stale index.
+    """
+
+    def __init__(
+        self,
+        min_filters: int = SECONDARY_INDEX_MIN_FILTERS,
+        min_rows: int = SECONDARY_INDEX_MIN_ROWS,
+        max_bytes: int = SECONDARY_INDEX_MAX_BYTES,
+    ):
+        self.min_filters = min_filters
+        self.min_rows = min_rows
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._filter_counts: "OrderedDict[Hashable, int]" = OrderedDict()
+        # Columns whose dtype cannot be indexed, so they are not re-examined.
+        self._unindexable: Set[Hashable] = set()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.builds = 0
+        self.lookups = 0
+        self.join_lookups = 0
+        self.evictions = 0
+
+    def _get_or_build(self, key: Hashable, kind: str, series: pd.Series):
+        with self._lock:
+            index = self._entries.get(key)
+            if index is not None:
+                self._entries.move_to_end(key)
+                return index
+        values = _indexable_values(series)
+        if values is None:
+            with self._lock:
+                self._unindexable.add(key[:-1])
+            return None
+        index = HashIndex(values) if kind == "hash" else SortedIndex(values)
+        trace_log(
+            f"INDEX: Built a {kind} index on '{series.name}' ({len(values)} rows, {index.nbytes} bytes)."
+        )
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+            if index.nbytes > self.max_bytes:
+                return None
+            self._entries[key] = index
+            self.current_bytes += index.nbytes
+            self.builds += 1
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+                self.evictions += 1
+        return index
+
+    def lookup(
+        self, dataset_id: str, df: pd.DataFrame, column: str, operator_str: str, value: Any
+    ) -> Optional[np.ndarray]:
+        """
+        Positions of the rows of a dataset's full frame where column
+        <operator_str> value, or None when the filter should scan instead.
+        value must already be converted as filter_value_type converts it.
+        """
+        if not SECONDARY_INDEXES_ENABLED or len(df) < self.min_rows:
+            return None
+        if not df.columns.is_unique or column not in df.columns:
+            return None
+        if operator_str in HASH_OPERATORS:
+            kind = "hash"
+        elif operator_str in RANGE_OPERATORS:
+            kind = "sorted"
+        else:
+            return None
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            return None
+        series = df[column]
+        column_key = (dataset_id, column, str(series.dtype), len(df))
+        with self._lock:
+            count = self._filter_counts.pop(column_key, 0) + 1
+            self._filter_counts[column_key] = count
+            if len(self._filter_counts) > FILTER_COUNT_MAX_COLUMNS:
+                self._filter_counts.popitem(last=False)
+        if count < self.min_filters or column_key in self._unindexable:
+            return None
+        index = self._get_or_build((*column_key, kind), kind, series)
+        if index is None:
+            return None
+        try:
+            positions = index.lookup(operator_str, value)
+        except TypeError:
+            # e.g. a range filter with a value the column cannot be ordered against.
+            return None
+        with self._lock:
+            self.lookups += 1
+        return positions
+
+    def join_index(self, dataset_id: Optional[str], df: pd.DataFrame, column: str) -> Optional[HashIndex]:
+        """
+        A hash index on the key column of a join's build side, or None when
+        the column cannot be indexed. Indexes of a dataset's full frame live
+        in the LRU with the filter indexes and serve later joins as well;
+        indexes of derived frames are built for the one join.
+        """
+        if not df.columns.is_unique or column not in df.columns:
+            return None
+        series = df[column]
+        if dataset_id is None or not SECONDARY_INDEXES_ENABLED:
+            values = _indexable_values(series)
+            return None if values is None else HashIndex(values)
+        column_key = (dataset_id, column, str(series.dtype), len(df))
+        if column_key in self._unindexable:
+            return None
+        index = self._get_or_build((*column_key, "hash"), "hash", series)
+        if index is not None:
+            with self._lock:
+                self.join_lookups += 1
+        return index
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": int(SECONDARY_INDEXES_ENABLED),
+                "indexes": len(self._entries),
+                "current_bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "builds": self.builds,
+                "lookups": self.lookups,
+                "join_lookups": self.join_lookups,
+                "evictions": self.evictions,
+            }
+
+
+secondary_indexes = SecondaryIndexStore()
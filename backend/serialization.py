@@ -0,0 +1,190 @@
+# serialization.py
+import io
+import json
+import math
+import os
+from typing import Any, Iterator, Optional
+
+import dotenv
+import numpy as np
+import pandas as pd
+from fastapi.responses import JSONResponse
+
+from compaction import expand_frame, expand_series, expanded_dtype
+
+dotenv.load_dotenv()
+
+# Rows encoded per chunk of a streamed NDJSON or Arrow response.
+STREAM_CHUNK_ROWS = int(os.environ.get("STREAM_CHUNK_ROWS", 10_000))
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+RESULT_FORMATS = {
+    "records": "application/json",
+    "columns": "application/json",
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+# Media types a client can ask for in Accept; column-oriented JSON is only
+# available through ?format=columns since it shares application/json.
+_ACCEPTED_MEDIA_TYPES = {
+    "application/json": "records",
+    "application/x-ndjson": "ndjson",
+    "application/vnd.apache.arrow.stream": "arrow",
+}
+
+
+def json_default(value: Any) -> Any:
+    """Encodes the numpy and pandas values the json modules do not know."""
+    if value is pd.NaT or value is pd.NA:
+        return None
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if isinstance(value, pd.Timedelta):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _sanitize(value: Any) -> Any:
+    """NaN and infinity as null, numpy scalars as Python ones, for json.dumps."""
+    if isinstance(value, dict):
+        return {key: _sanitize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_sanitize(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return _sanitize(value.tolist())
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def dumps(value: Any) -> bytes:
+    """
+    Compact JSON with NaN and infinity written as null. Uses orjson, which
+    encodes numpy arrays and scalars natively, when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(
+            value,
+            default=json_default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+        )
+    return json.dumps(
+        _sanitize(value),
+        default=json_default,
+        allow_nan=False,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+class NumpyJSONResponse(JSONResponse):
+    """JSONResponse that accepts numpy scalars and NaN in the content."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def negotiate_format(accept: Optional[str], requested: Optional[str] = None) -> str:
+    """
+    Picks a key of RESULT_FORMATS: the explicitly requested one, else the
+    Accept media type with the highest q-value we support, else records.
+    """
+    if requested:
+        return requested
+    candidates = []
+    for position, media_range in enumerate((accept or "").split(",")):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_type.lower() in _ACCEPTED_MEDIA_TYPES and quality > 0:
+            candidates.append((-quality, position, _ACCEPTED_MEDIA_TYPES[media_type.lower()]))
+    return min(candidates)[2] if candidates else "records"
+
+
+def _column_values(series: pd.Series) -> Any:
+    series = expand_series(series)
+    if orjson is not None and isinstance(series.dtype, np.dtype) and series.dtype.kind in "biuf":
+        # Encoded straight from the buffer, without Python objects per value.
+        return np.ascontiguousarray(series.to_numpy())
+    return series.tolist()
+
+
+def columns_json_chunks(df: pd.DataFrame, **fields: Any) -> Iterator[bytes]:
+    """
+    Column-oriented JSON: the given fields plus "columns", a list of
+    {"name", "dtype", "values"}. Encoded and yielded one column at a time.
+    """
+    yield dumps(fields)[:-1] + (b',"columns":[' if fields else b'"columns":[')
+    for position, (column, dtype) in enumerate(zip(df.columns, df.dtypes)):
+        yield (b"," if position else b"") + dumps(
+            {
+                "name": str(column),
+                "dtype": str(expanded_dtype(dtype)),
+                "values": _column_values(df.iloc[:, position]),
+            }
+        )
+    yield b"]}"
+
+
+def ndjson_chunks(df: pd.DataFrame, chunk_rows: int = STREAM_CHUNK_ROWS) -> Iterator[bytes]:
+    """One JSON object per row, encoded chunk_rows rows at a time."""
+    names = [str(column) for column in df.columns]
+    for start in range(0, len(df), chunk_rows):
+        chunk = df.iloc[start : start + chunk_rows]
+        # tolist() converts whole columns to Python scalars in C; only the
+        # row dicts of the current chunk exist at any time.
+        columns = [expand_series(chunk.iloc[:, i]).tolist() for i in range(len(names))]
+        yield b"".join(dumps(dict(zip(names, row))) + b"\n" for row in zip(*columns))
+
+
+def _arrow_table(df: pd.DataFrame) -> "pa.Table":
+    df = expand_frame(df)
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Object columns mixing types (e.g. numbers and strings) have no
+        # Arrow type; send them as strings.
+        mixed = df.select_dtypes("object").columns
+        df = df.assign(**{str(c): df[c].astype(str).where(df[c].notna()) for c in mixed})
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def arrow_chunks(df: pd.DataFrame, chunk_rows: int = STREAM_CHUNK_ROWS) -> Iterator[bytes]:
+    """An Arrow IPC stream: the schema, then one record batch per chunk."""
+    if pa is None:
+        raise RuntimeError("pyarrow is not installed.")
+    table = _arrow_table(df)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=chunk_rows):
+            writer.write_batch(batch)
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    # The end-of-stream marker written on close.
+    yield sink.getvalue()
+
+
+def arrow_available() -> bool:
+    return pa is not None
@@ -0,0 +1,242 @@
+# streaming.py
+import os
+import time
+from contextlib import closing, nullcontext
+from typing import Any, Dict, Iterator, List, Optional
+
+import dotenv
+import numpy as np
+import pandas as pd
+
+from execution_trace import muted_logs, trace_log
+
+dotenv.load_dotenv()
+
+STREAMING_MEMORY_BUDGET_BYTES = int(
+    os.environ.get("STREAMING_MEMORY_BUDGET_BYTES", 2 * 1024**3)
+)
+# Rough ratio of parsed DataFrame size to CSV text size.
+STREAMING_EXPANSION_FACTOR = float(os.environ.get("STREAMING_EXPANSION_FACTOR", 3))
+
+STREAMABLE_ROW_OPS = ["filter_rows", "drop_columns", "rename_column"]
+STREAMABLE_AGGREGATES = ["calculate_sum", "calculate_average", "group_and_aggregate"]
+STREAMABLE_AGG_FUNCTIONS = ["sum", "count", "min", "max", "mean"]
+
+
+def exceeds_memory_budget(size_bytes: int) -> bool:
+    return size_bytes * STREAMING_EXPANSION_FACTOR > STREAMING_MEMORY_BUDGET_BYTES
+
+
+def streamable_prefix(operations: List[Dict[str, Any]]) -> int:
+    """
+    Number of leading steps that can run chunk by chunk: a read_csv, a chain
+    of row-wise steps each feeding only the next one, and optionally one
+    aggregate that ends the chain. Returns 0 when streaming would not reduce
+    what has to be held in memory.
+    """
+    if not operations or operations[0].get("operation_type") != "read_csv":
+        return 0
+    consumers: Dict[str, List[int]] = {}
+    for i, op in enumerate(operations):
+        if op.get("input_data_key"):
+            consumers.setdefault(op["input_data_key"], []).append(i)
+        right_key = (op.get("parameters") or {}).get("right_data_key")
+        if right_key:
+            consumers.setdefault(right_key, []).append(i)
+
+    end = 1
+    key = operations[0].get("output_data_key")
+    reduces = bool((operations[0].get("parameters") or {}).get("filters"))
+    while key and end < len(operations):
+        op = operations[end]
+        if op.get("input_data_key") != key or consumers.get(key) != [end]:
+            break
+        op_type = op.get("operation_type")
+        params = op.get("parameters") or {}
+        if op_type in STREAMABLE_ROW_OPS:
+            reduces = reduces or op_type == "filter_rows"
+            key = op.get("output_data_key")
+            end += 1
+        elif op_type in STREAMABLE_AGGREGATES:
+            if op_type == "group_and_aggregate" and any(
+                agg.get("function") not in STREAMABLE_AGG_FUNCTIONS
+                for agg in params.get("aggregations") or []
+            ):
+                break
+            reduces = True
+            end += 1
+            break
+        else:
+            break
+    return end if reduces else 0
+
+
+def chunk_predicates(operations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Filters every row of a streamed prefix's result has passed: the read's
+    pushed-down filters and the filter_rows steps directly after the read.
+    Chunks where none of them can hold do not change the result.
+    """
+    predicates = list((operations[0].get("parameters") or {}).get("filters") or [])
+    for op in operations[1:]:
+        if op.get("operation_type") != "filter_rows":
+            break
+        predicates.append(op.get("parameters") or {})
+    return predicates
+
+
+class StreamingExecutor:
+    """
+    Runs a streamable plan prefix over a CSV in chunks so the whole file never
+    has to be resident. Row-wise steps reuse the agent's own tools on every
+    chunk; aggregates keep partial states (sum, count, min, max, with mean as
+    sum/count) and combine them at the end.
+
+    Column types are inferred per chunk, so an integer column whose blanks
+    only appear late in the file is compared as integer in the early chunks.
+    """
+
+    def __init__(self, agent, chunk_rows: int):
+        self.agent = agent
+        self.chunk_rows = chunk_rows
+
+    def run(
+        self,
+        operations: List[Dict[str, Any]],
+        path: str,
+        chunks: Optional[Iterator[pd.DataFrame]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        chunks, when given, replaces reading the whole file, e.g. with only
+        the chunks a zone map says can hold rows passing chunk_predicates.
+        """
+        read_params = operations[0].get("parameters") or {}
+        filters = read_params.get("filters") or []
+        last_op = operations[-1]
+        aggregate = last_op if last_op.get("operation_type") in STREAMABLE_AGGREGATES else None
+        row_ops = operations[1:-1] if aggregate is not None else operations[1:]
+
+        wall_ms = [0.0] * len(operations)
+        rows_in = [0] * len(operations)
+        rows_out = [0] * len(operations)
+        partials: List[Any] = []
+        kept: List[pd.DataFrame] = []
+        n_chunks = 0
+
+        trace_log(
+            f"TOOL: Streaming '{read_params.get('filepath')}' in chunks of {self.chunk_rows} rows..."
+        )
+        filepath = read_params.get("filepath")
+        started = time.perf_counter()
+        if chunks is not None:
+            reader = closing(chunks)
+        else:
+            with self.agent._csv_read_errors(filepath):
+                reader = pd.read_csv(
+                    path, usecols=read_params.get("usecols"), chunksize=self.chunk_rows
+                )
+        wall_ms[0] += (time.perf_counter() - started) * 1000
+        with reader as source:
+            while True:
+                self.agent._check_cancelled(f"chunk {n_chunks + 1}")
+                started = time.perf_counter()
+                with self.agent._csv_read_errors(filepath):
+                    chunk = next(source, None)
+                if chunk is None:
+                    break
+                rows_out[0] += len(chunk)
+                # Tools log once, on the first chunk.
+                with muted_logs() if n_chunks else nullcontext():
+                    for filter_params in filters:
+                        chunk = self.agent._filter_rows(chunk, filter_params)
+                    wall_ms[0] += (time.perf_counter() - started) * 1000
+                    for offset, op in enumerate(row_ops, start=1):
+                        started = time.perf_counter()
+                        rows_in[offset] += len(chunk)
+                        chunk = self.agent.tools[op["operation_type"]](
+                            chunk, op.get("parameters") or {}
+                        )
+                        rows_out[offset] += len(chunk)
+                        wall_ms[offset] += (time.perf_counter() - started) * 1000
+                    if aggregate is not None:
+                        started = time.perf_counter()
+                        rows_in[-1] += len(chunk)
+                        if not n_chunks:
+                            # Validates and logs exactly like the in-memory tool.
+                            self.agent.tools[aggregate["operation_type"]](
+                                chunk.head(0), aggregate.get("parameters") or {}
+                            )
+                        partials.append(self._partial(aggregate, chunk))
+                        wall_ms[-1] += (time.perf_counter() - started) * 1000
+                    else:
+                        kept.append(chunk)
+                n_chunks += 1
+
+        if not n_chunks:
+            return None
+        started = time.perf_counter()
+        if aggregate is not None:
+            result = self._combine(aggregate, partials)
+        else:
+            result = pd.concat(kept)
+        wall_ms[-1] += (time.perf_counter() - started) * 1000
+        if isinstance(result, pd.DataFrame):
+            rows_out[-1] = len(result)
+        return {
+            "result": result,
+            "chunks": n_chunks,
+            "wall_ms": wall_ms,
+            "rows_in": rows_in,
+            "rows_out": rows_out,
+        }
+
+    def _partial(self, aggregate: Dict[str, Any], chunk: pd.DataFrame) -> Any:
+        op_type = aggregate["operation_type"]
+        params = aggregate.get("parameters") or {}
+        if op_type == "calculate_sum":
+            return chunk[params["column"]].sum()
+        if op_type == "calculate_average":
+            column = chunk[params["column"]]
+            return (column.sum(), column.count())
+        named_aggs = {}
+        for i, agg in enumerate(params["aggregations"]):
+            column, func = agg["column"], agg["function"]
+            if func == "mean":
+                named_aggs[f"{i}_sum"] = pd.NamedAgg(column=column, aggfunc="sum")
+                named_aggs[f"{i}_count"] = pd.NamedAgg(column=column, aggfunc="count")
+            else:
+                named_aggs[f"{i}_{func}"] = pd.NamedAgg(column=column, aggfunc=func)
+        return chunk.groupby(params["by_columns"]).agg(**named_aggs)
+
+    def _combine(self, aggregate: Dict[str, Any], partials: List[Any]) -> Any:
+        op_type = aggregate["operation_type"]
+        params = aggregate.get("parameters") or {}
+        if op_type == "calculate_sum":
+            total = partials[0]
+            for partial in partials[1:]:
+                total = total + partial
+            return total
+        if op_type == "calculate_average":
+            total = sum(partial[0] for partial in partials)
+            count = sum(partial[1] for partial in partials)
+            return np.float64(total) / count if count else np.nan
+        return combine_group_partials(params, partials)
+
+
+def combine_group_partials(params: Dict[str, Any], partials: List[pd.DataFrame]) -> pd.DataFrame:
+    """Merges per-partition groupby states into the final aggregate frame."""
+    combined = pd.concat(partials)
+    merge_funcs = {
+        column: ("min" if column.endswith("_min") else "max" if column.endswith("_max") else "sum")
+        for column in combined.columns
+    }
+    merged = combined.groupby(level=list(range(combined.index.nlevels))).agg(merge_funcs)
+    result = pd.DataFrame(index=merged.index)
+    for i, agg in enumerate(params["aggregations"]):
+        func = agg["function"]
+        output_name = agg.get("output_column_name", f"{agg['column']}_{func}")
+        if func == "mean":
+            result[output_name] = merged[f"{i}_sum"] / merged[f"{i}_count"]
+        else:
+            result[output_name] = merged[f"{i}_{func}"]
+    return result.reset_index()
@@ -0,0 +1,178 @@
+# subplan_cache.py
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import dotenv
+import pandas as pd
+
+from execution_trace import trace_log
+from frame_cache import cached_copy, frame_nbytes
+
+dotenv.load_dotenv()
+
+SUBPLAN_CACHE_ENABLED = os.environ.get("SUBPLAN_CACHE_ENABLED", "1").lower() in ("1", "true", "yes")
+SUBPLAN_CACHE_MAX_BYTES = int(os.environ.get("SUBPLAN_CACHE_MAX_BYTES", 256 * 1024**2))
+# Accounted size of a cached scalar result.
+SCALAR_NBYTES = 64
+
+# Steps whose output keeps the input's columns, minus drops and renames. Their
+# output for a projected read is the output for a wider read restricted to
+# the projected columns.
+COLUMN_PRESERVING_OPS = ["filter_rows", "sort_column", "drop_columns", "rename_column"]
+
+
+def _digest(payload: Dict[str, Any]) -> str:
+    text = json.dumps(payload, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def subplan_keys(
+    operations: List[Dict[str, Any]], dataset_for: Callable[[str], Any]
+) -> Tuple[List[Optional[str]], List[Optional[List[str]]], List[List[Optional[int]]]]:
+    """
+    For each step: the key of the sub-plan that produces its output, the
+    columns that output has, and the steps producing its inputs.
+
+    A key hashes the step's operation and parameters with the keys of its
+    inputs in place of data key names, down to the content hash of the
+    dataset each read_csv loads, so the same computation gets the same key
+    in any plan. Descriptions, labels and read projections are left out;
+    the columns list says which columns this plan's output has, and is None
+    once a step's output no longer depends on how many columns were read.
+    Steps over a file that is not a stored dataset have no key.
+    """
+    keys: List[Optional[str]] = []
+    columns: List[Optional[List[str]]] = []
+    producers: List[List[Optional[int]]] = []
+    writers: Dict[str, int] = {}
+    for op in operations:
+        op_type = op.get("operation_type")
+        params = dict(op.get("parameters") or {})
+        input_keys = [op.get("input_data_key")]
+        if op_type == "merge_dataframes":
+            input_keys.append(params.pop("right_data_key", None))
+        inputs = [] if op_type == "read_csv" else [writers.get(key) if key else None for key in input_keys]
+        producers.append(inputs)
+
+        key: Optional[str] = None
+        output_columns: Optional[List[str]] = None
+        if op_type == "read_csv":
+            dataset = dataset_for(params.get("filepath"))
+            if dataset is not None:
+                usecols = params.get("usecols")
+                output_columns = list(usecols) if usecols else list(dataset.columns)
+                key = _digest(
+                    {"op": op_type, "dataset": dataset.dataset_id, "filters": params.get("filters") or []}
+                )
+        elif op_type != "display_data" and inputs and all(i is not None and keys[i] for i in inputs):
+            payload: Dict[str, Any] = {"op": op_type, "params": params, "inputs": [keys[i] for i in inputs]}
+            input_columns = columns[inputs[0]]
+            if op_type == "merge_dataframes":
+                # Which columns collide, and get suffixes, depends on both sides.
+                payload["columns"] = [columns[i] for i in inputs]
+            elif op_type in COLUMN_PRESERVING_OPS and input_columns is not None:
+                if op_type == "drop_columns":
+                    dropped = set(params.get("columns_to_drop") or [])
+                    output_columns = [c for c in input_columns if c not in dropped]
+                elif op_type == "rename_column":
+                    renames = {params.get("old_name"): params.get("new_name")}
+                    output_columns = [renames.get(c, c) for c in input_columns]
+                else:
+                    output_columns = list(input_columns)
+            key = _digest(payload)
+        keys.append(key)
+        columns.append(output_columns)
+        if op.get("output_data_key"):
+            writers[op["output_data_key"]] = len(keys) - 1
+    return keys, columns, producers
+
+
+class SubplanCache:
+    """
+    Process-wide LRU cache of step results keyed by subplan_keys, bounded by
+    memory like the frame cache. A frame cached from a wider read serves
+    plans that read fewer columns; a narrower one is replaced when the same
+    sub-plan runs over more columns.
+    """
+
+    def __init__(self, max_bytes: int = SUBPLAN_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _covers(value: Any, columns: Optional[List[str]]) -> bool:
+        if columns is None or not isinstance(value, pd.DataFrame):
+            return True
+        if not value.columns.is_unique:
+            return list(value.columns) == columns
+        return set(columns) <= set(value.columns)
+
+    def get(self, key: str, columns: Optional[List[str]] = None) -> Optional[Any]:
+        """The cached result restricted to columns, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not self._covers(entry[0], columns):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            value = entry[0]
+        if isinstance(value, pd.DataFrame):
+            if columns is not None and list(value.columns) != columns:
+                return value[columns]
+            return cached_copy(value)
+        return value
+
+    def put(self, key: str, value: Any):
+        if isinstance(value, pd.DataFrame):
+            with self._lock:
+                existing = self._entries.get(key)
+                if existing is not None and self._covers(existing[0], list(value.columns)):
+                    # Keep the wider frame; it serves this plan as well.
+                    self._entries.move_to_end(key)
+                    return
+            nbytes = frame_nbytes(value)
+        elif pd.api.types.is_scalar(value):
+            nbytes = SCALAR_NBYTES
+        else:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                trace_log(
+                    f"SUBPLAN CACHE: Result of {nbytes} bytes exceeds the {self.max_bytes} byte budget; not caching."
+                )
+                return
+            self._entries[key] = (value, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": int(SUBPLAN_CACHE_ENABLED),
+                "entries": len(self._entries),
+                "current_bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+subplan_cache = SubplanCache()
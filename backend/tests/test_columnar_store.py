@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from columnar_store import ColumnarStore
+
+DATASET = "a" * 64
+FRAME = pd.DataFrame({"id": [1, 2, 3], "price": [1.5, 2.5, np.nan], "name": ["x", "y", None]})
+
+
+def test_round_trip_matches_the_parsed_frame(tmp_path):
+    store = ColumnarStore(root=str(tmp_path))
+    store.write(DATASET, list(FRAME.columns), FRAME)
+
+    pd.testing.assert_frame_equal(store.load(DATASET), FRAME)
+    # Projections come back in file order, like read_csv with usecols.
+    pd.testing.assert_frame_equal(store.load(DATASET, ["price", "id"]), FRAME[["id", "price"]])
+
+
+def test_numeric_columns_are_mapped_copy_on_write(tmp_path):
+    store = ColumnarStore(root=str(tmp_path))
+    store.write(DATASET, list(FRAME.columns), FRAME)
+
+    loaded = store.load(DATASET, ["id"])
+    loaded.loc[0, "id"] = 100
+    assert store.load(DATASET, ["id"])["id"].tolist() == [1, 2, 3]
+
+
+def test_columns_of_a_narrower_read_are_merged(tmp_path):
+    store = ColumnarStore(root=str(tmp_path))
+    header = list(FRAME.columns)
+    store.write(DATASET, header, FRAME[["price"]])
+    assert store.load(DATASET) is None
+    assert store.has_columns(DATASET, ["price"])
+
+    store.write(DATASET, header, FRAME[["id", "name"]])
+    pd.testing.assert_frame_equal(store.load(DATASET), FRAME)
+
+
+def test_least_recently_used_copies_are_evicted_over_the_budget(tmp_path):
+    store = ColumnarStore(root=str(tmp_path))
+    store.write("old" + DATASET[3:], list(FRAME.columns), FRAME)
+    size = store.stats()["bytes"]
+    old_manifest = os.path.join(str(tmp_path), "old" + DATASET[3:], "manifest.json")
+    os.utime(old_manifest, (time.time() - 60, time.time() - 60))
+
+    store.max_bytes = size + size // 2
+    store.write(DATASET, list(FRAME.columns), FRAME)
+
+    assert store.load("old" + DATASET[3:]) is None
+    assert store.load(DATASET) is not None
+    assert store.stats()["datasets"] == 1
+
+
+def test_stats_survive_concurrent_eviction(tmp_path):
+    store = ColumnarStore(root=str(tmp_path), max_bytes=1)
+    stop = threading.Event()
+    errors = []
+
+    def write():
+        i = 0
+        while not stop.is_set():
+            store.write(f"{i:064x}", list(FRAME.columns), FRAME)
+            i += 1
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        deadline = time.time() + 1
+        while time.time() < deadline:
+            try:
+                store.stats()
+            except OSError as e:
+                errors.append(e)
+    finally:
+        stop.set()
+        writer.join()
+    assert errors == []
@@ -0,0 +1,14 @@
+import pandas as pd
+import pytest
+
+from frame_cache import FrameCache
+
+
+@pytest.mark.parametrize("copy_on_write", [True, False])
+def test_changing_a_cache_hit_leaves_the_cached_frame_alone(copy_on_write):
+    cache = FrameCache(max_bytes=1024**2)
+    with pd.option_context("mode.copy_on_write", copy_on_write):
+        hit = cache.get_or_load("key", lambda: pd.DataFrame({"a": [1, 2, 3]}))
+        hit.loc[0, "a"] = 100
+        hit["a"] += 1
+        assert cache.get_or_load("key", lambda: None)["a"].tolist() == [1, 2, 3]
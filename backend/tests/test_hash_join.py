@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import hash_join
+from hash_join import HashJoin, check_join_size, join_cardinality
+from secondary_index import secondary_indexes
+
+
+def _index_for(df, column):
+    return secondary_indexes.join_index(None, df, column)
+
+
+def _keys(rng, n, kind, categories):
+    codes = rng.integers(0, 8, n)
+    if kind == "int":
+        return codes
+    if kind == "float":
+        return codes.astype(float)
+    values = np.array([f"k{code}" for code in codes], dtype=object)
+    if kind == "string":
+        return values
+    return pd.Categorical(values, categories=categories)
+
+
+@pytest.mark.parametrize("how", ["inner", "left", "right"])
+@pytest.mark.parametrize("kind", ["int", "float", "string", "categorical"])
+def test_hash_join_matches_pd_merge(how, kind):
+    rng = np.random.default_rng(0)
+    shared = [f"k{code}" for code in range(8)]
+    hash_joins = 0
+    for trial in range(60):
+        # Categorical keys alternate between shared and differing categories.
+        right_categories = shared if trial % 2 else shared[::-1]
+        left = pd.DataFrame({"k": _keys(rng, rng.integers(0, 15), kind, shared)})
+        left["a"] = np.arange(len(left))
+        right = pd.DataFrame({"k": _keys(rng, rng.integers(0, 15), kind, right_categories)})
+        right["b"] = rng.random(len(right))
+        join = HashJoin.plan(left, right, "k", how, _index_for)
+        if join is None:
+            continue
+        hash_joins += 1
+        expected = pd.merge(left, right, on="k", how=how)
+        pd.testing.assert_frame_equal(join.result(), expected)
+        assert join.rows == len(expected)
+        assert join_cardinality(left["k"], right["k"], how)[0] == len(expected)
+    assert hash_joins >= 10
+
+
+def test_inner_join_with_repeated_matches_is_left_to_pd_merge():
+    left = pd.DataFrame({"k": [3, 6, 7, 2, 4, 7, 4, 7, 0, 1, 4, 6, 7, 0, 1]})
+    right = pd.DataFrame({"k": [3, 3, 0, 7, 4, 3, 4, 5], "id": range(8)})
+    assert HashJoin.plan(left, right, "k", "inner", _index_for) is None
+
+
+def test_join_over_the_size_limit_is_refused(monkeypatch):
+    monkeypatch.setattr(hash_join, "JOIN_MAX_RESULT_BYTES", 1024)
+    left = pd.DataFrame({"k": [1] * 100, "a": range(100)})
+    right = pd.DataFrame({"k": [1] * 100, "b": range(100)})
+    rows, many_to_many = join_cardinality(left["k"], right["k"], "inner")
+    assert (rows, many_to_many) == (10_000, True)
+    with pytest.raises(ValueError, match="Refusing the merge"):
+        check_join_size(left, right, "k", rows, many_to_many)
+
+
+def test_many_to_many_join_within_the_limit_warns():
+    left = pd.DataFrame({"k": [1, 1], "a": [1, 2]})
+    right = pd.DataFrame({"k": [1, 1], "b": [3, 4]})
+    warning = check_join_size(left, right, "k", 4, True)
+    assert warning is not None and "Many-to-many" in warning
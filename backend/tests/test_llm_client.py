@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from agent import LLMClient, LLMTimeoutError, PlanProvider
+
+PLAN = {"operations": []}
+
+
+class StubProvider(PlanProvider):
+    """
+    Answers after the next of the given delays, the last one repeating.
+    A negative delay fails the call instead.
+    """
+
+    def __init__(self, *delays: float):
+        self.delays = list(delays)
+        self.calls = 0
+
+    async def aplan(self, context_input):
+        delay = self.delays[min(self.calls, len(self.delays) - 1)]
+        self.calls += 1
+        if delay < 0:
+            raise ValueError("bad plan")
+        await asyncio.sleep(delay)
+        return {**PLAN, "call": self.calls}, {"input_tokens": 3}
+
+
+def test_a_call_past_the_timeout_raises_and_frees_its_slot():
+    client = LLMClient(StubProvider(5.0, 0.0), max_concurrency=1, timeout_seconds=0.05)
+
+    with pytest.raises(LLMTimeoutError, match="0.05 seconds"):
+        client.plan("slow")
+    # The only concurrency slot is free again, so the next call is not stuck.
+    assert client.plan("fast") == {**PLAN, "call": 2}
+
+    stats = client.stats()
+    assert (stats["calls"], stats["timeouts"], stats["errors"], stats["in_flight"]) == (2, 1, 0, 0)
+
+
+def test_provider_errors_are_counted_and_raised():
+    client = LLMClient(StubProvider(-1.0), timeout_seconds=1.0)
+
+    with pytest.raises(ValueError, match="bad plan"):
+        client.plan("broken")
+
+    assert (client.stats()["errors"], client.stats()["timeouts"]) == (1, 0)
+
+
+def test_a_slow_call_is_hedged_after_the_p95_latency():
+    client = LLMClient(
+        StubProvider(5.0, 0.0),
+        max_concurrency=2,
+        timeout_seconds=1.0,
+        hedge_enabled=True,
+        hedge_min_samples=5,
+    )
+    client._latencies.extend([0.01] * 5)
+
+    assert client.plan("hedge me") == {**PLAN, "call": 2}
+    assert (client.hedged, client.hedge_wins) == (1, 1)
+
+
+def test_no_hedge_is_sent_without_a_free_slot():
+    client = LLMClient(
+        StubProvider(0.2),
+        max_concurrency=1,
+        timeout_seconds=1.0,
+        hedge_enabled=True,
+        hedge_min_samples=5,
+    )
+    client._latencies.extend([0.01] * 5)
+
+    assert client.plan("wait") == {**PLAN, "call": 1}
+    assert client.hedged == 0
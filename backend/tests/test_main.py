@@ -0,0 +1,41 @@
+from fastapi.testclient import TestClient
+
+import main
+import manipulator
+from dataset_store import DatasetStore
+from plan_cache import PlanCache
+
+CSV = b"name,score\nada,3\nbob,5\n"
+OTHER_CSV = b"name,team\nada,red\n"
+
+
+def test_identical_uploads_keep_both_names(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "dataset_store", DatasetStore(root=str(tmp_path / "datasets")))
+    monkeypatch.setattr(manipulator, "plan_cache", PlanCache(path=str(tmp_path / "plans.sqlite3")))
+    plan = {
+        "operations": [
+            {
+                "operation_type": "read_csv",
+                "parameters": {"filepath": "b.csv"},
+                "output_data_key": "data",
+            },
+            {"operation_type": "display_data", "input_data_key": "data", "parameters": {}},
+        ]
+    }
+    monkeypatch.setattr(manipulator, "_plan_with_llm", lambda datasets, query, feedback=None: plan)
+
+    response = TestClient(main.app).post(
+        "/uploadcsvs",
+        files=[
+            ("csv_files", ("a.csv", CSV, "text/csv")),
+            ("csv_files", ("b.csv", CSV, "text/csv")),
+            ("csv_files", ("c.csv", OTHER_CSV, "text/csv")),
+        ],
+        data={"query": "show b"},
+    )
+
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["filenames"] == ["a.csv", "b.csv", "c.csv"]
+    assert body["dataset_ids"][0] == body["dataset_ids"][1]
+    assert body["processed_data"] == [{"name": "ada", "score": 3}, {"name": "bob", "score": 5}]
@@ -0,0 +1,119 @@
+import pandas as pd
+
+import manipulator
+import metrics
+from dataset_store import DatasetStore
+from manipulator import DataProcessorAgent
+from subplan_cache import SubplanCache
+
+REGION_US = {"column": "region", "operator": "==", "value": "US"}
+PRICE_OVER_10 = {"column": "price", "operator": ">", "value": 10}
+
+
+def _sales_csv(tmp_path):
+    path = tmp_path / "sales.csv"
+    pd.DataFrame(
+        {
+            "region": ["EU", "EU", "US", "US", "EU", "US"],
+            "price": [5, 50, 20, 3, 40, 60],
+        }
+    ).to_csv(path, index=False)
+    return str(path)
+
+
+def test_scan_filtered_survives_chunks_emptied_by_an_earlier_filter(tmp_path, monkeypatch):
+    path = _sales_csv(tmp_path)
+    monkeypatch.setattr(manipulator, "READ_CHUNK_ROWS", 2)
+
+    result = DataProcessorAgent()._scan_filtered(path, path, None, [REGION_US, PRICE_OVER_10])
+
+    expected = pd.read_csv(path)
+    expected = expected[(expected["region"] == "US") & (expected["price"] > 10)]
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def _stored_sales(tmp_path):
+    path = _sales_csv(tmp_path)
+    with open(path, "rb") as f:
+        return DatasetStore(root=str(tmp_path / "datasets")).add(f, "sales.csv")
+
+
+def _sorted_sales_plan():
+    return {
+        "operations": [
+            {"operation_type": "read_csv", "parameters": {"filepath": "sales.csv"}, "output_data_key": "sales"},
+            {
+                "operation_type": "filter_rows",
+                "input_data_key": "sales",
+                "output_data_key": "unused",
+                "parameters": REGION_US,
+            },
+            {
+                "operation_type": "sort_column",
+                "input_data_key": "sales",
+                "output_data_key": "sorted",
+                "parameters": {"column": "price", "order": "descending"},
+            },
+            {"operation_type": "display_data", "input_data_key": "sorted", "parameters": {}},
+        ]
+    }
+
+
+def test_dead_steps_are_skipped_with_the_subplan_cache_off(tmp_path, monkeypatch):
+    monkeypatch.setattr(manipulator, "SUBPLAN_CACHE_ENABLED", False)
+    agent = DataProcessorAgent(datasets=[_stored_sales(tmp_path)])
+
+    result = agent.execute_plan(_sorted_sales_plan())
+
+    assert agent.stats["skipped_steps"] == [2]
+    assert [row["price"] for row in result] == [60, 50, 40, 20, 5, 3]
+
+
+def test_cached_steps_are_recorded_in_the_step_metrics(tmp_path, monkeypatch):
+    monkeypatch.setattr(manipulator, "subplan_cache", SubplanCache())
+    dataset = _stored_sales(tmp_path)
+    DataProcessorAgent(datasets=[dataset]).execute_plan(_sorted_sales_plan())
+    hits_before = _observations(metrics.step_seconds, ("sort_column", "hit"))
+
+    agent = DataProcessorAgent(datasets=[dataset])
+    agent.execute_plan(_sorted_sales_plan())
+
+    assert agent.stats["cached_steps"] == [3]
+    assert _observations(metrics.step_seconds, ("sort_column", "hit")) == hits_before + 1
+    assert [step["subplan_cache"] for step in agent.trace.steps() if step["step"] == 3] == ["hit"]
+
+
+def _observations(histogram, labels) -> int:
+    return sum(histogram._series.get(labels, []))
+
+
+def test_intermediates_are_released_after_their_last_reader(tmp_path):
+    path = _sales_csv(tmp_path)
+    plan = {
+        "operations": [
+            {"operation_type": "read_csv", "parameters": {"filepath": path}, "output_data_key": "sales"},
+            {
+                "operation_type": "filter_rows",
+                "input_data_key": "sales",
+                "output_data_key": "us_sales",
+                "parameters": REGION_US,
+            },
+            {
+                "operation_type": "sort_column",
+                "input_data_key": "us_sales",
+                "output_data_key": "sorted",
+                "parameters": {"column": "price", "order": "ascending"},
+            },
+            {"operation_type": "display_data", "input_data_key": "sorted", "parameters": {}},
+        ]
+    }
+    agent = DataProcessorAgent()
+
+    result = agent.execute_plan(plan)
+
+    assert agent.stats["released_keys"] == ["sales", "us_sales", "sorted"]
+    assert agent.data_store == {}
+    assert agent.stats["skipped_steps"] == []
+    # The full frame is gone before the sort runs, so it never overlaps its result.
+    assert 0 < agent.stats["peak_intermediate_bytes"] < agent.stats["total_intermediate_bytes"]
+    assert [row["price"] for row in result] == [3, 20, 60]
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+import metrics
+
+
+def test_current_rss_follows_allocations():
+    before = metrics.current_rss_bytes()
+    if before is None:
+        pytest.skip("no /proc on this platform")
+
+    block = np.ones(64 * 1024**2 // 8)
+    grown = metrics.current_rss_bytes()
+    del block
+
+    assert grown - before >= 32 * 1024**2
+    assert metrics.current_rss_bytes() < grown
+
+
+def test_a_step_that_frees_memory_is_observed_in_the_lowest_bucket():
+    series = metrics.step_rss_delta_bytes._series
+    before = list(series.get(("sort_column",), [0] * (len(metrics.BYTE_BUCKETS) + 1)))
+
+    metrics.observe_step(
+        {"op_type": "sort_column", "status": "ok", "wall_time_ms": 1, "rss_delta_bytes": -4096}
+    )
+
+    assert series[("sort_column",)][0] == before[0] + 1
+    assert sum(series[("sort_column",)]) == sum(before) + 1
+
+
+def test_stats_gauges_read_stats_once_per_scrape(monkeypatch):
+    registry = metrics.Registry()
+    monkeypatch.setattr(metrics, "registry", registry)
+    calls = []
+
+    def stats():
+        calls.append(1)
+        return {"entries": len(calls), "hit_rate": 0.5, "path": "cache.sqlite3"}
+
+    metrics.register_stats_gauges("csv_test", stats)
+    calls.clear()
+    text = registry.render()
+
+    assert len(calls) == 1
+    assert "csv_test_entries 1\n" in text
+    assert "csv_test_hit_rate 0.5\n" in text
+    assert "# TYPE csv_test_hit_rate gauge" in text
+    assert "path" not in text
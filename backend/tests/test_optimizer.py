@@ -0,0 +1,162 @@
+import pandas as pd
+import pytest
+
+from manipulator import DataProcessorAgent
+from optimizer import optimize_plan
+
+COLUMNS = ["region", "product", "price", "quantity"]
+
+
+@pytest.fixture
+def sales_csv(tmp_path):
+    path = tmp_path / "sales.csv"
+    pd.DataFrame(
+        {
+            "region": ["EU", "US", "US", "EU", "US", "EU"],
+            "product": ["a", "b", "c", "d", "e", "f"],
+            "price": [5, 50, 20, 3, 40, 60],
+            "quantity": [1, 2, 3, 4, 5, 6],
+        }
+    ).to_csv(path, index=False)
+    return str(path)
+
+
+def _read(path, key="sales"):
+    return {"operation_type": "read_csv", "parameters": {"filepath": path}, "output_data_key": key}
+
+
+def _op(op_type, input_key, output_key, **params):
+    op = {"operation_type": op_type, "input_data_key": input_key, "parameters": params}
+    if output_key:
+        op["output_data_key"] = output_key
+    return op
+
+
+def _run(plan):
+    return DataProcessorAgent().execute_plan(plan)
+
+
+def test_projection_and_filter_are_pushed_into_the_read(sales_csv):
+    plan = {
+        "operations": [
+            _read(sales_csv),
+            _op("filter_rows", "sales", "expensive", column="price", operator=">", value=10),
+            _op("calculate_sum", "expensive", "total", column="quantity"),
+        ]
+    }
+
+    optimized, explain = optimize_plan(plan, COLUMNS)
+
+    assert [op["operation_type"] for op in optimized["operations"]] == ["read_csv", "calculate_sum"]
+    read_params = optimized["operations"][0]["parameters"]
+    assert read_params["usecols"] == ["price", "quantity"]
+    assert read_params["filters"] == [{"column": "price", "operator": ">", "value": 10}]
+    assert explain["before"] == plan
+    assert len(explain["rewrites"]) == 2
+    assert _run(optimized) == _run(plan) == 2 + 3 + 5 + 6
+
+
+def test_filter_moves_ahead_of_the_sort_it_follows(sales_csv):
+    plan = {
+        "operations": [
+            _read(sales_csv),
+            _op("sort_column", "sales", "sorted", column="price", order="descending"),
+            _op("filter_rows", "sorted", "us", column="region", operator="==", value="US"),
+        ]
+    }
+
+    optimized, _ = optimize_plan(plan, COLUMNS)
+
+    assert [op["operation_type"] for op in optimized["operations"]] == [
+        "read_csv",
+        "filter_rows",
+        "sort_column",
+    ]
+    # A string filter is not pushed into the read, and the sink keeps every column.
+    assert optimized["operations"][0]["parameters"] == {"filepath": sales_csv}
+    assert _run(optimized) == _run(plan)
+
+
+def test_drops_of_unread_columns_are_removed(sales_csv):
+    plan = {
+        "operations": [
+            _read(sales_csv),
+            _op("drop_columns", "sales", "narrow", columns_to_drop=["product", "quantity"]),
+            _op("rename_column", "narrow", "renamed", old_name="price", new_name="cost"),
+            _op("calculate_average", "renamed", "average", column="cost"),
+        ]
+    }
+
+    optimized, _ = optimize_plan(plan, COLUMNS)
+
+    assert optimized["operations"][0]["parameters"]["usecols"] == ["price"]
+    assert [op["operation_type"] for op in optimized["operations"]] == [
+        "read_csv",
+        "rename_column",
+        "calculate_average",
+    ]
+    assert optimized["operations"][1]["input_data_key"] == "sales"
+    assert _run(optimized) == _run(plan)
+
+
+def test_a_filter_read_by_two_steps_stays_in_the_plan(sales_csv):
+    plan = {
+        "operations": [
+            _read(sales_csv),
+            _op("filter_rows", "sales", "cheap", column="price", operator="<", value=30),
+            _op("merge_dataframes", "sales", "joined", right_data_key="cheap", on="product", how="inner"),
+        ]
+    }
+
+    optimized, explain = optimize_plan(plan, COLUMNS)
+
+    assert optimized["operations"][1]["operation_type"] == "filter_rows"
+    assert "filters" not in optimized["operations"][0]["parameters"]
+    assert explain["rewrites"] == []
+
+
+def test_mangled_duplicate_headers_are_not_projected(sales_csv):
+    plan = {"operations": [_read(sales_csv), _op("calculate_sum", "sales", "total", column="price")]}
+
+    optimized, _ = optimize_plan(plan, ["price", "price.1"])
+
+    assert "usecols" not in optimized["operations"][0]["parameters"]
+
+
+def test_plans_that_reassign_a_key_are_left_alone(sales_csv):
+    plan = {
+        "operations": [
+            _read(sales_csv),
+            _op("filter_rows", "sales", "sales", column="price", operator=">", value=10),
+        ]
+    }
+
+    optimized, explain = optimize_plan(plan, COLUMNS)
+
+    assert optimized is plan
+    assert explain["rewrites"] == ["Skipped: the plan writes the same data key more than once."]
+
+
+def test_dead_steps_are_removed_until_none_is_left(sales_csv):
+    plan = {
+        "operations": [
+            _read(sales_csv),
+            _op("filter_rows", "sales", "us", column="region", operator="==", value="US"),
+            _op("sort_column", "us", "sorted_us", column="price", order="ascending"),
+            _op("calculate_sum", "sales", "total", column="price"),
+            _op("display_data", "sales", None),
+        ]
+    }
+
+    optimized, explain = optimize_plan(plan)
+
+    assert [op["operation_type"] for op in optimized["operations"]] == [
+        "read_csv",
+        "calculate_sum",
+        "display_data",
+    ]
+    assert [rewrite.split(";")[0] for rewrite in explain["rewrites"]] == [
+        "Removed dead step sort_column -> 'sorted_us'",
+        "Removed dead step filter_rows -> 'us'",
+    ]
+    assert _run(optimized) == _run(plan) == 178
@@ -0,0 +1,79 @@
+import pandas as pd
+import pytest
+
+import parallel_csv
+from parallel_csv import partition_offsets, read_csv_parallel
+
+
+def _write(tmp_path, text: str, newline: str = "\n") -> str:
+    path = tmp_path / "data.csv"
+    path.write_bytes(text.replace("\n", newline).encode())
+    return str(path)
+
+
+def _assert_matches_read_csv(path: str, workers: int):
+    expected = pd.read_csv(path)
+    result = read_csv_parallel(path, workers=workers)
+    assert result is not None
+    pd.testing.assert_frame_equal(result, expected)
+    return result
+
+
+@pytest.fixture(autouse=True)
+def small_scan_blocks(monkeypatch):
+    # Quote state has to carry across blocks, not only within one.
+    monkeypatch.setattr(parallel_csv, "SCAN_BLOCK_SIZE", 7)
+
+
+def test_quoted_embedded_newlines(tmp_path):
+    rows = "".join(f'{i},"line one\nline two {i}",{i * 1.5}\n' for i in range(40))
+    path = _write(tmp_path, "id,note,value\n" + rows)
+    _assert_matches_read_csv(path, workers=4)
+
+
+def test_crlf_line_endings(tmp_path):
+    rows = "".join(f"{i},name {i},{i % 3}\n" for i in range(50))
+    path = _write(tmp_path, "id,name,group\n" + rows, newline="\r\n")
+    _assert_matches_read_csv(path, workers=4)
+
+
+def test_range_boundary_inside_quoted_field(tmp_path):
+    long_field = '"' + "x\n" * 200 + 'with ""escaped"" quotes"'
+    path = _write(tmp_path, f"id,note\n1,short\n2,{long_field}\n3,after\n4,\"a,b\"\n")
+    offsets = partition_offsets(path, 4)
+    # Targets inside the long field move to the record boundary after it.
+    with open(path, "rb") as f:
+        data = f.read()
+    assert all(data[offset - 1:offset] == b"\n" for offset in offsets[:-1])
+    assert offsets[-1] == len(data)
+    _assert_matches_read_csv(path, workers=4)
+
+
+def test_dtypes_inferred_differently_between_ranges(tmp_path):
+    # 'code' is numeric in the first ranges and text in the last; 'amount'
+    # is int in some ranges and float in others.
+    rows = [f"{i},{i},{i}" for i in range(60)]
+    rows += [f"{i},A{i},{i}.5" for i in range(60, 80)]
+    path = _write(tmp_path, "id,code,amount\n" + "\n".join(rows) + "\n")
+    result = _assert_matches_read_csv(path, workers=4)
+    assert result["code"].dtype == object
+    assert result["amount"].dtype == "float64"
+
+
+def test_stray_quote_falls_back_to_a_single_read(tmp_path, monkeypatch):
+    # The quote in 5" flips the quote state, so later ranges are cut inside
+    # quoted fields.
+    rows = ['1,5" screen,"a\nb"'] + [f'{i},"x\ny{i}",t' for i in range(2, 40)]
+    path = _write(tmp_path, "id,desc,note\n" + "\n".join(rows) + "\n")
+    assert read_csv_parallel(path, workers=4) is None
+    monkeypatch.setattr(parallel_csv, "PARALLEL_PARSE_WORKERS", 4)
+    monkeypatch.setattr(parallel_csv, "PARALLEL_PARSE_MIN_BYTES", 0)
+    pd.testing.assert_frame_equal(parallel_csv.parse_csv(path), pd.read_csv(path))
+
+
+def test_range_starting_mid_record_is_detected():
+    aligned = pd.DataFrame({"a": [1], "b": [2]})
+    # A record one field wider than the header makes read_csv add an index.
+    shifted = pd.DataFrame({"a": [3], "b": [4]}, index=pd.Index([9]))
+    assert not parallel_csv._misaligned([aligned, aligned])
+    assert parallel_csv._misaligned([aligned, shifted])
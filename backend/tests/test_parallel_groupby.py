@@ -0,0 +1,12 @@
+import pandas as pd
+
+from parallel_groupby import parallel_group_aggregate
+
+
+def test_signed_zero_keys_form_one_group():
+    df = pd.DataFrame({"k": [0.0, -0.0] * 50, "v": range(100)})
+    aggs = {"total": pd.NamedAgg(column="v", aggfunc="sum")}
+    result = parallel_group_aggregate(df, ["k"], aggs, workers=4)
+    expected = df.groupby(["k"], observed=True).agg(**aggs)
+    pd.testing.assert_frame_equal(result, expected)
+    assert len(result) == 1
@@ -0,0 +1,78 @@
+import io
+
+import pytest
+
+from dataset_store import DatasetStore
+from plan_validator import PlanValidationError, PlanValidator
+
+PRICES = b"item,price\na,5\nb,150\nc,unknown\nd,20\n"
+
+
+def _plan(operator: str, value):
+    return {
+        "operations": [
+            {
+                "operation_type": "read_csv",
+                "parameters": {"filepath": "prices.csv"},
+                "output_data_key": "data",
+            },
+            {
+                "operation_type": "filter_rows",
+                "input_data_key": "data",
+                "output_data_key": "filtered",
+                "parameters": {"column": "price", "operator": operator, "value": value},
+            },
+        ]
+    }
+
+
+@pytest.fixture
+def validator(tmp_path):
+    dataset = DatasetStore(root=str(tmp_path)).add(io.BytesIO(PRICES), "prices.csv")
+    return PlanValidator([dataset])
+
+
+def test_number_ordered_against_text_column_is_an_error(validator):
+    with pytest.raises(PlanValidationError) as raised:
+        validator.validate(_plan(">", 100))
+    assert "price" in raised.value.feedback()
+
+
+def test_number_matched_against_text_column_is_compared_as_text(validator):
+    plan, repairs = validator.validate(_plan("==", 150))
+    assert plan["operations"][1]["parameters"]["value"] == "150"
+    assert len(repairs) == 1
+
+
+def test_whole_float_matched_against_text_column_is_written_like_the_csv(validator):
+    plan, _ = validator.validate(_plan("==", 150.0))
+    assert plan["operations"][1]["parameters"]["value"] == "150"
+
+
+def test_missing_input_key_is_not_filled_in_after_a_branch(validator):
+    read = {
+        "operation_type": "read_csv",
+        "parameters": {"filepath": "prices.csv"},
+    }
+    plan = {
+        "operations": [
+            {**read, "output_data_key": "left"},
+            {**read, "output_data_key": "right"},
+            {
+                "operation_type": "merge_dataframes",
+                "output_data_key": "merged",
+                "parameters": {"right_data_key": "right", "on_column": "item", "how": "inner"},
+            },
+        ]
+    }
+    with pytest.raises(PlanValidationError) as raised:
+        validator.validate(plan)
+    assert "needs an input_data_key" in raised.value.feedback()
+
+
+def test_missing_input_key_is_filled_in_on_a_linear_plan(validator):
+    plan = _plan("==", "b")
+    del plan["operations"][1]["input_data_key"]
+    repaired, repairs = validator.validate(plan)
+    assert repaired["operations"][1]["input_data_key"] == "data"
+    assert repairs == ["Step 2: set the missing input_data_key to 'data'."]
@@ -0,0 +1,29 @@
+import pandas as pd
+
+from compaction import compact_frame
+from result_store import ResultStore, page_records
+
+
+def test_schema_and_pages_report_the_dtypes_before_compaction(tmp_path):
+    path = tmp_path / "sales.csv"
+    pd.DataFrame(
+        {
+            "region": ["EU", "US", "EU", "US"],
+            "price": [1.5, 2.0, 2.5, 3.0],
+            "quantity": [1, 2, 3, 4],
+            "sold": [True, False, True, True],
+        }
+    ).to_csv(path, index=False)
+    parsed = pd.read_csv(path)
+    compacted, report = compact_frame(parsed)
+    assert set(report["converted_columns"]) == {"region", "price", "quantity"}
+
+    handle = ResultStore().put(compacted)
+
+    assert handle["schema"] == [
+        {"name": column, "dtype": str(dtype)} for column, dtype in parsed.dtypes.items()
+    ]
+    assert page_records(compacted, 1, 2, ["region", "price"]) == [
+        {"region": "US", "price": 2.0},
+        {"region": "EU", "price": 2.5},
+    ]
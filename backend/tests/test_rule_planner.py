@@ -0,0 +1,38 @@
+import pandas as pd
+
+from rule_planner import RulePlanner
+
+DTYPES = {
+    "Artist": pd.api.types.pandas_dtype(object),
+    "Song": pd.api.types.pandas_dtype(object),
+    "region": pd.api.types.pandas_dtype(object),
+    "sales": pd.api.types.pandas_dtype("int64"),
+    "price": pd.api.types.pandas_dtype("float64"),
+}
+COLUMNS = list(DTYPES)
+
+
+def _plan(query: str, columns=COLUMNS):
+    return RulePlanner().plan(query, "data.csv", columns, DTYPES)
+
+
+def test_extreme_over_a_text_column_goes_to_the_llm():
+    # "songs" fuzzy-matches Song, which only a count could rank.
+    assert _plan("Which artist has the most songs?", ["Song", "sales"]) is None
+    assert _plan("Which artist has the most songs?") is None
+
+
+def test_extreme_whose_subject_is_a_column_goes_to_the_llm():
+    assert _plan("Which region has the highest sales?") is None
+
+
+def test_extreme_without_dtypes_goes_to_the_llm():
+    assert RulePlanner().plan("Which row has the highest price?", "data.csv", COLUMNS) is None
+
+
+def test_extreme_over_a_numeric_column_is_planned_locally():
+    plan = _plan("Which row has the highest price?")
+    assert plan["limit"] == 1
+    sort = plan["operations"][1]
+    assert sort["operation_type"] == "sort_column"
+    assert sort["parameters"] == {"column": "price", "order": "descending"}
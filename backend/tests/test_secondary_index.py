@@ -0,0 +1,18 @@
+import pandas as pd
+
+import secondary_index
+from secondary_index import SecondaryIndexStore
+
+
+def test_filter_counts_are_bounded(monkeypatch):
+    monkeypatch.setattr(secondary_index, "FILTER_COUNT_MAX_COLUMNS", 2)
+    store = SecondaryIndexStore(min_filters=2, min_rows=1)
+    df = pd.DataFrame({"k": [1, 2, 3]})
+    store.lookup("kept", df, "k", "==", 1)
+    for dataset_id in ("a", "b", "c"):
+        store.lookup(dataset_id, df, "k", "==", 1)
+        # Filtering a column again keeps its count from being forgotten.
+        store.lookup("kept", df, "k", "==", 1)
+    assert len(store._filter_counts) == 2
+    assert store._filter_counts[("kept", "k", "int64", 3)] == 4
+    assert store.stats()["indexes"] == 1
@@ -0,0 +1,126 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import serialization
+from result_store import ResultStore
+from serialization import arrow_chunks, columns_json_chunks, dumps, ndjson_chunks, negotiate_format
+
+
+@pytest.fixture
+def frame():
+    return pd.DataFrame(
+        {
+            "name": pd.Series(["ada", "bob", "ada", None], dtype="category"),
+            "score": np.array([1.5, np.nan, np.inf, 4.0], dtype=np.float32),
+            "count": np.array([1, 2, 3, 4], dtype=np.int8),
+        }
+    )
+
+
+EXPECTED_ROWS = [
+    {"name": "ada", "score": 1.5, "count": 1},
+    {"name": "bob", "score": None, "count": 2},
+    {"name": "ada", "score": None, "count": 3},
+    {"name": None, "score": 4.0, "count": 4},
+]
+
+
+@pytest.mark.parametrize(
+    "accept, requested, expected",
+    [
+        (None, None, "records"),
+        ("text/html", None, "records"),
+        ("application/x-ndjson", None, "ndjson"),
+        ("application/json;q=0.5, application/vnd.apache.arrow.stream", None, "arrow"),
+        ("application/x-ndjson;q=0, application/json", None, "records"),
+        ("application/x-ndjson;q=oops", None, "records"),
+        ("application/x-ndjson", "columns", "columns"),
+    ],
+)
+def test_negotiate_format(accept, requested, expected):
+    assert negotiate_format(accept, requested) == expected
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_dumps_writes_nan_and_infinity_as_null(monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(serialization, "orjson", None)
+    elif serialization.orjson is None:
+        pytest.skip("orjson is not installed")
+    value = {"values": np.array([1.0, np.nan]), "scalar": np.float64(np.inf), "when": pd.NaT}
+
+    assert json.loads(dumps(value)) == {"values": [1.0, None], "scalar": None, "when": None}
+
+
+def test_ndjson_chunks_are_whole_rows_of_expanded_values(frame):
+    chunks = list(ndjson_chunks(frame, chunk_rows=3))
+
+    assert len(chunks) == 2
+    assert all(chunk.endswith(b"\n") for chunk in chunks)
+    rows = [json.loads(line) for line in b"".join(chunks).splitlines()]
+    assert rows == EXPECTED_ROWS
+
+
+def test_columns_json_is_one_document(frame):
+    document = json.loads(b"".join(columns_json_chunks(frame, result_id="r1", total_rows=4)))
+
+    assert document["result_id"] == "r1"
+    assert document["total_rows"] == 4
+    assert [column["name"] for column in document["columns"]] == ["name", "score", "count"]
+    assert [column["dtype"] for column in document["columns"]] == ["object", "float64", "int64"]
+    assert document["columns"][1]["values"] == [1.5, None, None, 4.0]
+    assert document["columns"][0]["values"] == ["ada", "bob", "ada", None]
+
+
+def test_columns_json_without_fields(frame):
+    document = json.loads(b"".join(columns_json_chunks(frame.iloc[:, :0])))
+
+    assert document == {"columns": []}
+
+
+def test_arrow_stream_round_trips_in_batches(frame):
+    pa = pytest.importorskip("pyarrow")
+    frame = frame.assign(mixed=[1, "two", None, 4.5])
+
+    chunks = list(arrow_chunks(frame, chunk_rows=3))
+    reader = pa.ipc.open_stream(b"".join(chunks))
+    batches = list(reader)
+
+    assert [batch.num_rows for batch in batches] == [3, 1]
+    table = pa.Table.from_batches(batches)
+    assert table.column("count").type == pa.int64()
+    assert table.column("score").type == pa.float64()
+    assert table.column("mixed").to_pylist() == ["1", "two", None, "4.5"]
+
+
+def test_result_pages_in_each_format(frame, monkeypatch):
+    store = ResultStore()
+    monkeypatch.setattr(main, "result_store", store)
+    result_id = store.put(frame)["result_id"]
+    client = TestClient(main.app)
+
+    records = client.get(f"/results/{result_id}", params={"offset": 1, "limit": 2})
+    assert records.json()["rows"] == EXPECTED_ROWS[1:3]
+
+    ndjson = client.get(
+        f"/results/{result_id}",
+        params={"columns": "count"},
+        headers={"Accept": "application/x-ndjson"},
+    )
+    assert ndjson.headers["content-type"] == "application/x-ndjson"
+    assert ndjson.headers["x-total-rows"] == "4"
+    assert [json.loads(line) for line in ndjson.text.splitlines()] == [
+        {"count": count} for count in (1, 2, 3, 4)
+    ]
+
+    columns = client.get(f"/results/{result_id}", params={"format": "columns", "limit": 1})
+    assert [column["values"] for column in columns.json()["columns"]] == [["ada"], [1.5], [1]]
+
+    missing = client.get(f"/results/{result_id}", params={"columns": "name,nope"})
+    assert missing.status_code == 422
+    assert client.get("/results/unknown").status_code == 404
@@ -0,0 +1,42 @@
+import pandas as pd
+
+import manipulator
+import streaming
+from manipulator import DataProcessorAgent
+
+
+def test_streamed_filters_survive_chunks_emptied_by_an_earlier_filter(tmp_path, monkeypatch):
+    path = tmp_path / "sales.csv"
+    pd.DataFrame(
+        {
+            "region": ["EU", "EU", "US", "US", "EU", "US"],
+            "price": [5, 50, 20, 3, 40, 60],
+        }
+    ).to_csv(path, index=False)
+    monkeypatch.setattr(manipulator, "READ_CHUNK_ROWS", 2)
+    monkeypatch.setattr(streaming, "STREAMING_MEMORY_BUDGET_BYTES", 1)
+    plan = {
+        "operations": [
+            {"operation_type": "read_csv", "parameters": {"filepath": str(path)}, "output_data_key": "sales"},
+            {
+                "operation_type": "filter_rows",
+                "input_data_key": "sales",
+                "output_data_key": "us_sales",
+                "parameters": {"column": "region", "operator": "==", "value": "US"},
+            },
+            {
+                "operation_type": "filter_rows",
+                "input_data_key": "us_sales",
+                "output_data_key": "expensive",
+                "parameters": {"column": "price", "operator": ">", "value": 10},
+            },
+            {"operation_type": "display_data", "input_data_key": "expensive", "parameters": {"label": "US sales"}},
+        ]
+    }
+
+    agent = DataProcessorAgent()
+    result = agent.execute_plan(plan)
+
+    # The first chunk holds only EU rows, so the price filter sees it empty.
+    assert agent.stats["streamed_steps"] == 3
+    assert result == [{"region": "US", "price": 20}, {"region": "US", "price": 60}]
@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+
+import pandas as pd
+
+from subplan_cache import SubplanCache, subplan_keys
+
+SALES = SimpleNamespace(dataset_id="a" * 64, columns=["region", "price"])
+OTHER_SALES = SimpleNamespace(dataset_id="b" * 64, columns=["region", "price"])
+
+
+def _plan(read_key="sales", filter_key="us", value="US", description="Keep US rows."):
+    return [
+        {"operation_type": "read_csv", "parameters": {"filepath": "sales.csv"}, "output_data_key": read_key},
+        {
+            "operation_type": "filter_rows",
+            "input_data_key": read_key,
+            "output_data_key": filter_key,
+            "parameters": {"column": "region", "operator": "==", "value": value},
+            "description": description,
+        },
+        {"operation_type": "display_data", "input_data_key": filter_key, "parameters": {}},
+    ]
+
+
+def _keys(operations, dataset=SALES):
+    return subplan_keys(operations, lambda filepath: dataset)[0]
+
+
+def test_keys_ignore_data_key_names_and_descriptions():
+    renamed = _plan(read_key="data", filter_key="filtered", description="Only the US.")
+    assert _keys(_plan()) == _keys(renamed)
+    assert _keys(_plan())[2] is None
+
+
+def test_keys_change_with_parameters_and_dataset_content():
+    keys = _keys(_plan())
+    assert _keys(_plan(value="EU"))[1] != keys[1]
+    assert _keys(_plan(value="EU"))[0] == keys[0]
+    # A changed file is a new dataset id, so nothing cached for the old one is reused.
+    assert _keys(_plan(), OTHER_SALES)[0] != keys[0]
+    assert _keys(_plan(), OTHER_SALES)[1] != keys[1]
+
+
+def test_steps_over_unstored_files_have_no_key():
+    assert _keys(_plan(), None) == [None, None, None]
+
+
+def test_a_wider_cached_frame_serves_narrower_reads():
+    cache = SubplanCache(max_bytes=1024**2)
+    frame = pd.DataFrame({"region": ["EU", "US"], "price": [1, 2]})
+    cache.put("key", frame)
+    assert cache.get("key", ["price"]).columns.tolist() == ["price"]
+    assert cache.get("key", ["region", "price", "cost"]) is None
+    # A narrower result does not replace the wider one.
+    cache.put("key", frame[["price"]])
+    assert cache.get("key", ["region"]).columns.tolist() == ["region"]
+
+
+def test_results_over_the_budget_are_evicted_least_recently_used_first():
+    frame = pd.DataFrame({"price": range(100)})
+    cache = SubplanCache(max_bytes=int(frame.memory_usage(index=True, deep=True).sum()) * 2)
+    cache.put("first", frame)
+    cache.put("second", frame)
+    cache.get("first")
+    cache.put("third", frame)
+    assert cache.get("second") is None
+    assert cache.get("first") is not None and cache.get("third") is not None
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,76 @@
+import io
+
+import pandas as pd
+
+import manipulator
+from dataset_store import DatasetStore
+from manipulator import DataProcessorAgent
+from zone_maps import ZoneMapStore, build_zone_map, record_ranges, zone_can_match
+
+PRICE_OVER_45 = {"column": "price", "operator": ">", "value": 45}
+
+
+def _stored(tmp_path, text: str):
+    path = tmp_path / "upload.csv"
+    path.write_text(text)
+    with open(path, "rb") as f:
+        return DatasetStore(root=str(tmp_path / "datasets")).add(f, "sales.csv")
+
+
+def _with_zone_map(monkeypatch, dataset, chunk_rows=2):
+    store = ZoneMapStore(min_bytes=0)
+    store._maps[dataset.dataset_id] = build_zone_map(dataset.path, chunk_rows=chunk_rows)
+    monkeypatch.setattr(manipulator, "zone_maps", store)
+    return store
+
+
+def test_record_ranges_do_not_split_quoted_newlines(tmp_path):
+    path = tmp_path / "notes.csv"
+    path.write_text('id,note\n1,"a\nb"\n2,c\n3,"d\ne"\n4,f\n')
+    header_end, ranges = record_ranges(str(path), chunk_rows=2)
+    data = path.read_bytes()
+    chunks = [pd.read_csv(io.BytesIO(data[:header_end] + data[s:e])) for s, e in ranges]
+    assert [chunk["id"].tolist() for chunk in chunks] == [[1, 2], [3, 4]]
+    assert chunks[0]["note"].tolist() == ["a\nb", "c"]
+
+
+def test_zone_can_match():
+    zone = {"dtype": "int64", "nulls": 0, "distinct": 2, "min": 10, "max": 20}
+    assert not zone_can_match(zone, ">", 20)
+    assert zone_can_match(zone, ">=", 20)
+    assert not zone_can_match(zone, "==", 5)
+    assert zone_can_match(zone, "!=", 10)
+    assert not zone_can_match({**zone, "min": 10, "max": 10, "distinct": 1}, "!=", 10)
+    # A value the column cannot be compared with is left to the filter tool.
+    assert zone_can_match(zone, ">", "abc")
+    empty = {"dtype": "float64", "nulls": 2, "distinct": 0}
+    assert not zone_can_match(empty, "==", 1.5)
+    assert zone_can_match(empty, "!=", 1.5)
+
+
+def test_scan_skips_chunks_that_cannot_match(tmp_path, monkeypatch):
+    prices = [5, 10, 50, 60, 15, 20, 70, 1]
+    dataset = _stored(tmp_path, "price\n" + "\n".join(map(str, prices)) + "\n")
+    store = _with_zone_map(monkeypatch, dataset)
+    agent = DataProcessorAgent(datasets=[dataset])
+    agent.stats = {}
+
+    result = agent._scan_filtered("sales.csv", dataset.path, None, [PRICE_OVER_45], dataset)
+
+    expected = pd.read_csv(dataset.path)
+    expected = expected[expected["price"] > 45]
+    pd.testing.assert_frame_equal(result, expected)
+    assert agent.stats == {"zone_chunks_scanned": 2, "zone_chunks_skipped": 2}
+    assert store.stats()["chunks_skipped"] == 2
+
+
+def test_scan_falls_back_when_chunk_dtypes_differ(tmp_path, monkeypatch):
+    # The last chunk parses 'price' as text, so a whole-file read would too.
+    dataset = _stored(tmp_path, "price\n5\n50\n60\nunknown\n")
+    _with_zone_map(monkeypatch, dataset)
+    agent = DataProcessorAgent(datasets=[dataset])
+    agent.stats = {}
+
+    filters = [{"column": "price", "operator": "==", "value": "50"}]
+    assert agent._scan_filtered("sales.csv", dataset.path, None, filters, dataset) is None
+    assert agent.stats == {}
@@ -0,0 +1,152 @@
+# worker_pool.py
+import asyncio
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import dotenv
+
+dotenv.load_dotenv()
+
+EXECUTOR_KIND = os.environ.get("EXECUTOR_KIND", "thread")
+EXECUTOR_MAX_WORKERS = int(os.environ.get("EXECUTOR_MAX_WORKERS", os.cpu_count() or 4))
+EXECUTOR_MAX_QUEUE = int(os.environ.get("EXECUTOR_MAX_QUEUE", 16))
+EXECUTOR_TIMEOUT_SECONDS = float(os.environ.get("EXECUTOR_TIMEOUT_SECONDS", 120))
+EXECUTOR_RETRY_AFTER_SECONDS = int(os.environ.get("EXECUTOR_RETRY_AFTER_SECONDS", 5))
+DISCONNECT_POLL_SECONDS = 0.5
+
+
+class PoolSaturatedError(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__("All plan workers are busy and the queue is full.")
+        self.retry_after = retry_after
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class ClientDisconnectedError(Exception):
+    pass
+
+
+class WorkerPool:
+    """
+    Runs blocking plan executions off the event loop with a bounded number of
+    running plus queued jobs, a per-job timeout, and cancellation when the
+    client goes away.
+
+    In thread mode the job receives a ``cancel_event`` keyword argument that it
+    is expected to poll; process workers cannot be interrupted once started,
+    so only jobs that are still queued are cancelled there.
+    """
+
+    def __init__(
+        self,
+        kind: str = EXECUTOR_KIND,
+        max_workers: int = EXECUTOR_MAX_WORKERS,
+        max_queue: int = EXECUTOR_MAX_QUEUE,
+        timeout_seconds: float = EXECUTOR_TIMEOUT_SECONDS,
+        retry_after: int = EXECUTOR_RETRY_AFTER_SECONDS,
+    ):
+        if kind not in ["thread", "process"]:
+            raise ValueError(f"Unsupported EXECUTOR_KIND: {kind}. Use 'thread' or 'process'.")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout_seconds = timeout_seconds
+        self.retry_after = retry_after
+        self._executor: Optional[Executor] = None
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.cancelled = 0
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="plan-worker"
+                )
+        return self._executor
+
+    def _release(self, _future):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    async def run(
+        self,
+        func: Callable[..., Any],
+        *args,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    ) -> Any:
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PoolSaturatedError(self.retry_after)
+
+        kwargs: Dict[str, Any] = {}
+        cancel_event = None
+        if self.kind == "thread":
+            cancel_event = threading.Event()
+            kwargs["cancel_event"] = cancel_event
+        try:
+            future = self.executor.submit(func, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.in_flight += 1
+        # The slot is held until the job really finishes, not until the caller
+        # gives up on it, so abandoned work still counts against capacity.
+        future.add_done_callback(self._release)
+
+        loop = asyncio.get_running_loop()
+        waiter = asyncio.wrap_future(future)
+        deadline = loop.time() + self.timeout_seconds
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    with self._lock:
+                        self.timed_out += 1
+                    raise PoolTimeoutError(
+                        f"Plan execution exceeded {self.timeout_seconds:g} seconds."
+                    )
+                done, _ = await asyncio.wait(
+                    {waiter}, timeout=min(DISCONNECT_POLL_SECONDS, remaining)
+                )
+                if done:
+                    return waiter.result()
+                if is_disconnected is not None and await is_disconnected():
+                    with self._lock:
+                        self.cancelled += 1
+                    raise ClientDisconnectedError("Client disconnected before the plan finished.")
+        except BaseException:
+            future.cancel()
+            if cancel_event is not None:
+                cancel_event.set()
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "kind": self.kind,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "timeout_seconds": self.timeout_seconds,
+                "in_flight": self.in_flight,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "cancelled": self.cancelled,
+            }
+
+
+worker_pool = WorkerPool()
@@ -0,0 +1,295 @@
+# zone_maps.py
+import io
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import dotenv
+import numpy as np
+import pandas as pd
+
+from compaction import COMPARISONS
+from execution_trace import trace_log
+
+dotenv.load_dotenv()
+
+ZONE_MAPS_ENABLED = os.environ.get("ZONE_MAPS_ENABLED", "1").lower() in ("1", "true", "yes")
+ZONE_MAP_CHUNK_ROWS = int(os.environ.get("ZONE_MAP_CHUNK_ROWS", 100_000))
+# Smaller uploads are parsed whole or served from memory; chunks are never
+# skipped for them, so they get no zone map.
+ZONE_MAP_MIN_BYTES = int(os.environ.get("ZONE_MAP_MIN_BYTES", 64 * 1024**2))
+SCAN_BLOCK_SIZE = 16 * 1024**2
+
+
+def record_ranges(path: str, chunk_rows: int) -> Tuple[int, List[Tuple[int, int]]]:
+    """
+    The end of the header record and the byte ranges of consecutive groups of
+    chunk_rows records. Newlines inside quoted fields are not boundaries; the
+    quote parity is carried across blocks, as in partition_offsets.
+    """
+    header_end: Optional[int] = None
+    boundaries: List[int] = []
+    records = 0
+    parity = 0
+    block_start = 0
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(SCAN_BLOCK_SIZE)
+            if not block:
+                break
+            data = np.frombuffer(block, dtype=np.uint8)
+            is_newline = data == ord("\n")
+            if parity or b'"' in block:
+                # uint8 wraps at 256, which keeps the parity.
+                quotes = np.cumsum(data == ord('"'), dtype=np.uint8) + np.uint8(parity)
+                is_newline &= quotes % 2 == 0
+                parity = int(quotes[-1]) % 2
+            newlines = np.flatnonzero(is_newline) + block_start + 1
+            block_start += len(block)
+            if header_end is None and len(newlines):
+                header_end, newlines = int(newlines[0]), newlines[1:]
+            if header_end is None:
+                continue
+            # Record ends that close a group of chunk_rows records.
+            closing = np.arange(chunk_rows - 1 - records % chunk_rows, len(newlines), chunk_rows)
+            boundaries.extend(int(offset) for offset in newlines[closing])
+            records += len(newlines)
+    size = block_start
+    if header_end is None:
+        return size, []
+    if not boundaries or boundaries[-1] < size:
+        boundaries.append(size)
+    starts = [header_end] + boundaries[:-1]
+    return header_end, [(start, end) for start, end in zip(starts, boundaries) if end > start]
+
+
+def read_range(
+    path: str, header_end: int, start: int, end: int, usecols: Optional[List[str]] = None
+) -> pd.DataFrame:
+    with open(path, "rb") as f:
+        header = f.read(header_end)
+        f.seek(start)
+        body = f.read(end - start)
+    return pd.read_csv(io.BytesIO(header + body), usecols=usecols)
+
+
+def _json_scalar(value: Any) -> Any:
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def column_zone(series: pd.Series) -> Dict[str, Any]:
+    """
+    Statistics of one column of one chunk: dtype, null count, distinct count,
+    and min/max for numeric columns and all-string columns. read_csv leaves
+    dates as strings, and ISO timestamps sort as strings in time order.
+    """
+    zone: Dict[str, Any] = {
+        "dtype": str(series.dtype),
+        "nulls": int(series.isna().sum()),
+        "distinct": int(series.nunique()),
+    }
+    if series.dtype.kind in "iuf" or (
+        series.dtype == object and pd.api.types.infer_dtype(series, skipna=True) == "string"
+    ):
+        present = series.dropna()
+        if len(present):
+            zone["min"] = _json_scalar(present.min())
+            zone["max"] = _json_scalar(present.max())
+    return zone
+
+
+def build_zone_map(path: str, chunk_rows: int = ZONE_MAP_CHUNK_ROWS) -> Dict[str, Any]:
+    """Parses the file range by range and records each chunk's zones."""
+    header_end, ranges = record_ranges(path, chunk_rows)
+    chunks = []
+    row_start = 0
+    for start, end in ranges:
+        chunk = read_range(path, header_end, start, end)
+        chunks.append(
+            {
+                "start": start,
+                "end": end,
+                "row_start": row_start,
+                "rows": len(chunk),
+                "columns": {str(column): column_zone(chunk[column]) for column in chunk.columns},
+            }
+        )
+        row_start += len(chunk)
+    return {"header_end": header_end, "chunk_rows": chunk_rows, "rows": row_start, "chunks": chunks}
+
+
+def _comparable(value: Any, zone: Dict[str, Any]) -> Optional[Any]:
+    """
+    value converted as the filter tool would convert it for this chunk, or
+    None when the chunk has to be read to know (or to raise the tool's error).
+    """
+    kind = np.dtype(zone["dtype"]).kind if zone["dtype"] != "object" else "O"
+    try:
+        if kind in "iu":
+            return np.int64(value) if kind == "i" else np.uint64(value)
+        if kind == "f":
+            return np.float64(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if kind == "O" and isinstance(value, str):
+        return value
+    return None
+
+
+def zone_can_match(zone: Optional[Dict[str, Any]], operator_str: str, value: Any) -> bool:
+    """False only when no row of the chunk can satisfy column <operator_str> value."""
+    if zone is None or operator_str not in COMPARISONS:
+        return True
+    value = _comparable(value, zone)
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return True
+    if "min" not in zone:
+        # Either the dtype has no usable order, or every value is missing and
+        # missing values only satisfy !=.
+        return zone["distinct"] > 0 or zone["nulls"] == 0 or operator_str == "!="
+    low, high = zone["min"], zone["max"]
+    try:
+        if operator_str == "==":
+            return low <= value <= high
+        if operator_str == "!=":
+            return not (low == high == value and zone["nulls"] == 0)
+        if operator_str in (">", ">="):
+            return COMPARISONS[operator_str](high, value)
+        return COMPARISONS[operator_str](low, value)
+    except TypeError:
+        return True
+
+
+class ZoneMapStore:
+    """
+    Per-chunk zone maps of large stored datasets, saved as JSON next to the
+    CSV. A map is built in a background thread when the dataset is uploaded,
+    or on its first chunked scan for datasets stored before; until it exists,
+    scans read every chunk.
+    """
+
+    def __init__(self, min_bytes: int = ZONE_MAP_MIN_BYTES):
+        self.min_bytes = min_bytes
+        self._maps: Dict[str, Dict[str, Any]] = {}
+        self._building: Dict[str, threading.Thread] = {}
+        self._lock = threading.Lock()
+        self.built = 0
+        self.chunks_scanned = 0
+        self.chunks_skipped = 0
+
+    @staticmethod
+    def _path_for(dataset) -> str:
+        return os.path.splitext(dataset.path)[0] + ".zones.json"
+
+    def get(self, dataset) -> Optional[Dict[str, Any]]:
+        if not ZONE_MAPS_ENABLED:
+            return None
+        with self._lock:
+            zone_map = self._maps.get(dataset.dataset_id)
+        if zone_map is not None:
+            return zone_map
+        try:
+            with open(self._path_for(dataset)) as f:
+                zone_map = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        with self._lock:
+            self._maps[dataset.dataset_id] = zone_map
+        return zone_map
+
+    def build_in_background(self, dataset):
+        if not ZONE_MAPS_ENABLED or dataset.size_bytes < self.min_bytes:
+            return
+        with self._lock:
+            if dataset.dataset_id in self._maps or dataset.dataset_id in self._building:
+                return
+            thread = threading.Thread(target=self._build, args=(dataset,), daemon=True)
+            self._building[dataset.dataset_id] = thread
+        thread.start()
+
+    def _build(self, dataset):
+        try:
+            started = time.perf_counter()
+            zone_map = build_zone_map(dataset.path)
+            path = self._path_for(dataset)
+            with open(path + ".part", "w") as f:
+                json.dump(zone_map, f)
+            os.replace(path + ".part", path)
+            with self._lock:
+                self._maps[dataset.dataset_id] = zone_map
+                self.built += 1
+            print(
+                f"ZONE MAPS: Recorded {len(zone_map['chunks'])} chunks of '{dataset.filename}' "
+                f"in {time.perf_counter() - started:.1f}s."
+            )
+        except Exception as e:
+            print(f"ZONE MAPS: Could not build zone maps for '{dataset.filename}': {e}")
+        finally:
+            with self._lock:
+                self._building.pop(dataset.dataset_id, None)
+
+    def chunks(
+        self,
+        dataset,
+        zone_map: Dict[str, Any],
+        usecols: Optional[List[str]],
+        predicates: List[Dict[str, Any]],
+        counts: Dict[str, int],
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Parses the chunks that may hold rows passing every predicate, indexed
+        by their row numbers in the file. The first chunk is parsed even when
+        all are skipped, so callers still get the columns and dtypes.
+        """
+        chunks = zone_map["chunks"]
+        scanned = skipped = 0
+        try:
+            for position, chunk in enumerate(chunks):
+                if not all(
+                    zone_can_match(
+                        chunk["columns"].get(p.get("column")), p.get("operator", "=="), p.get("value")
+                    )
+                    for p in predicates
+                ):
+                    if scanned or position < len(chunks) - 1:
+                        skipped += 1
+                        continue
+                    chunk = chunks[0]
+                scanned += 1
+                frame = read_range(dataset.path, zone_map["header_end"], chunk["start"], chunk["end"], usecols)
+                frame.index = pd.RangeIndex(chunk["row_start"], chunk["row_start"] + len(frame))
+                yield frame
+            trace_log(f"ZONE MAPS: Skipped {skipped} of {len(chunks)} chunks.")
+        finally:
+            counts["zone_chunks_scanned"] = counts.get("zone_chunks_scanned", 0) + scanned
+            counts["zone_chunks_skipped"] = counts.get("zone_chunks_skipped", 0) + skipped
+            with self._lock:
+                self.chunks_scanned += scanned
+                self.chunks_skipped += skipped
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": int(ZONE_MAPS_ENABLED),
+                "datasets": len(self._maps),
+                "building": len(self._building),
+                "built": self.built,
+                "chunks_scanned": self.chunks_scanned,
+                "chunks_skipped": self.chunks_skipped,
+            }
+
+
+def uniform_dtypes(zone_map: Dict[str, Any], columns: List[str]) -> bool:
+    """True when every chunk parsed these columns with the same dtype."""
+    for column in columns:
+        dtypes = {chunk["columns"].get(column, {}).get("dtype") for chunk in zone_map["chunks"]}
+        if len(dtypes) > 1:
+            return False
+    return True
+
+
+zone_maps = ZoneMapStore()